@@ -0,0 +1,157 @@
+"""
+Background account deletion.
+
+delete_account deactivates the user and signs them out straight away; a
+worker thread then removes their data one step at a time. Each step deletes
+rows in chunks of ACCOUNT_DELETION_CHUNK_SIZE, one short transaction per
+chunk, and records its progress in AccountDeletion, so no single statement
+holds locks for long and the resume_account_deletions command can finish a
+deletion interrupted by a crash or deploy. Garment photos and profile
+pictures are deleted in storage batches as their rows go.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from allauth.account.models import EmailAddress
+from allauth.socialaccount.models import SocialAccount
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from .images import IMAGE_FIELDS, delete_files
+from .models import (
+    AccountDeletion, DailyOutfit, EmailVerification, Garment, LaundryItem, LLMUsage,
+    Outfit, Profile, RecommendationJob, StoredImage, WearHistory,
+)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def deletion_steps(user_id, email):
+    """(step name, queryset) in dependency order; the user row itself goes last"""
+    return [
+        ('wear_history', WearHistory.objects.filter(Q(garment__owner_id=user_id) | Q(outfit__owner_id=user_id))),
+        ('laundry_items', LaundryItem.objects.filter(garment__owner_id=user_id)),
+        ('outfit_garments', Outfit.garments.through.objects.filter(
+            Q(outfit__owner_id=user_id) | Q(garment__owner_id=user_id)
+        )),
+        ('outfits', Outfit.objects.filter(owner_id=user_id)),
+        ('daily_outfits', DailyOutfit.objects.filter(owner_id=user_id)),
+        ('recommendation_jobs', RecommendationJob.objects.filter(owner_id=user_id)),
+        ('llm_usage', LLMUsage.objects.filter(owner_id=user_id)),
+        ('garments', Garment.objects.filter(owner_id=user_id)),
+        ('social_accounts', SocialAccount.objects.filter(user_id=user_id)),
+        ('email_addresses', EmailAddress.objects.filter(user_id=user_id)),
+        ('email_verifications', EmailVerification.objects.filter(email__iexact=email) if email
+            else EmailVerification.objects.none()),
+        ('tokens', Token.objects.filter(user_id=user_id)),
+        ('profile', Profile.objects.filter(user_id=user_id)),
+    ]
+
+
+def unshared_files(model, pks):
+    """Stored names of the images (and variants) of these rows that nothing else uses"""
+    image_field, variants_field = IMAGE_FIELDS[model._meta.label]
+    rows = list(model.objects.filter(pk__in=pks).exclude(**{image_field: ''})
+                .exclude(**{f'{image_field}__isnull': True}).values_list(image_field, variants_field))
+    # Content-addressed photos are reference counted and released by the delete signals
+    shared = set(StoredImage.objects.filter(name__in=[name for name, _ in rows]).values_list('name', flat=True))
+    names = []
+    for name, variants in rows:
+        if name in shared:
+            continue
+        names.append(name)
+        names.extend(variant for key, variant in (variants or {}).items() if key != 'source')
+    return names
+
+
+def delete_in_chunks(deletion, step, queryset, chunk_size):
+    """Delete a step's rows chunk by chunk, saving the running count after each chunk"""
+    model = queryset.model
+    has_media = model._meta.label in IMAGE_FIELDS
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return
+        files = unshared_files(model, pks) if has_media else []
+        with transaction.atomic():
+            model.objects.filter(pk__in=pks).delete()
+            deletion.deleted[step] = deletion.deleted.get(step, 0) + len(pks)
+            AccountDeletion.objects.filter(pk=deletion.pk).update(
+                stage=step, deleted=deletion.deleted, updated_at=timezone.now(),
+            )
+        if files:
+            # Files left behind by a crash here are picked up by gc_media
+            storage = model._meta.get_field(IMAGE_FIELDS[model._meta.label][0]).storage
+            removed, errors = delete_files(storage, files)
+            deletion.deleted['files'] = deletion.deleted.get('files', 0) + len(removed)
+            for error in errors:
+                print(f"Account deletion {deletion.pk}: could not delete {error}")
+
+
+def run_account_deletion(deletion_id, chunk_size=None):
+    """Delete everything belonging to the user; safe to run again after a failure"""
+    chunk_size = chunk_size or getattr(settings, 'ACCOUNT_DELETION_CHUNK_SIZE', 500)
+    deletion = AccountDeletion.objects.get(pk=deletion_id)
+    if deletion.status == 'done':
+        return deletion
+    AccountDeletion.objects.filter(pk=deletion.pk).update(status='running', error='', updated_at=timezone.now())
+    try:
+        email = User.objects.filter(pk=deletion.user_id).values_list('email', flat=True).first()
+        for step, queryset in deletion_steps(deletion.user_id, email):
+            deletion.stage = step
+            delete_in_chunks(deletion, step, queryset, chunk_size)
+        with transaction.atomic():
+            deletion.deleted['user'] = User.objects.filter(pk=deletion.user_id).delete()[1].get('auth.User', 0)
+            AccountDeletion.objects.filter(pk=deletion.pk).update(
+                status='done', stage='', deleted=deletion.deleted, finished_at=timezone.now(), updated_at=timezone.now(),
+            )
+    except Exception as e:
+        print(f"Account deletion {deletion.pk} failed at {deletion.stage or 'start'}: {e}")
+        AccountDeletion.objects.filter(pk=deletion.pk).update(
+            status='failed', error=str(e), deleted=deletion.deleted, updated_at=timezone.now(),
+        )
+        raise
+    deletion.refresh_from_db()
+    return deletion
+
+
+def get_executor():
+    """Process-wide pool for deletions, created on first use"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='account-deletion')
+        return _executor
+
+
+def _run_logged(deletion_id):
+    try:
+        run_account_deletion(deletion_id)
+    except Exception:
+        # Already printed and recorded on the AccountDeletion row
+        pass
+
+
+def _run_in_background(deletion_id):
+    try:
+        _run_logged(deletion_id)
+    finally:
+        connection.close()
+
+
+def request_account_deletion(user):
+    """Deactivate and sign out the user now; delete their data once the transaction commits"""
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        for token in Token.objects.filter(user=user):
+            token.delete()
+        deletion, _ = AccountDeletion.objects.get_or_create(user_id=user.pk, defaults={'username': user.username})
+        if getattr(settings, 'ACCOUNT_DELETION_ASYNC', True):
+            transaction.on_commit(lambda: get_executor().submit(_run_in_background, deletion.pk))
+        else:
+            transaction.on_commit(lambda: _run_logged(deletion.pk))
+    return deletion
@@ -0,0 +1,52 @@
+import re
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+USERNAME_MAX_LENGTH = User._meta.get_field('username').max_length
+
+
+def find_user_by_email(email):
+    """Case-insensitive email lookup, served by the UPPER(email) index"""
+    if not email:
+        return None
+    return User.objects.filter(email__iexact=email).order_by('id').first()
+
+
+def allocate_username(base_username):
+    """
+    Return base_username, or base_username plus the lowest free numeric suffix.
+
+    All existing usernames sharing the prefix are fetched in a single
+    LIKE 'base%' query and the suffix is picked in memory.
+    """
+    base_username = (base_username or 'user')[:USERNAME_MAX_LENGTH - 6]
+    taken = set(
+        User.objects.filter(username__startswith=base_username)
+        .values_list('username', flat=True)
+    )
+    if base_username not in taken:
+        return base_username
+
+    suffix_pattern = re.compile(rf'^{re.escape(base_username)}(\d+)$')
+    used_suffixes = set()
+    for username in taken:
+        match = suffix_pattern.match(username)
+        if match:
+            used_suffixes.add(int(match.group(1)))
+
+    counter = 1
+    while counter in used_suffixes:
+        counter += 1
+    return f"{base_username}{counter}"
+
+
+def create_user_with_unique_username(base_username, max_attempts=5, **user_fields):
+    """Create a user under a free username, retrying if a concurrent signup takes it first"""
+    for attempt in range(max_attempts):
+        username = allocate_username(base_username)
+        try:
+            with transaction.atomic():
+                return User.objects.create_user(username=username, **user_fields)
+        except IntegrityError:
+            if attempt == max_attempts - 1:
+                raise
@@ -1,5 +1,5 @@
 from allauth.socialaccount.adapter import DefaultSocialAccountAdapter
-from django.contrib.auth.models import User
+from .accounts import find_user_by_email
 
 
 class CustomSocialAccountAdapter(DefaultSocialAccountAdapter):
@@ -10,10 +10,7 @@ class CustomSocialAccountAdapter(DefaultSocialAccountAdapter):
         if sociallogin.is_existing:
             return
 
-        try:
-            email = sociallogin.account.extra_data.get('email')
-            if email:
-                user = User.objects.get(email=email)
-                sociallogin.connect(request, user)
-        except User.DoesNotExist:
-            pass
+        email = sociallogin.account.extra_data.get('email')
+        user = find_user_by_email(email)
+        if user:
+            sociallogin.connect(request, user)
@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+TOKEN_CACHE_PREFIX = 'auth_token:'
+
+# Per-process backends: evicting an entry in one worker leaves it in the others
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def token_cache_ttl():
+    """Seconds to cache resolved tokens; 0 unless the cache is shared by every worker"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend in LOCAL_CACHE_BACKENDS:
+        return 0
+    return getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 300)
+
+
+def token_cache_key(key):
+    """Cache key for a resolved auth token"""
+    return f'{TOKEN_CACHE_PREFIX}{key}'
+
+
+def invalidate_token(key):
+    """Drop a single token from the auth cache"""
+    if key and token_cache_ttl():
+        cache.delete(token_cache_key(key))
+
+
+def invalidate_user_tokens(user_id):
+    """Drop every cached token that belongs to a user"""
+    if not token_cache_ttl():
+        return
+    keys = Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+def rotate_token(user):
+    """Replace the user's token with a fresh one and return it"""
+    for old_token in Token.objects.filter(user=user):
+        invalidate_token(old_token.key)
+        old_token.delete()
+    return Token.objects.create(user=user)
+
+
+def token_is_expired(token):
+    """Check if a token is older than AUTH_TOKEN_EXPIRY_HOURS (0 disables expiry)"""
+    expiry_hours = getattr(settings, 'AUTH_TOKEN_EXPIRY_HOURS', 0)
+    if not expiry_hours:
+        return False
+    return timezone.now() > token.created + timezone.timedelta(hours=expiry_hours)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that caches the resolved token, user and profile.
+
+    The token is loaded with its user and profile in a single query and kept
+    in the cache for AUTH_TOKEN_CACHE_TTL seconds, so repeated API calls and
+    UserSerializer lookups don't hit the database. Entries are invalidated
+    on logout, password changes, profile updates, account deletion and
+    token rotation (see api/signals.py). Caching only happens with a cache
+    shared by all workers (REDIS_URL); with the per-process default an
+    eviction would miss the other workers, so every request reads the
+    database instead.
+    """
+
+    def authenticate_credentials(self, key):
+        ttl = token_cache_ttl()
+        cache_key = token_cache_key(key)
+        token = cache.get(cache_key) if ttl else None
+
+        if token is None:
+            try:
+                token = Token.objects.select_related('user', 'user__profile').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            if ttl:
+                cache.set(cache_key, token, ttl)
+
+        # Expiry is checked against the cached creation time, so it costs no query
+        if token_is_expired(token):
+            invalidate_token(key)
+            token.delete()
+            raise exceptions.AuthenticationFailed('Token has expired.')
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return (token.user, token)
@@ -0,0 +1,361 @@
+"""
+Real-time change notifications for open clients.
+
+Model signals (and the bulk import/sync paths) publish compact events such
+as {"type": "garment", "id": 12, "version": 1760889600123} to the owner's
+channel once the transaction commits. The version is the object's
+updated_at in milliseconds (the publish time for objects without one), so a
+client only refetches objects newer than what it already has. An id of null
+means many objects of that type changed and the list should be reloaded;
+deletes carry "deleted": true.
+
+Clients subscribe over Server-Sent Events (/api/changes/stream/) or a
+WebSocket (/ws/changes/, routed in garmently_backend/asgi.py). Both need the
+ASGI application: each connection is a coroutine waiting on an asyncio
+queue, so thousands of idle connections cost no threads. Clients that can't
+set an Authorization header (EventSource, browser WebSockets) put a ticket
+from /api/changes/ticket/ in the URL instead of their token: it is signed,
+expires after CHANGE_STREAM_TICKET_MAX_AGE seconds and never contains the
+token itself. Every CHANGE_STREAM_REVALIDATE seconds an open stream checks
+that its token still exists and its user is active, and closes otherwise
+(logout, token rotation, deactivation). Events that arrive
+together are coalesced per object before they are sent, and a subscriber
+that falls more than CHANGE_STREAM_QUEUE_SIZE events behind gets a single
+"resync" instead.
+
+The broker is in-process by default. With CHANGE_BROKER_URL (or REDIS_URL)
+set, events go through Redis pub/sub so a change made in one worker reaches
+connections held by the others.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from .authentication import CachedTokenAuthentication
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+RESYNC = {'type': 'resync'}
+CHANNEL_PREFIX = 'garmently:changes:'
+TICKET_SALT = 'api.changes.ticket'
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def change_event(kind, obj=None, deleted=False):
+    """Event for a saved or deleted object, or for many objects of a kind (obj=None)"""
+    updated_at = getattr(obj, 'updated_at', None)
+    version = int(updated_at.timestamp() * 1000) if updated_at and not deleted else int(time.time() * 1000)
+    event = {'type': kind, 'id': obj.pk if obj is not None else None, 'version': version}
+    if deleted:
+        event['deleted'] = True
+    return event
+
+
+def publish_change(user_id, event):
+    """Send the event to the user's subscribers once the current transaction commits"""
+    if user_id is None:
+        return
+    transaction.on_commit(lambda: _publish(user_id, event))
+
+
+def publish_changes(user_id, kind, ids):
+    """Events for objects changed by bulk SQL (no signals fire for those)"""
+    version = int(time.time() * 1000)
+    for obj_id in ids:
+        publish_change(user_id, {'type': kind, 'id': obj_id, 'version': version})
+
+
+def _publish(user_id, event):
+    try:
+        get_broker().publish(user_id, event)
+    except Exception as e:
+        # A missed notification only delays a refresh; never fail the request over it
+        print(f"Change notification for user {user_id} failed: {e}")
+
+
+class Subscription:
+    """One open connection's queue of pending events"""
+
+    def __init__(self, user_id, queue_size):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.queue_size = queue_size
+        self.overflowed = False
+
+    def put(self, event):
+        """Queue an event; call on the subscription's event loop (see LocalBroker.deliver)"""
+        if self.queue.qsize() >= self.queue_size:
+            self.overflowed = True
+        else:
+            self.queue.put_nowait(event)
+
+    async def next_batch(self, timeout):
+        """Events waiting for this connection, coalesced per object; [] after `timeout` seconds of quiet"""
+        try:
+            first = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        events = {(first['type'], first.get('id')): first}
+        while not self.queue.empty():
+            event = self.queue.get_nowait()
+            events[(event['type'], event.get('id'))] = event
+        if self.overflowed:
+            self.overflowed = False
+            return [RESYNC]
+        return list(events.values())
+
+
+def _put_all(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.put(event)
+
+
+class LocalBroker:
+    """Fans events out to the subscriptions held by this process"""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id, event):
+        self.published += 1
+        self.deliver(user_id, event)
+
+    def deliver(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        # One wakeup per event loop rather than one per connection
+        by_loop = defaultdict(list)
+        for subscription in subscriptions:
+            by_loop[subscription.loop].append(subscription)
+        for loop, group in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_put_all, group, event)
+            except RuntimeError:
+                # Loop already closed; its connections are going away
+                pass
+        self.delivered += len(subscriptions)
+
+    def stats(self):
+        with self._lock:
+            connections = sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+            users = len(self._subscriptions)
+        return {'backend': type(self).__name__, 'users': users, 'connections': connections,
+                'published': self.published, 'delivered': self.delivered}
+
+
+class RedisBroker(LocalBroker):
+    """Publishes through Redis; one listener thread per process delivers to local subscriptions"""
+
+    def __init__(self, url, queue_size=100):
+        super().__init__(queue_size)
+        self.client = redis.Redis.from_url(url)
+        self._listener = None
+
+    def subscribe(self, user_id):
+        self._start_listener()
+        return super().subscribe(user_id)
+
+    def publish(self, user_id, event):
+        self.published += 1
+        self.client.publish(f'{CHANNEL_PREFIX}{user_id}', json.dumps(event))
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='change-broker', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        delay = 1
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f'{CHANNEL_PREFIX}*')
+                delay = 1
+                for message in pubsub.listen():
+                    user_id = int(message['channel'].rsplit(b':', 1)[1])
+                    self.deliver(user_id, json.loads(message['data']))
+            except Exception as e:
+                print(f"Change broker lost Redis ({e}); reconnecting in {delay}s")
+                # Whatever was published meanwhile is lost, so tell everyone to refetch
+                with self._lock:
+                    user_ids = list(self._subscriptions)
+                for user_id in user_ids:
+                    self.deliver(user_id, RESYNC)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+
+def get_broker():
+    """Process-wide broker, created on first use"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            url = getattr(settings, 'CHANGE_BROKER_URL', '')
+            queue_size = getattr(settings, 'CHANGE_STREAM_QUEUE_SIZE', 100)
+            if url and redis is None:
+                print("CHANGE_BROKER_URL is set but the redis package is missing; using the in-process broker")
+            _broker = RedisBroker(url, queue_size) if url and redis is not None else LocalBroker(queue_size)
+        return _broker
+
+
+def token_digest(key):
+    """SHA-256 of a token key; lets tickets and open streams refer to the token without holding it"""
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def issue_ticket(user_id, token_key):
+    """Signed stream ticket for the user's token, valid for CHANGE_STREAM_TICKET_MAX_AGE seconds"""
+    return signing.dumps({'user': user_id, 'token': token_digest(token_key)}, salt=TICKET_SALT)
+
+
+def token_is_current(user_id, digest):
+    """False once the token is deleted (logout, rotation) or its user deactivated"""
+    keys = Token.objects.filter(user_id=user_id, user__is_active=True).values_list('key', flat=True)
+    return any(hmac.compare_digest(token_digest(key), digest) for key in keys)
+
+
+async def authenticate(headers, query_string):
+    """(user ID, token digest) for an "Authorization: Token ..." header or a ?ticket= from
+    issue_ticket; None if neither is valid"""
+    authorization = headers.get('authorization', '')
+    token = authorization[6:].strip() if authorization.lower().startswith('token ') else ''
+    if token:
+        try:
+            user, _ = await sync_to_async(CachedTokenAuthentication().authenticate_credentials)(token)
+        except AuthenticationFailed:
+            return None
+        return user.id, token_digest(token)
+
+    ticket = (parse_qs(query_string).get('ticket') or [''])[0]
+    if not ticket:
+        return None
+    try:
+        payload = signing.loads(ticket, salt=TICKET_SALT, max_age=getattr(settings, 'CHANGE_STREAM_TICKET_MAX_AGE', 60))
+    except signing.BadSignature:
+        # Expired tickets included
+        return None
+    if not await sync_to_async(token_is_current)(payload['user'], payload['token']):
+        return None
+    return payload['user'], payload['token']
+
+
+class TokenCheck:
+    """Re-checks an open stream's token at most every CHANGE_STREAM_REVALIDATE seconds"""
+
+    def __init__(self, user_id, digest):
+        self.user_id = user_id
+        self.digest = digest
+        self.interval = getattr(settings, 'CHANGE_STREAM_REVALIDATE', 60)
+        self.checked_at = time.monotonic()
+
+    async def still_valid(self):
+        if time.monotonic() - self.checked_at < self.interval:
+            return True
+        self.checked_at = time.monotonic()
+        return await sync_to_async(token_is_current)(self.user_id, self.digest)
+
+
+async def change_batches(user_id, digest):
+    """Lists of events for the user as they happen ([] for a keepalive); ends when the token is
+    no longer valid and unsubscribes when closed"""
+    broker = get_broker()
+    keepalive = getattr(settings, 'CHANGE_STREAM_KEEPALIVE', 15)
+    check = TokenCheck(user_id, digest)
+    subscription = broker.subscribe(user_id)
+    try:
+        while True:
+            batch = await subscription.next_batch(keepalive)
+            if not await check.still_valid():
+                return
+            yield batch
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def sse_changes(user_id, digest):
+    """Server-Sent Events stream of the user's changes"""
+    yield f"retry: 3000\nevent: ready\ndata: {json.dumps({'time': int(time.time() * 1000)})}\n\n"
+    async for events in change_batches(user_id, digest):
+        if not events:
+            yield ": keepalive\n\n"
+        for event in events:
+            name = 'resync' if event['type'] == 'resync' else 'change'
+            yield f"event: {name}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+    # Tells the client to sign in again rather than reconnect with the same ticket
+    yield "event: unauthorized\ndata: {}\n\n"
+
+
+async def websocket_changes(scope, receive, send):
+    """Raw ASGI WebSocket endpoint: one JSON text frame per batch of events"""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope.get('headers', [])}
+    credentials = await authenticate(headers, scope.get('query_string', b'').decode())
+    if credentials is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+    await send({'type': 'websocket.accept'})
+    await send({'type': 'websocket.send', 'text': json.dumps({'type': 'ready', 'time': int(time.time() * 1000)})})
+
+    broker = get_broker()
+    keepalive = getattr(settings, 'CHANGE_STREAM_KEEPALIVE', 15)
+    check = TokenCheck(*credentials)
+    subscription = broker.subscribe(credentials[0])
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        while True:
+            batch = asyncio.ensure_future(subscription.next_batch(keepalive))
+            done, _ = await asyncio.wait({batch, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                batch.cancel()
+                return
+            if not await check.still_valid():
+                await send({'type': 'websocket.close', 'code': 4401})
+                return
+            # An empty list doubles as a keepalive frame
+            await send({'type': 'websocket.send', 'text': json.dumps(batch.result(), separators=(',', ':'))})
+    finally:
+        disconnect.cancel()
+        broker.unsubscribe(subscription)
+
+
+async def _wait_for_disconnect(receive):
+    # Clients don't send anything meaningful; read until they go away
+    while (await receive())['type'] != 'websocket.disconnect':
+        pass
@@ -0,0 +1,67 @@
+"""
+Outfit of the day, computed with the local scoring engine.
+
+The precompute_daily_outfits command fills DailyOutfit rows for every
+active user overnight, so the morning peak reads one precomputed row
+instead of scoring wardrobes on demand. Users without a row are scored on
+first request.
+"""
+from itertools import groupby
+from .models import DailyOutfit, Garment
+from .scoring import WardrobeArrays, local_recommendations
+
+DAILY_THEME = 'everyday'
+DEFAULT_WEATHER = 'moderate'
+MAX_WEATHER_LENGTH = DailyOutfit._meta.get_field('weather').max_length
+
+
+def daily_seed(user_id, date):
+    """Stable seed so a user's outfit of the day doesn't change when recomputed"""
+    return user_id * 1000003 + date.toordinal()
+
+
+def compute_daily_outfits(user_ids, date, weather):
+    """Score outfits for a batch of users with one garment query; returns unsaved rows"""
+    rows = (
+        Garment.objects.filter(owner_id__in=user_ids, status='clean')
+        .order_by('owner_id')
+        .values_list('owner_id', *WardrobeArrays.FIELDS)
+    )
+    daily_outfits = []
+    for owner_id, garments in groupby(rows.iterator(chunk_size=5000), key=lambda row: row[0]):
+        wardrobe = WardrobeArrays([row[1:] for row in garments], today=date)
+        daily_outfits.append(DailyOutfit(
+            owner_id=owner_id,
+            date=date,
+            weather=weather,
+            result=local_recommendations(wardrobe, DAILY_THEME, weather, k=1, seed=daily_seed(owner_id, date)),
+        ))
+    return daily_outfits
+
+
+def save_daily_outfits(daily_outfits):
+    """Insert rows in bulk, replacing any existing row for the same user and date"""
+    return DailyOutfit.objects.bulk_create(
+        daily_outfits,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['owner', 'date'],
+        update_fields=['weather', 'result', 'computed_at'],
+    )
+
+
+def get_daily_outfit(user, date, weather=None):
+    """
+    Return (DailyOutfit, precomputed).
+
+    The stored row is used when no weather is given or it was computed for
+    the same weather; otherwise the outfit is computed now and replaces it.
+    """
+    daily_outfit = DailyOutfit.objects.filter(owner=user, date=date).first()
+    if daily_outfit is not None and (not weather or daily_outfit.weather == weather):
+        return daily_outfit, True
+    computed = compute_daily_outfits([user.id], date, weather or DEFAULT_WEATHER)
+    if not computed:
+        return None, False
+    save_daily_outfits(computed)
+    return computed[0], False
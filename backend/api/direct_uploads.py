@@ -0,0 +1,131 @@
+"""
+Direct-to-S3 garment photo uploads.
+
+Instead of streaming the photo through a Django worker, the client asks for
+a presigned POST, uploads the file straight to the bucket, then confirms the
+key. The POST policy limits the size and content type; confirming only costs
+a HEAD request before the key is attached to the garment, which also starts
+the usual variant rendering (see api/images.py). Only available when media
+is stored on S3 (USE_S3).
+
+A confirmed key gets a StoredImage row like any other garment photo, so
+replacing the photo or deleting the garment releases the object and its
+variants. The row can only be created once per key, which stops one upload
+from being attached to several garments. Its sha256 is derived from the key
+rather than the bytes, which the web worker never reads.
+"""
+import hashlib
+import uuid
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from .models import StoredImage
+
+# Accepted photo types -> extension of the stored key
+UPLOAD_CONTENT_TYPES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/heic': '.heic',
+    'image/gif': '.gif',
+}
+
+
+class DirectUploadError(Exception):
+    """Raised when an upload can't be issued or confirmed; the message is safe to show"""
+
+
+def direct_uploads_enabled():
+    return getattr(settings, 'USE_S3', False)
+
+
+def max_upload_bytes():
+    return getattr(settings, 'DIRECT_UPLOAD_MAX_BYTES', 15 * 1024 * 1024)
+
+
+def user_prefix(user_id):
+    return f'garments/{user_id}/'
+
+
+def s3_client():
+    # Reuse the storage backend's session so endpoint, region and credentials match
+    return default_storage.connection.meta.client
+
+
+def create_upload(user_id, content_type, size=None):
+    """Presigned POST for one garment photo: {'url', 'fields', 'key', 'max_bytes', 'expires_in'}"""
+    if not direct_uploads_enabled():
+        raise DirectUploadError('Direct uploads require S3 storage')
+    extension = UPLOAD_CONTENT_TYPES.get(content_type)
+    if extension is None:
+        raise DirectUploadError(f"content_type must be one of: {', '.join(UPLOAD_CONTENT_TYPES)}")
+    limit = max_upload_bytes()
+    if size is not None and not 0 < size <= limit:
+        raise DirectUploadError(f'size must be between 1 and {limit} bytes')
+
+    key = f'{user_prefix(user_id)}{uuid.uuid4().hex}{extension}'
+    fields = {'Content-Type': content_type}
+    conditions = [
+        ['content-length-range', 1, limit],
+        {'Content-Type': content_type},
+    ]
+    cache_control = getattr(settings, 'AWS_S3_OBJECT_PARAMETERS', {}).get('CacheControl')
+    if cache_control:
+        fields['Cache-Control'] = cache_control
+        conditions.append({'Cache-Control': cache_control})
+
+    expires_in = getattr(settings, 'DIRECT_UPLOAD_EXPIRY', 300)
+    post = s3_client().generate_presigned_post(
+        Bucket=default_storage.bucket_name,
+        Key=key,
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=expires_in,
+    )
+    return {
+        'url': post['url'],
+        'fields': post['fields'],
+        'key': key,
+        'max_bytes': limit,
+        'expires_in': expires_in,
+    }
+
+
+def check_upload(user_id, key):
+    """HEAD an uploaded key and make sure it is a photo this user was allowed to upload"""
+    if not direct_uploads_enabled():
+        raise DirectUploadError('Direct uploads require S3 storage')
+    key = str(key or '')
+    if not key.startswith(user_prefix(user_id)) or '..' in key:
+        raise DirectUploadError('key was not issued to this user')
+    try:
+        head = s3_client().head_object(Bucket=default_storage.bucket_name, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            raise DirectUploadError('Upload not found; upload the file before confirming it')
+        raise
+    if head.get('ContentType') not in UPLOAD_CONTENT_TYPES:
+        raise DirectUploadError('Uploaded file is not a supported image type')
+    if not 0 < head.get('ContentLength', 0) <= max_upload_bytes():
+        raise DirectUploadError('Uploaded file is too large')
+    return head
+
+
+def upload_digest(key):
+    """Stand-in for the content hash of a direct upload's StoredImage row; unique per key"""
+    return hashlib.sha256(f'direct-upload:{key}'.encode()).hexdigest()
+
+
+def attach_upload(garment, key):
+    """Point the garment's image at a confirmed key (saving it schedules variant rendering)"""
+    head = check_upload(garment.owner_id, key)
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                StoredImage.objects.create(sha256=upload_digest(key), name=key, size=head['ContentLength'], ref_count=1)
+        except IntegrityError:
+            raise DirectUploadError('This upload is already attached to a garment')
+        garment.image.name = key
+        garment.save(update_fields=['image', 'updated_at'])
+    return garment
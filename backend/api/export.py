@@ -0,0 +1,155 @@
+"""
+Streaming wardrobe export.
+
+export_lines() yields the user's data as NDJSON, one {"type", "data"}
+record per line: an export header, then garments, outfits (with their
+garment IDs), wear history and laundry. Rows are read with
+iterator(chunk_size=...) and outfit-garment links are merged in by a sorted
+walk over the link table, so memory stays flat however large the wardrobe.
+zip_chunks() wraps the same lines in a zip archive, followed by the photos
+streamed from the storage backend a chunk at a time.
+"""
+import json
+import zipfile
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from .models import Garment, LaundryItem, Outfit, WearHistory
+
+EXPORT_VERSION = 1
+CHUNK_SIZE = 500
+
+GARMENT_FIELDS = [
+    'id', 'name', 'description', 'category__name', 'color', 'size', 'brand', 'price', 'image',
+    'season', 'material', 'care_instructions', 'status', 'is_favorite', 'times_worn', 'last_worn',
+    'purchase_date', 'created_at', 'updated_at',
+]
+OUTFIT_FIELDS = [
+    'id', 'name', 'occasion', 'season', 'notes', 'layout', 'rating', 'is_favorite', 'times_worn',
+    'last_worn', 'weather', 'date', 'is_planned', 'created_at', 'updated_at',
+]
+WEAR_HISTORY_FIELDS = ['id', 'garment_id', 'outfit_id', 'date_worn', 'occasion', 'weather', 'rating', 'notes']
+LAUNDRY_FIELDS = ['id', 'garment_id', 'wash_date', 'estimated_completion', 'is_completed', 'completion_date', 'notes']
+
+# Folder in the zip archive holding garment photos, under their storage names
+IMAGES_DIR = 'images/'
+
+
+def record(record_type, data):
+    return (json.dumps({'type': record_type, 'data': data}, cls=DjangoJSONEncoder) + '\n').encode()
+
+
+def outfits_with_garments(user):
+    """Outfit rows with a garment_ids list, merging two ID-ordered streams"""
+    links = (
+        Outfit.garments.through.objects.filter(outfit__owner=user)
+        .order_by('outfit_id', 'garment_id').values_list('outfit_id', 'garment_id')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    link = next(links, None)
+    outfits = Outfit.objects.filter(owner=user).order_by('id').values(*OUTFIT_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+    for outfit in outfits:
+        garment_ids = []
+        while link is not None and link[0] <= outfit['id']:
+            if link[0] == outfit['id']:
+                garment_ids.append(link[1])
+            link = next(links, None)
+        outfit['garment_ids'] = garment_ids
+        yield outfit
+
+
+def export_lines(user):
+    """The user's wardrobe as NDJSON lines (bytes)"""
+    yield record('export', {
+        'version': EXPORT_VERSION,
+        'exported_at': timezone.now(),
+        'user': {'id': user.id, 'username': user.username, 'email': user.email},
+    })
+    garments = Garment.objects.filter(owner=user).order_by('id').values(*GARMENT_FIELDS)
+    for garment in garments.iterator(chunk_size=CHUNK_SIZE):
+        garment['category'] = garment.pop('category__name')
+        yield record('garment', garment)
+    for outfit in outfits_with_garments(user):
+        yield record('outfit', outfit)
+    wear_history = (
+        WearHistory.objects.filter(Q(garment__owner=user) | Q(outfit__owner=user))
+        .order_by('id').values(*WEAR_HISTORY_FIELDS)
+    )
+    for row in wear_history.iterator(chunk_size=CHUNK_SIZE):
+        yield record('wear_history', row)
+    laundry = LaundryItem.objects.filter(garment__owner=user).order_by('id').values(*LAUNDRY_FIELDS)
+    for row in laundry.iterator(chunk_size=CHUNK_SIZE):
+        yield record('laundry', row)
+
+
+def buffered(chunks, size=64 * 1024):
+    """Group small chunks (NDJSON lines) into writes of about `size` bytes"""
+    parts, length = [], 0
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield b''.join(parts)
+            parts, length = [], 0
+    if parts:
+        yield b''.join(parts)
+
+
+class ZipSink:
+    """Write-only file for ZipFile that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self._parts:
+            data = b''.join(self._parts)
+            self._parts = []
+            yield data
+
+
+def zip_chunks(user):
+    """A zip archive of wardrobe.ndjson plus every garment photo, as a stream of bytes"""
+    sink = ZipSink()
+    # A sink without seek() makes ZipFile write data descriptors instead of
+    # going back to patch sizes, so nothing needs to be buffered
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+        with archive.open('wardrobe.ndjson', 'w', force_zip64=True) as entry:
+            for line in export_lines(user):
+                entry.write(line)
+                yield from sink.drain()
+
+        storage = Garment._meta.get_field('image').storage
+        names = (
+            Garment.objects.filter(owner=user).exclude(image='').exclude(image__isnull=True)
+            .order_by('image').values_list('image', flat=True).distinct()
+        )
+        for name in names.iterator(chunk_size=CHUNK_SIZE):
+            info = zipfile.ZipInfo(IMAGES_DIR + name, date_time=timezone.localtime().timetuple()[:6])
+            # Photos are already compressed
+            info.compress_type = zipfile.ZIP_STORED
+            try:
+                source = storage.open(name, 'rb')
+            except Exception as e:
+                print(f"Export of {user.id}: skipping missing photo {name}: {e}")
+                continue
+            with source, archive.open(info, 'w', force_zip64=True) as entry:
+                for chunk in source.chunks():
+                    entry.write(chunk)
+                    yield from sink.drain()
+    yield from sink.drain()
+
+
+async def async_chunks(chunks):
+    """Serve a sync generator from an async response, one chunk per thread hop (ASGI buffers sync iterators)"""
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
@@ -0,0 +1,155 @@
+"""
+Minimal stand-in for the OpenAI chat completions API.
+
+Point the backend at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 and
+any OPENAI_API_KEY to exercise the recommendation code paths locally without
+network access or cost. Responses pick garment IDs out of the prompt, so
+they reference real garments. GET /stats returns how many completions were
+served.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Garment rows in the prompt table start with "<id>|"
+GARMENT_ID_PATTERN = re.compile(r'^(\d+)\|', re.MULTILINE)
+
+
+def fake_recommendations(prompt):
+    """Build three outfits from the garment IDs mentioned in the prompt"""
+    garment_ids = [int(value) for value in GARMENT_ID_PATTERN.findall(prompt)]
+    outfits = []
+    for i in range(3):
+        outfits.append({
+            "name": f"Fake Look {i+1}",
+            "garment_ids": garment_ids[i::3][:4],
+            "reasoning": "Served by the fake OpenAI server",
+            "style_tip": "Swap in the real API for actual styling advice",
+        })
+    return {"outfits": outfits}
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, request, content, usage, chunk_size=16):
+        """Send content as chat.completion.chunk SSE events, like the real streaming API"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for start in range(0, len(content), chunk_size):
+            chunk = {
+                'id': f'chatcmpl-fake-{self.server.call_count}',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': request.get('model', 'gpt-4o-mini'),
+                'choices': [{
+                    'index': 0,
+                    'delta': {'content': content[start:start + chunk_size]},
+                    'finish_reason': None,
+                }],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            if self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+        if (request.get('stream_options') or {}).get('include_usage'):
+            # Like the real API: a final chunk with no choices carries the usage
+            chunk = {
+                'id': f'chatcmpl-fake-{self.server.call_count}',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': request.get('model', 'gpt-4o-mini'),
+                'choices': [],
+                'usage': usage,
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self._send_json({'calls': self.server.call_count})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json({'error': {'message': 'not found'}}, status=404)
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        self.server.record_call()
+
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if self.server.fail:
+            self._send_json({'error': {'message': 'fake upstream failure', 'type': 'server_error'}}, status=500)
+            return
+
+        prompt = '\n'.join(str(m.get('content', '')) for m in request.get('messages', []))
+        content = json.dumps(fake_recommendations(prompt))
+        usage = {
+            'prompt_tokens': len(prompt) // 4,
+            'completion_tokens': len(content) // 4,
+            'total_tokens': (len(prompt) + len(content)) // 4,
+        }
+        if request.get('stream'):
+            self._send_stream(request, content, usage)
+            return
+        self._send_json({
+            'id': f'chatcmpl-fake-{self.server.call_count}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'gpt-4o-mini'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': usage,
+        })
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """Threaded fake server that counts completions; use start()/stop() from code"""
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0, fail=False, chunk_delay=0.0):
+        super().__init__((host, port), FakeOpenAIHandler)
+        self.delay = delay
+        self.chunk_delay = chunk_delay
+        self.fail = fail
+        self.call_count = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def record_call(self):
+        with self._count_lock:
+            self.call_count += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
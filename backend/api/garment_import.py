@@ -0,0 +1,238 @@
+"""
+Bulk garment import from CSV or NDJSON.
+
+Rows are parsed one at a time from the uploaded file, validated with
+GarmentImportSerializer (GarmentSerializer's rules, with categories matched
+by name from a single preloaded lookup) and inserted with bulk_create in
+batches of IMPORT_BATCH_SIZE. A row's "image" column can name a photo in a
+zip archive uploaded alongside; members are read one at a time straight
+into content-addressed storage, never extracted as a whole, and the sizes
+the zip declares are capped before anything is decompressed. An export zip
+from /api/export/?mode=zip can be imported as it is. A row whose photo
+isn't in the zip (or was uploaded without one, as with a bare NDJSON
+export) is imported without it and listed under warnings. Invalid rows are
+skipped and reported by row number; if the file turns out to be unreadable
+after some batches were saved, the report says where the import stopped.
+"""
+import csv
+import io
+import json
+import os
+import time
+import zipfile
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from .changes import change_event, publish_change
+from .export import IMAGES_DIR
+from .image_dedup import acquire_image, delete_stored_files
+from .images import schedule_refresh
+from .models import Category, Garment
+from .serializers import GarmentImportSerializer
+from .theme_index import theme_index
+
+IMPORT_BATCH_SIZE = 500
+
+# Row errors and warnings listed in the report (the rest are only counted)
+MAX_REPORTED_ERRORS = 200
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.heic', '.gif')
+
+
+class GarmentImportError(Exception):
+    """Raised when the file as a whole can't be imported; the message is safe to show"""
+
+
+def plain_errors(detail):
+    """ValidationError.detail as plain strings"""
+    if isinstance(detail, dict):
+        return {field: plain_errors(value) for field, value in detail.items()}
+    if isinstance(detail, list):
+        return [plain_errors(value) for value in detail]
+    return str(detail)
+
+
+def csv_rows(binary_file):
+    """(row, None) per CSV line, keyed by lowercased header; blank cells are left out"""
+    text = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+    try:
+        for row in csv.DictReader(text):
+            yield {
+                key.strip().lower(): value.strip()
+                for key, value in row.items()
+                if key and isinstance(value, str) and value.strip()
+            }, None
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise GarmentImportError(f'Could not read the CSV file: {e}')
+    finally:
+        text.detach()
+
+
+def ndjson_rows(binary_file):
+    """(row, None) per garment object; export files' other record types are skipped"""
+    for line in binary_file:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield None, {'non_field_errors': [f'Invalid JSON: {e}']}
+            continue
+        if not isinstance(row, dict):
+            yield None, {'non_field_errors': ['Each line must be a JSON object']}
+            continue
+        if 'type' in row and 'data' in row:
+            if row['type'] != 'garment':
+                continue
+            row = row['data']
+        yield row, None
+
+
+def open_rows(file, filename):
+    """(rows, images archive) for an uploaded CSV, NDJSON or export zip"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        return csv_rows(file), None
+    if extension in ('.ndjson', '.jsonl', '.json'):
+        return ndjson_rows(file), None
+    if extension == '.zip':
+        archive = open_archive(file)
+        names = archive.namelist()
+        data_name = 'wardrobe.ndjson' if 'wardrobe.ndjson' in names else next(
+            (name for name in names if name.lower().endswith(('.ndjson', '.jsonl', '.csv'))), None
+        )
+        if data_name is None:
+            raise GarmentImportError('The zip has no wardrobe.ndjson or CSV file')
+        member = archive.open(data_name)
+        rows = csv_rows(member) if data_name.lower().endswith('.csv') else ndjson_rows(member)
+        return rows, archive
+    raise GarmentImportError('Upload a .csv, .ndjson or .zip file')
+
+
+def open_archive(file):
+    try:
+        # Only the central directory is read; members are opened as rows need them
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile:
+        raise GarmentImportError('The images file is not a valid zip archive')
+    # Reads stop at each member's declared size, so capping the declared sizes caps decompression
+    limit = getattr(settings, 'GARMENT_IMPORT_MAX_ZIP_BYTES', 2 * 1024 * 1024 * 1024)
+    if sum(member.file_size for member in archive.infolist()) > limit:
+        raise GarmentImportError(f'The zip expands to more than {limit // (1024 * 1024)} MB')
+    return archive
+
+
+def find_member(archive, image):
+    """Zip member for a row's image column: its path, or under images/ as in exports"""
+    if archive is None:
+        return None
+    for name in (image, IMAGES_DIR + image):
+        try:
+            return archive.getinfo(name)
+        except KeyError:
+            continue
+    return None
+
+
+def read_rows(rows, report):
+    """(number, (row, errors)) pairs; a file that breaks partway ends the import instead of failing it"""
+    number = 0
+    try:
+        for number, row in enumerate(rows, 1):
+            yield number, row
+    except GarmentImportError as e:
+        if not number:
+            raise
+        # Rows before this one are (or will be) saved, so report them rather than a bare error
+        report['truncated'] = f'Stopped at row {number + 1}: {e}'
+
+
+def import_garments(user, file, filename, images=None, dry_run=False):
+    """Import garments for the user; returns a report of rows, created garments, row errors and warnings"""
+    started = time.perf_counter()
+    rows, archive = open_rows(file, filename)
+    if archive is None and images is not None:
+        archive = open_archive(images)
+    max_rows = getattr(settings, 'GARMENT_IMPORT_MAX_ROWS', 20000)
+    max_photo_bytes = getattr(settings, 'GARMENT_IMPORT_MAX_PHOTO_BYTES', 15 * 1024 * 1024)
+
+    categories = {category.name.lower(): category for category in Category.objects.all()}
+    # One serializer validates every row; field setup happens once
+    serializer = GarmentImportSerializer(context={'categories': categories})
+    storage = Garment._meta.get_field('image').storage
+    report = {
+        'rows': 0, 'created': 0, 'failed': 0, 'images': 0, 'errors': [], 'warnings': [], 'dry_run': dry_run,
+    }
+    batch = []
+
+    def flush():
+        if not dry_run:
+            acquired = []
+            try:
+                with transaction.atomic():
+                    for garment, member in batch:
+                        if member is not None:
+                            with archive.open(member) as source:
+                                photo = File(source, name=os.path.basename(member.filename))
+                                photo.size = member.file_size
+                                acquired.append(acquire_image(photo, member.filename, storage))
+                                garment.image = acquired[-1]
+                    Garment.objects.bulk_create([garment for garment, _ in batch])
+                    for garment, member in batch:
+                        if member is not None:
+                            schedule_refresh('api.Garment', garment.pk)
+            except Exception:
+                # The rollback undid the reference counts; delete the files it left without a row
+                for name in acquired:
+                    delete_stored_files(storage, name, {})
+                raise
+        report['created'] += len(batch)
+        report['images'] += sum(member is not None for _, member in batch)
+        batch.clear()
+
+    for number, (row, errors) in read_rows(rows, report):
+        if number > max_rows:
+            # Earlier batches are already saved; say where the import stopped
+            report['truncated'] = f'Stopped after {max_rows} rows; import the rest separately'
+            break
+        report['rows'] = number
+        member = None
+        if errors is None:
+            try:
+                validated = serializer.run_validation(row)
+            except ValidationError as e:
+                errors = plain_errors(e.detail)
+        if errors is None and row.get('image'):
+            image = str(row['image'])
+            member = find_member(archive, image)
+            if member is None:
+                # The garment is still worth having; the photo can be added later
+                missing = 'no images zip was uploaded' if archive is None else 'it is not in the images zip'
+                if len(report['warnings']) < MAX_REPORTED_ERRORS:
+                    report['warnings'].append({
+                        'row': number, 'warnings': {'image': [f'"{image}" was skipped: {missing}']},
+                    })
+            elif not member.filename.lower().endswith(IMAGE_EXTENSIONS):
+                errors = {'image': [f'"{image}" is not a supported image type']}
+            elif member.file_size > max_photo_bytes:
+                errors = {'image': [f'"{image}" is larger than {max_photo_bytes // (1024 * 1024)} MB']}
+        if errors is not None:
+            report['failed'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'row': number, 'errors': errors})
+            continue
+
+        batch.append((Garment(owner=user, **validated), member))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+
+    if report['created'] and not dry_run:
+        theme_index.forget_user(user.id)
+        # One "reload the list" event rather than one per imported garment
+        publish_change(user.id, change_event('garment'))
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    return report
@@ -0,0 +1,140 @@
+"""
+Idempotency-Key support for mutating API calls.
+
+A client that may retry a POST (after a timeout, say) sends the same
+Idempotency-Key header with each attempt. The first attempt claims the key
+and runs the view; its response is stored in IdempotencyKey in the same
+transaction as the view's writes, so the two commit together. Retries with
+the same key and body get the stored response back without running the
+view again, marked with Idempotent-Replayed: true. A key reused with a
+different body is rejected, and a retry that arrives while the first
+attempt is still running gets 409. Keys are scoped per user and stored
+under KEY_PREFIX, apart from offline sync's "op:<op_id>" rows in the same
+table; they expire after IDEMPOTENCY_KEY_TTL_HOURS and are removed by
+purge_idempotency_keys.
+"""
+import functools
+import hashlib
+import json
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.http import QueryDict
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.request import Request
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+# Header keys live alongside offline sync's op keys, so they get a namespace of their own
+KEY_PREFIX = 'header:'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length - len(KEY_PREFIX)
+
+
+def _plain(value):
+    if isinstance(value, UploadedFile):
+        return [value.name, value.size]
+    return str(value)
+
+
+def request_fingerprint(request):
+    """SHA-256 of the method, path and parsed body; a retry of the same call gives the same value"""
+    data = request.data
+    if isinstance(data, QueryDict):
+        data = {key: data.getlist(key) for key in data}
+    payload = json.dumps([request.method, request.get_full_path(), data], sort_keys=True, default=_plain)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def claim(user_id, key, fingerprint):
+    """(row, created): a new pending row for the key, or the live row another attempt already made"""
+    now = timezone.now()
+    ttl = timezone.timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    pending_timeout = timezone.timedelta(seconds=getattr(settings, 'IDEMPOTENCY_PENDING_TIMEOUT', 60))
+    for _ in range(3):
+        try:
+            with transaction.atomic():
+                row = IdempotencyKey.objects.create(
+                    user_id=user_id, key=key, fingerprint=fingerprint, expires_at=now + ttl,
+                )
+            return row, True
+        except IntegrityError:
+            pass
+        row = IdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+        if row is None:
+            continue
+        # Expired rows not purged yet, and claims left by a worker that died mid-request, are taken over
+        abandoned = row.status_code is None and row.created_at <= now - pending_timeout
+        if row.expires_at > now and not abandoned:
+            return row, False
+        IdempotencyKey.objects.filter(pk=row.pk).delete()
+    raise IntegrityError(f'Could not claim idempotency key {key!r}')
+
+
+def replay(row, fingerprint):
+    """Response for a retry that found an existing row"""
+    if row.fingerprint != fingerprint:
+        return Response({'error': f'{HEADER} was already used for a different request'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if row.status_code is None:
+        response = Response({'error': 'A request with this Idempotency-Key is still in progress'},
+                            status=status.HTTP_409_CONFLICT)
+        response['Retry-After'] = '1'
+        return response
+    response = Response(row.response, status=row.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """Decorator for API view functions and viewset methods: honour the Idempotency-Key header.
+
+    Requests without the header, read-only requests and anonymous requests
+    run as usual. Responses the view returns below 500, 4xx included, are
+    stored and replayed. A 5xx response or any exception raised by the view
+    releases the key so the client can retry for real; that includes DRF's
+    4xx exceptions (ValidationError, NotFound...), which are rendered after
+    the decorator has returned.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        request = next(arg for arg in args if isinstance(arg, Request))
+        key = request.headers.get(HEADER, '').strip()
+        if not key or request.method in SAFE_METHODS or not request.user.is_authenticated:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        row, created = claim(request.user.id, KEY_PREFIX + key, fingerprint)
+        if not created:
+            return replay(row, fingerprint)
+
+        try:
+            with transaction.atomic():
+                response = view(*args, **kwargs)
+                if response.status_code < 500:
+                    IdempotencyKey.objects.filter(pk=row.pk).update(
+                        status_code=response.status_code, response=getattr(response, 'data', None),
+                    )
+                    return response
+        except Exception:
+            IdempotencyKey.objects.filter(pk=row.pk).delete()
+            raise
+        IdempotencyKey.objects.filter(pk=row.pk).delete()
+        return response
+    return wrapper
+
+
+def purge_expired(batch_size=1000):
+    """Delete expired keys in batches; returns how many were deleted"""
+    deleted = 0
+    while True:
+        pks = list(IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+                   .values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=pks).delete()[0]
@@ -0,0 +1,198 @@
+"""
+Content-addressed storage of garment photos.
+
+Uploads are hashed (SHA-256) chunk by chunk as they stream in through the
+upload handlers below. A garment photo is stored once per distinct content
+as garments/<sha256>.<ext>, with a StoredImage row that counts how many
+garments point at it; re-uploading the same photo only bumps the count, and
+the file (with its shared variants) is deleted when the last garment lets
+go of it. An optional 64-bit difference hash of each stored photo lets the
+duplicates endpoint flag garments that show nearly the same picture. The
+dedupe_garment_images command folds photos uploaded before this existed.
+"""
+import hashlib
+import os
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from PIL import Image
+from .images import delete_variants
+from .models import Garment, StoredImage
+
+CHUNK_SIZE = 64 * 1024
+
+# Difference hash: compare neighbouring pixels of a 9x8 grayscale thumbnail
+PHASH_SIZE = 8
+
+# Set bits per byte value, for Hamming distances between hashes
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+class HashingUploadMixin:
+    """Compute the SHA-256 of the chunks this handler keeps and set it as file.sha256"""
+
+    def new_file(self, *args, **kwargs):
+        self._sha256 = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        passed_on = super().receive_data_chunk(raw_data, start)
+        if passed_on is None:
+            # This handler kept the chunk (the memory handler passes large files on)
+            self._sha256.update(raw_data)
+        return passed_on
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self._sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def file_sha256(file):
+    """SHA-256 of a file that didn't come through the upload handlers"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks(CHUNK_SIZE) if hasattr(file, 'chunks') else iter(lambda: file.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def content_name(sha256, original_name):
+    extension = os.path.splitext(original_name or '')[1].lower()
+    return f'garments/{sha256}{extension}'
+
+
+def perceptual_hash(file):
+    """64-bit difference hash as 16 hex digits ('' if disabled or not an image)"""
+    if not getattr(settings, 'IMAGE_PHASH_ENABLED', True):
+        return ''
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            # A tiny thumbnail is all the hash needs; JPEGs can skip most of the decode
+            image.draft('L', (PHASH_SIZE * 8, PHASH_SIZE * 8))
+            pixels = np.asarray(image.convert('L').resize((PHASH_SIZE + 1, PHASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    except Exception as e:
+        print(f"Perceptual hash failed: {e}")
+        return ''
+    finally:
+        file.seek(0)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return f'{int("".join("1" if bit else "0" for bit in bits), 2):016x}'
+
+
+def acquire_image(file, original_name, storage):
+    """Storage name for these bytes, uploading them only if nobody has them yet"""
+    digest = getattr(file, 'sha256', None) or file_sha256(file)
+    with transaction.atomic():
+        if StoredImage.objects.filter(sha256=digest).update(ref_count=F('ref_count') + 1):
+            return StoredImage.objects.values_list('name', flat=True).get(sha256=digest)
+
+    name = content_name(digest, original_name)
+    phash = perceptual_hash(file)
+    # A leftover from a photo released moments ago already holds these bytes
+    saved = name if storage.exists(name) else storage.save(name, file)
+    try:
+        with transaction.atomic():
+            StoredImage.objects.create(sha256=digest, name=saved, size=file.size, ref_count=1, phash=phash)
+        return saved
+    except IntegrityError:
+        # The same photo was stored concurrently; use that copy
+        with transaction.atomic():
+            StoredImage.objects.filter(sha256=digest).update(ref_count=F('ref_count') + 1)
+            existing = StoredImage.objects.values_list('name', flat=True).get(sha256=digest)
+        if saved != existing:
+            storage.delete(saved)
+        return existing
+
+
+def store_garment_image(field_file):
+    """Replace a pending upload on a garment with its content-addressed copy"""
+    field_file.name = acquire_image(field_file.file, field_file.name, field_file.storage)
+    # Stops the file field from saving the upload again
+    field_file._committed = True
+
+
+def delete_stored_files(storage, name, variants):
+    if StoredImage.objects.filter(name=name).exists():
+        # The same photo was uploaded again in the meantime
+        return
+    storage.delete(name)
+    delete_variants(storage, variants)
+
+
+def release_image(name, storage):
+    """Drop one garment's reference to a stored photo, deleting it with its last reference"""
+    if not name:
+        return
+    with transaction.atomic():
+        stored = StoredImage.objects.select_for_update().filter(name=name).first()
+        if stored is None:
+            # Uploaded before content addressing; left alone
+            return
+        if stored.ref_count > 1:
+            StoredImage.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') - 1)
+            return
+        stored.delete()
+        transaction.on_commit(lambda: delete_stored_files(storage, name, stored.variants))
+
+
+def hamming_distances(value, others):
+    """Differing bits between one uint64 hash and an array of them"""
+    return _POPCOUNT[np.bitwise_xor(others, value).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def near_duplicate_groups(user_id, max_distance=None):
+    """Groups of the user's garments whose photos are identical or nearly so"""
+    if max_distance is None:
+        max_distance = getattr(settings, 'IMAGE_PHASH_DISTANCE', 6)
+    rows = list(
+        Garment.objects.filter(owner_id=user_id)
+        .exclude(image='').exclude(image__isnull=True)
+        .order_by('id').values_list('id', 'image')
+    )
+    phashes = dict(
+        StoredImage.objects.filter(name__in={name for _, name in rows})
+        .exclude(phash='').values_list('name', 'phash')
+    )
+    rows = [(garment_id, name) for garment_id, name in rows if name in phashes]
+    if len(rows) < 2:
+        return []
+    hashes = np.array([int(phashes[name], 16) for _, name in rows], dtype=np.uint64)
+
+    # Union-find over every pair within max_distance
+    parent = list(range(len(rows)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(rows) - 1):
+        close = np.nonzero(hamming_distances(hashes[i], hashes[i + 1:]) <= max_distance)[0]
+        for j in close + i + 1:
+            parent[find(int(j))] = find(i)
+
+    groups = {}
+    for i, (garment_id, name) in enumerate(rows):
+        groups.setdefault(find(i), []).append((garment_id, name))
+    return [
+        {
+            'garment_ids': [garment_id for garment_id, _ in members],
+            'identical': len({name for _, name in members}) == 1,
+        }
+        for members in groups.values() if len(members) > 1
+    ]
@@ -0,0 +1,217 @@
+"""
+Resized WebP variants of garment photos and profile pictures.
+
+When an image is uploaded or replaced, a background thread decodes it once
+and writes a fixed-width thumbnail and a medium-size copy as WebP next to
+the original through the configured default storage (S3 or local files).
+The stored names are kept in the model's *_variants JSON field together
+with the name of the source image, so a variant is only served while it
+matches the current image. The generate_image_variants command backfills
+images uploaded before variants existed.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+from .authentication import invalidate_user_tokens
+from .models import StoredImage
+
+# Variant name -> width in pixels (never upscaled)
+IMAGE_VARIANTS = {'thumb': 256, 'medium': 1024}
+WEBP_QUALITY = 80
+
+# Model label -> (image field, variants field)
+IMAGE_FIELDS = {
+    'api.Garment': ('image', 'image_variants'),
+    'api.Profile': ('profile_picture', 'profile_picture_variants'),
+}
+
+_executor = None
+_lock = threading.Lock()
+
+
+def variant_name(source_name, variant):
+    """garments/IMG_1234.jpg -> garments/IMG_1234.jpg.thumb.webp
+
+    The source extension stays in the name so IMG_1234.jpg and IMG_1234.png
+    don't overwrite each other's variants.
+    """
+    return f'{source_name}.{variant}.webp'
+
+
+def render_variants(file):
+    """Decode an image once and return {variant: WebP bytes}"""
+    with Image.open(file) as original:
+        # JPEG photos can be decoded at a reduced scale, which is far cheaper
+        # than decoding a full 12 MP frame and shrinking it
+        largest = max(IMAGE_VARIANTS.values())
+        original.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if image.mode in ('LA', 'PA', 'P') else 'RGB')
+
+        rendered = {}
+        for variant, width in sorted(IMAGE_VARIANTS.items(), key=lambda item: -item[1]):
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+            buffer = BytesIO()
+            image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+            rendered[variant] = buffer.getvalue()
+        return rendered
+
+
+def generate_variants(field_file):
+    """Render and store the variants of an image; returns the mapping for the *_variants field"""
+    storage = field_file.storage
+    with field_file.open('rb') as source:
+        rendered = render_variants(source)
+    variants = {'source': field_file.name}
+    for variant, data in rendered.items():
+        name = variant_name(field_file.name, variant)
+        # Replace rather than let the storage pick a suffixed name
+        storage.delete(name)
+        variants[variant] = storage.save(name, ContentFile(data))
+    return variants
+
+
+# Most keys per S3 DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
+
+def delete_files(storage, names):
+    """Delete stored files in batches (one DeleteObjects request per 1000 on S3); returns (deleted, errors)"""
+    names = list(names)
+    if not hasattr(storage, 'bucket_name'):
+        deleted, errors = [], []
+        for name in names:
+            try:
+                storage.delete(name)
+                deleted.append(name)
+            except OSError as e:
+                errors.append(f'{name}: {e}')
+        return deleted, errors
+
+    deleted, errors = [], []
+    client = storage.connection.meta.client
+    for start in range(0, len(names), DELETE_BATCH_SIZE):
+        batch = names[start:start + DELETE_BATCH_SIZE]
+        response = client.delete_objects(
+            Bucket=storage.bucket_name,
+            Delete={'Objects': [{'Key': name} for name in batch], 'Quiet': True},
+        )
+        # Quiet mode only reports the failures
+        failed = {error['Key']: error for error in response.get('Errors', [])}
+        deleted.extend(name for name in batch if name not in failed)
+        errors.extend(f"{key}: {error.get('Code')} {error.get('Message', '')}" for key, error in failed.items())
+    return deleted, errors
+
+
+def delete_variants(storage, variants, keep=()):
+    for key, name in (variants or {}).items():
+        if key != 'source' and name not in keep:
+            storage.delete(name)
+
+
+def is_shared(variants):
+    """Variants of a content-addressed photo belong to its StoredImage, which deletes them"""
+    source = (variants or {}).get('source')
+    return bool(source) and StoredImage.objects.filter(name=source).exists()
+
+
+def refresh_variants(model_label, pk, force=False):
+    """Bring one object's variants in line with its current image; returns True if they changed"""
+    model = apps.get_model(model_label)
+    image_field, variants_field = IMAGE_FIELDS[model_label]
+    obj = model.objects.filter(pk=pk).first()
+    if obj is None:
+        return False
+    field_file = getattr(obj, image_field)
+    old = getattr(obj, variants_field) or {}
+    if not field_file:
+        if not old:
+            return False
+        new = {}
+        updated = model.objects.filter(pk=pk).update(**{variants_field: new})
+    elif old.get('source') == field_file.name and not force:
+        return False
+    else:
+        stored = StoredImage.objects.filter(name=field_file.name).first()
+        if stored is not None and stored.variants.get('source') == field_file.name and not force:
+            # The same photo was already rendered for another garment
+            new = stored.variants
+        else:
+            new = generate_variants(field_file)
+            if stored is not None:
+                StoredImage.objects.filter(pk=stored.pk).update(variants=new)
+        # Only store them if the image wasn't replaced while we were rendering
+        updated = model.objects.filter(pk=pk, **{image_field: field_file.name}).update(**{variants_field: new})
+
+    if not updated:
+        if not is_shared(new):
+            delete_variants(field_file.storage, new, keep=set(old.values()))
+        return False
+    if not is_shared(old):
+        delete_variants(field_file.storage, old, keep=set(new.values()))
+    if model_label == 'api.Profile':
+        # Cached auth users carry their profile
+        invalidate_user_tokens(obj.user_id)
+    return True
+
+
+def variants_outdated(field_file, variants):
+    """True when the stored variants don't belong to the current image"""
+    return (variants or {}).get('source') != (field_file.name if field_file else None)
+
+
+def variant_urls(field_file, variants, request=None):
+    """{variant: URL} for variants generated from the current image (empty until they exist)"""
+    if not field_file or variants_outdated(field_file, variants):
+        return {}
+    urls = {}
+    for variant in IMAGE_VARIANTS:
+        if variant in variants:
+            url = field_file.storage.url(variants[variant])
+            if request and not url.startswith('http'):
+                url = request.build_absolute_uri(url)
+            urls[variant] = url
+    return urls
+
+
+def get_executor():
+    """Process-wide pool for rendering variants outside the request"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_VARIANT_WORKERS', 2),
+                thread_name_prefix='image-variants',
+            )
+        return _executor
+
+
+def _refresh_logged(model_label, pk):
+    try:
+        refresh_variants(model_label, pk)
+    except Exception as e:
+        print(f"Image variants for {model_label} {pk} failed: {e}")
+
+
+def _run_refresh(model_label, pk):
+    try:
+        _refresh_logged(model_label, pk)
+    finally:
+        # Pool threads are long-lived; don't leave a connection open per thread
+        connection.close()
+
+
+def schedule_refresh(model_label, pk):
+    """Refresh variants once the current transaction commits"""
+    if getattr(settings, 'IMAGE_VARIANTS_ASYNC', True):
+        transaction.on_commit(lambda: get_executor().submit(_run_refresh, model_label, pk))
+    else:
+        transaction.on_commit(lambda: _refresh_logged(model_label, pk))
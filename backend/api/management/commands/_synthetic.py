@@ -0,0 +1,29 @@
+from django.utils import timezone
+from api.models import Category, Garment
+
+CATEGORY_NAMES = ['Tops', 'Bottoms', 'Dresses', 'Outerwear', 'Shoes', 'Accessories']
+COLORS = ['black', 'white', 'navy', 'beige', 'red', 'olive', 'grey', 'denim blue']
+BRANDS = ['Uniqlo', 'Zara', 'H&M', 'Levi\'s', 'Nike', '']
+
+
+def synthetic_wardrobe(size, rng):
+    """Unsaved garments with realistic field values for benchmarks; no database access"""
+    categories = [Category(id=i, name=name) for i, name in enumerate(CATEGORY_NAMES, start=1)]
+    seasons = [choice[0] for choice in Garment.SEASON_CHOICES]
+    today = timezone.now().date()
+    garments = []
+    for i in range(1, size + 1):
+        category = rng.choice(categories)
+        garments.append(Garment(
+            id=i,
+            name=f"{rng.choice(COLORS).title()} {category.name[:-1].lower()} {i}",
+            category=category,
+            color=rng.choice(COLORS),
+            size=rng.choice(Garment.SIZE_CHOICES)[0],
+            brand=rng.choice(BRANDS),
+            season=rng.choice(seasons),
+            times_worn=rng.randint(0, 40),
+            last_worn=today - timezone.timedelta(days=rng.randint(0, 60)),
+            is_favorite=rng.random() < 0.1,
+        ))
+    return garments
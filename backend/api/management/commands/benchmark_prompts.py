@@ -0,0 +1,50 @@
+import json
+import random
+import time
+from django.core.management.base import BaseCommand
+from api.prompts import build_recommendation_prompt, estimate_tokens
+from ._synthetic import synthetic_wardrobe
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare AI recommendation prompt size and build time against wardrobe size. '
+        'Times prompt building only; no model is called, so model latency is not measured.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000,10000', help='Comma-separated wardrobe sizes')
+        parser.add_argument('--budget', type=int, default=None, help='Token budget (defaults to PROMPT_TOKEN_BUDGET)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+
+        self.stdout.write(f"{'garments':>9} {'legacy tokens':>14} {'legacy ms':>10} {'budgeted tokens':>16} {'rows':>6} {'budgeted ms':>12}")
+        for size in sizes:
+            garments = synthetic_wardrobe(size, rng)
+
+            started = time.perf_counter()
+            legacy_prompt = json.dumps([{
+                'id': g.id,
+                'name': g.name,
+                'category': g.category.name,
+                'color': g.color,
+                'size': g.size,
+                'brand': g.brand,
+            } for g in garments], indent=2)
+            legacy_ms = (time.perf_counter() - started) * 1000
+            legacy_tokens = estimate_tokens(legacy_prompt)
+
+            started = time.perf_counter()
+            prompt, included_ids = build_recommendation_prompt(
+                garments, 'casual day', 'sunny and warm', token_budget=options['budget']
+            )
+            budgeted_ms = (time.perf_counter() - started) * 1000
+
+            self.stdout.write(
+                f"{size:>9} {legacy_tokens:>14} {legacy_ms:>10.1f} "
+                f"{estimate_tokens(prompt):>16} {len(included_ids):>6} {budgeted_ms:>12.1f}"
+            )
+        self.stdout.write('Times are for building the prompt only and exclude model latency.')
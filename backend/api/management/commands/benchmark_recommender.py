@@ -0,0 +1,36 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from api.scoring import WardrobeArrays, local_recommendations
+from ._synthetic import synthetic_wardrobe
+
+
+class Command(BaseCommand):
+    help = 'Time the local outfit-scoring engine against wardrobe size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000,10000', help='Comma-separated wardrobe sizes')
+        parser.add_argument('--runs', type=int, default=5, help='Timed runs per size')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+
+        self.stdout.write(f"{'garments':>9} {'load ms':>9} {'score ms':>9} {'outfits':>8}")
+        for size in sizes:
+            garments = synthetic_wardrobe(size, rng)
+
+            started = time.perf_counter()
+            wardrobe = WardrobeArrays.from_garments(garments)
+            load_ms = (time.perf_counter() - started) * 1000
+
+            timings = []
+            for run in range(options['runs']):
+                started = time.perf_counter()
+                result = local_recommendations(wardrobe, 'casual day', 'sunny', seed=run)
+                timings.append((time.perf_counter() - started) * 1000)
+
+            self.stdout.write(
+                f"{size:>9} {load_ms:>9.1f} {sorted(timings)[len(timings) // 2]:>9.1f} {len(result['outfits']):>8}"
+            )
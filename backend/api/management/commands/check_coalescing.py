@@ -0,0 +1,70 @@
+import os
+import random
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.fake_openai import FakeOpenAIServer
+from api.recommendations import request_model_recommendations
+from api.singleflight import SingleFlight
+from ._synthetic import synthetic_wardrobe
+
+
+class Command(BaseCommand):
+    help = 'Fire identical concurrent recommendation requests at a slow fake OpenAI server and count upstream calls'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help='Concurrent identical requests')
+        parser.add_argument('--delay', type=float, default=1.0, help='Fake upstream latency in seconds')
+        parser.add_argument('--garments', type=int, default=40)
+
+    def handle(self, *args, **options):
+        garments = synthetic_wardrobe(options['garments'], random.Random(42))
+        server = FakeOpenAIServer(delay=options['delay']).start()
+        previous = {name: os.environ.get(name) for name in ('OPENAI_API_KEY', 'OPENAI_BASE_URL')}
+        os.environ['OPENAI_API_KEY'] = 'fake-key'
+        os.environ['OPENAI_BASE_URL'] = server.base_url
+        try:
+            def call_model():
+                return request_model_recommendations(garments, 'casual day', 'sunny')
+
+            flights = SingleFlight('check-coalescing')
+            self.stdout.write(f"{'mode':>10} {'requests':>9} {'upstream':>9} {'ok':>4} {'wall s':>7}")
+            for mode, run in (
+                ('direct', lambda: call_model()),
+                ('coalesced', lambda: flights.do('same-request', call_model)),
+            ):
+                calls_before = server.call_count
+                ok, wall = self.fire(run, options['requests'])
+                upstream = server.call_count - calls_before
+                self.stdout.write(f"{mode:>10} {options['requests']:>9} {upstream:>9} {ok:>4} {wall:>7.2f}")
+
+            if upstream != 1 or ok != options['requests']:
+                raise CommandError(f'Expected 1 upstream call and {options["requests"]} results, got {upstream} and {ok}')
+            self.stdout.write(self.style.SUCCESS(f'Coalescing OK: {flights.stats()}'))
+        finally:
+            server.stop()
+            for name, value in previous.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+    def fire(self, run, count):
+        """Start `count` threads at once; return (successful results, wall seconds)"""
+        barrier = threading.Barrier(count)
+        results = []
+
+        def worker():
+            barrier.wait()
+            try:
+                results.append(run())
+            except Exception as e:
+                self.stderr.write(f'Request failed: {e}')
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(1 for result in results if result.get('outfits')), time.perf_counter() - started
@@ -0,0 +1,137 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+from api.image_dedup import CHUNK_SIZE, delete_stored_files, perceptual_hash
+from api.images import delete_variants
+from api.models import Garment, StoredImage
+
+
+def hash_stored_file(storage, name):
+    """Thread worker: (name, sha256, size, phash, error) for one stored photo"""
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with storage.open(name, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+            phash = perceptual_hash(file)
+        return name, digest.hexdigest(), size, phash, None
+    except Exception as e:
+        return name, None, 0, '', str(e)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Store identical garment photos once and set up reference counts for photos uploaded before deduplication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Threads reading photos from storage')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be merged without changing anything')
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help='Keep unreferenced photos stored more recently than this (their garment may not be saved yet)')
+
+    def handle(self, *args, **options):
+        storage = Garment._meta.get_field('image').storage
+        stored_names = set(StoredImage.objects.values_list('name', flat=True))
+        names = [
+            name for name in (
+                Garment.objects.exclude(image='').exclude(image__isnull=True)
+                .values_list('image', flat=True).distinct().iterator()
+            )
+            if name not in stored_names
+        ]
+        self.stdout.write(f'Hashing {len(names)} photos with {options["workers"]} threads')
+
+        started = time.perf_counter()
+        by_hash = {}
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            results = executor.map(lambda name: hash_stored_file(storage, name), names)
+            for done, (name, digest, size, phash, error) in enumerate(results, 1):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'  {name}: {error}')
+                else:
+                    by_hash.setdefault(digest, []).append((name, size, phash))
+                if done % 500 == 0:
+                    self.stdout.write(f'  {done}/{len(names)} photos, {done / (time.perf_counter() - started):.1f} photos/s')
+
+        existing = {stored.sha256: stored for stored in StoredImage.objects.filter(sha256__in=by_hash)}
+        merged = saved_bytes = unrendered = 0
+        for digest, members in by_hash.items():
+            members.sort()
+            stored = existing.get(digest)
+            canonical = stored.name if stored else members[0][0]
+            duplicates = [(name, size) for name, size, _ in members if name != canonical]
+            merged += len(duplicates)
+            saved_bytes += sum(size for _, size in duplicates)
+            if options['dry_run']:
+                continue
+
+            with transaction.atomic():
+                if stored is None:
+                    _, size, phash = members[0]
+                    variants = next((
+                        variants for variants in
+                        Garment.objects.filter(image=canonical).values_list('image_variants', flat=True)
+                        if (variants or {}).get('source') == canonical
+                    ), {})
+                    stored = StoredImage.objects.create(
+                        sha256=digest, name=canonical, size=size, phash=phash, variants=variants,
+                    )
+                for name, _ in duplicates:
+                    old_variants = list(Garment.objects.filter(image=name).values_list('image_variants', flat=True))
+                    Garment.objects.filter(image=name).update(image=canonical, image_variants=stored.variants)
+                    transaction.on_commit(lambda name=name, old_variants=old_variants: self.delete_duplicate(
+                        storage, name, old_variants
+                    ))
+                references = Garment.objects.filter(image=canonical).count()
+                StoredImage.objects.filter(pk=stored.pk).update(ref_count=references)
+                if not stored.variants:
+                    unrendered += references
+
+        if not options['dry_run']:
+            self.recount(storage, options['grace_minutes'])
+
+        elapsed = time.perf_counter() - started
+        verb = 'Would merge' if options['dry_run'] else 'Merged'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {merged} duplicate photos into {len(by_hash)} stored images '
+            f'({saved_bytes / 1024 / 1024:.1f} MB freed, {failed} unreadable) in {elapsed:.1f}s'
+        ))
+        if unrendered:
+            self.stdout.write(f'{unrendered} garments have no variants yet; run generate_image_variants')
+
+    def delete_duplicate(self, storage, name, old_variants):
+        storage.delete(name)
+        for variants in old_variants:
+            if (variants or {}).get('source') == name:
+                delete_variants(storage, variants)
+
+    def recount(self, storage, grace_minutes):
+        """Set every reference count from the garments table and drop unreferenced photos"""
+        counts = dict(
+            Garment.objects.filter(image__in=StoredImage.objects.values('name'))
+            .values('image').annotate(total=Count('id')).values_list('image', 'total')
+        )
+        cutoff = timezone.now() - timezone.timedelta(minutes=grace_minutes)
+        fixed = 0
+        for stored in StoredImage.objects.iterator():
+            total = counts.get(stored.name, 0)
+            if total == stored.ref_count and total:
+                continue
+            # Only if no upload or release changed the count since it was read
+            current = StoredImage.objects.filter(pk=stored.pk, ref_count=stored.ref_count)
+            if total:
+                fixed += current.update(ref_count=total)
+            elif stored.created_at < cutoff and current.delete()[0]:
+                fixed += 1
+                delete_stored_files(storage, stored.name, stored.variants)
+        if fixed:
+            self.stdout.write(f'Corrected {fixed} reference counts')
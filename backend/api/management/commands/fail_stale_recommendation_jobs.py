@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from api.recommendation_jobs import STALE_JOB_MINUTES, fail_stale_jobs
+
+
+class Command(BaseCommand):
+    help = (f'Mark recommendation jobs left queued or running for over {STALE_JOB_MINUTES} minutes '
+            '(after a worker crash or restart) as failed; run periodically or after a deploy')
+
+    def handle(self, *args, **options):
+        failed = fail_stale_jobs()
+        self.stdout.write(self.style.SUCCESS(f'Marked {failed} stale recommendation jobs as failed'))
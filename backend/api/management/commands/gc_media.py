@@ -0,0 +1,180 @@
+import hashlib
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.core.management.base import BaseCommand
+from api.images import DELETE_BATCH_SIZE, IMAGE_VARIANTS, delete_files
+from api.models import Garment, Profile, StoredImage
+
+# (model, image field, variants field) whose files are kept
+REFERENCES = [
+    (Garment, 'image', 'image_variants'),
+    (Profile, 'profile_picture', 'profile_picture_variants'),
+    (StoredImage, 'name', 'variants'),
+]
+
+
+class BloomFilter:
+    """
+    Fixed-size set of strings with no false negatives.
+
+    A false positive only means an orphan survives until a later run, which
+    is the safe direction for a garbage collector.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1000)
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+def referenced_names():
+    """Every stored name the database points at, images and their variants, streamed"""
+    for model, image_field, variants_field in REFERENCES:
+        rows = model.objects.exclude(**{image_field: ''}).exclude(**{f'{image_field}__isnull': True})
+        for name, variants in rows.values_list(image_field, variants_field).iterator(chunk_size=5000):
+            yield name
+            for key, variant in (variants or {}).items():
+                if key != 'source':
+                    yield variant
+
+
+def variant_source(name):
+    """The source image a variant name was derived from (see images.variant_name), or None"""
+    for variant in IMAGE_VARIANTS:
+        suffix = f'.{variant}.webp'
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return None
+
+
+def still_referenced(names):
+    """
+    Exact check of a batch of candidates against the image columns, for
+    references saved since the scan. A variant counts as referenced while
+    its source image is.
+    """
+    names = list(names)
+    sources = {name: variant_source(name) for name in names}
+    lookup = set(names) | {source for source in sources.values() if source}
+    found = set()
+    for model, image_field, _ in REFERENCES:
+        found.update(model.objects.filter(**{f'{image_field}__in': lookup}).values_list(image_field, flat=True))
+    return {name for name in names if name in found or sources[name] in found}
+
+
+def media_prefixes():
+    return sorted({
+        model._meta.get_field(image_field).upload_to
+        for model, image_field, _ in REFERENCES
+        if hasattr(model._meta.get_field(image_field), 'upload_to')
+    })
+
+
+def s3_objects(storage, prefix):
+    """(name, size, last modified) of every object under prefix, one ListObjectsV2 page at a time"""
+    paginator = storage.connection.meta.client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=storage.bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key'], obj['Size'], obj['LastModified']
+
+
+def local_objects(storage, prefix):
+    """(name, size, last modified) of every file under prefix in MEDIA_ROOT"""
+    root = storage.path(prefix)
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            stat = os.stat(path)
+            name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+            yield name, stat.st_size, datetime.fromtimestamp(stat.st_mtime, dt_timezone.utc)
+
+
+class Command(BaseCommand):
+    help = 'Delete media files that no garment, profile or stored image refers to any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Leave files younger than this alone (uploads not yet saved)')
+        parser.add_argument('--prefix', action='append', help='Only collect under this prefix (repeatable); '
+                                                               'defaults to the upload directories')
+        parser.add_argument('--dry-run', action='store_true', help='Report orphans without deleting them')
+        parser.add_argument('--show', type=int, default=20, help='Orphans to list in the report')
+
+    def handle(self, *args, **options):
+        storage = Garment._meta.get_field('image').storage
+        is_s3 = hasattr(storage, 'bucket_name')
+        prefixes = options['prefix'] or media_prefixes()
+        cutoff = datetime.now(dt_timezone.utc) - timedelta(hours=options['grace_hours'])
+        started = time.perf_counter()
+
+        # Each row references its image plus about two variants
+        capacity = 3 * sum(model.objects.count() for model, _, _ in REFERENCES)
+        referenced = BloomFilter(capacity)
+        reference_count = 0
+        for name in referenced_names():
+            referenced.add(name)
+            reference_count += 1
+        self.stdout.write(f'Indexed {reference_count} referenced names ({len(referenced.bits) / 1024:.0f} KB filter) '
+                          f'in {time.perf_counter() - started:.1f}s')
+
+        scanned = young = orphans = orphan_bytes = deleted = deleted_bytes = failed = 0
+        batch = []
+
+        def flush():
+            nonlocal deleted, deleted_bytes, failed
+            keep = still_referenced(name for name, _ in batch)
+            doomed = [(name, size) for name, size in batch if name not in keep]
+            removed, errors = delete_files(storage, [name for name, _ in doomed])
+            sizes = dict(doomed)
+            deleted += len(removed)
+            deleted_bytes += sum(sizes[name] for name in removed)
+            failed += len(errors)
+            for error in errors[:10]:
+                self.stderr.write(f'  {error}')
+            batch.clear()
+
+        for prefix in prefixes:
+            objects = s3_objects(storage, prefix) if is_s3 else local_objects(storage, prefix)
+            for name, size, modified in objects:
+                scanned += 1
+                if name in referenced:
+                    continue
+                if modified > cutoff:
+                    young += 1
+                    continue
+                orphans += 1
+                orphan_bytes += size
+                if options['dry_run']:
+                    if orphans <= options['show']:
+                        self.stdout.write(f'  orphan: {name} ({size} bytes, {modified:%Y-%m-%d})')
+                    continue
+                batch.append((name, size))
+                if len(batch) >= DELETE_BATCH_SIZE:
+                    flush()
+        if batch:
+            flush()
+
+        elapsed = time.perf_counter() - started
+        summary = (f'Scanned {scanned} files under {", ".join(prefixes)} in {elapsed:.1f}s: '
+                   f'{orphans} orphans ({orphan_bytes / 1024 / 1024:.1f} MB), {young} too recent to judge')
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{summary}; dry run, nothing deleted'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'{summary}; deleted {deleted} ({deleted_bytes / 1024 / 1024:.1f} MB), {failed} failed'
+            ))
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import time
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+from api.images import IMAGE_FIELDS, refresh_variants
+
+
+def process_image(task):
+    """Pool worker: refresh one object's variants; returns (changed, error)"""
+    model_label, pk, force = task
+    try:
+        return refresh_variants(model_label, pk, force=force), None
+    except Exception as e:
+        return False, f'{model_label} {pk}: {e}'
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnail and WebP variants for existing garment photos and profile pictures'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=['garment', 'profile', 'all'], default='all')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes (1 = no pool)')
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that are already up to date')
+
+    def handle(self, *args, **options):
+        tasks = []
+        for model_label, (image_field, variants_field) in IMAGE_FIELDS.items():
+            if options['model'] not in ('all', model_label.split('.')[1].lower()):
+                continue
+            model = apps.get_model(model_label)
+            rows = model.objects.exclude(**{image_field: ''}).exclude(**{f'{image_field}__isnull': True})
+            for pk, name, variants in rows.values_list('pk', image_field, variants_field).iterator():
+                if options['force'] or (variants or {}).get('source') != name:
+                    tasks.append((model_label, pk, options['force']))
+
+        if not tasks:
+            self.stdout.write('All image variants are up to date')
+            return
+        workers = max(1, min(options['workers'], len(tasks)))
+        if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            # Spawned workers would start without Django set up (e.g. on Windows)
+            self.stderr.write('Worker processes need the fork start method, which this platform lacks; running serially')
+            workers = 1
+        self.stdout.write(f'Generating variants for {len(tasks)} images with {workers} workers')
+
+        started = time.perf_counter()
+        done = changed = failed = 0
+        if workers == 1:
+            results = map(process_image, tasks)
+            pool = None
+        else:
+            # Forked workers must not share the parent's database connection
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            results = pool.imap_unordered(process_image, tasks, chunksize=4)
+        try:
+            for was_changed, error in results:
+                done += 1
+                changed += was_changed
+                if error:
+                    failed += 1
+                    self.stderr.write(f'  {error}')
+                if done % 100 == 0:
+                    self.stdout.write(f'  {done}/{len(tasks)} images, {done / (time.perf_counter() - started):.1f} images/s')
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {changed} updated, {failed} failed, {done} images in {elapsed:.1f}s ({done / elapsed:.1f} images/s)'
+        ))
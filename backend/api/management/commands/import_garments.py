@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from api.garment_import import GarmentImportError, import_garments
+
+
+class Command(BaseCommand):
+    help = "Import garments for a user from a CSV, NDJSON or export zip file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='.csv, .ndjson or export .zip file')
+        parser.add_argument('--user', required=True, help='Username or ID of the owner')
+        parser.add_argument('--images', help='Zip of photos named by the rows\' image column')
+        parser.add_argument('--dry-run', action='store_true', help='Validate every row without saving')
+
+    def handle(self, *args, **options):
+        lookup = {'pk': options['user']} if options['user'].isdigit() else {'username': options['user']}
+        user = User.objects.filter(**lookup).first()
+        if user is None:
+            raise CommandError(f'No user {options["user"]}')
+
+        images = open(options['images'], 'rb') if options['images'] else None
+        try:
+            with open(options['path'], 'rb') as file:
+                report = import_garments(user, file, options['path'], images=images, dry_run=options['dry_run'])
+        except GarmentImportError as e:
+            raise CommandError(str(e))
+        finally:
+            if images is not None:
+                images.close()
+
+        for error in report['errors']:
+            self.stderr.write(f'  row {error["row"]}: {error["errors"]}')
+        if report.get('truncated'):
+            self.stderr.write(report['truncated'])
+        verb = 'Would create' if report['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {report["created"]} garments ({report["images"]} photos) from {report["rows"]} rows '
+            f'in {report["seconds"]}s; {report["failed"]} rows failed'
+        ))
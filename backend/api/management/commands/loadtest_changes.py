@@ -0,0 +1,209 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+from api.changes import get_broker
+
+STREAM_PATH = '/api/changes/stream/'
+
+
+def resident_mb():
+    """Resident memory of this process in MB (Linux), or None"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+class StreamClient:
+    """One SSE connection: parses events and records when each change arrived"""
+
+    def __init__(self):
+        self.ready = asyncio.Event()
+        self.received = {}
+        self.keepalives = 0
+        self.status = None
+        self._buffer = ''
+
+    def feed(self, data):
+        self._buffer += data.decode()
+        while '\n\n' in self._buffer:
+            block, self._buffer = self._buffer.split('\n\n', 1)
+            if block.startswith(':'):
+                self.keepalives += 1
+                continue
+            fields = dict(line.split(': ', 1) for line in block.split('\n') if ': ' in line)
+            if fields.get('event') == 'ready':
+                self.ready.set()
+            elif fields.get('event') == 'change':
+                event = json.loads(fields['data'])
+                self.received.setdefault(event['id'], time.perf_counter())
+
+
+async def run_in_process(client, application, token, stop):
+    """Drive the ASGI application directly with a synthetic HTTP connection"""
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await stop.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            client.status = message['status']
+            if client.status != 200:
+                client.ready.set()
+        elif message['type'] == 'http.response.body':
+            client.feed(message.get('body', b''))
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': STREAM_PATH, 'raw_path': STREAM_PATH.encode(),
+        'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'authorization', f'Token {token}'.encode())],
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+    }
+    await application(scope, receive, send)
+
+
+async def run_over_tcp(client, url, token, stop):
+    """A real connection to a running server"""
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    writer.write(
+        f'GET {STREAM_PATH} HTTP/1.1\r\nHost: {parts.netloc}\r\nAuthorization: Token {token}\r\n'
+        f'Accept: text/event-stream\r\n\r\n'.encode()
+    )
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    client.status = int(head.split(b' ', 2)[1])
+    if client.status != 200:
+        client.ready.set()
+        writer.close()
+        return
+    chunked = b'transfer-encoding: chunked' in head.lower()
+    reading = asyncio.ensure_future(stop.wait())
+    try:
+        while not stop.is_set():
+            read = asyncio.ensure_future(reader.read(65536))
+            await asyncio.wait({read, reading}, return_when=asyncio.FIRST_COMPLETED)
+            if not read.done():
+                read.cancel()
+                break
+            data = read.result()
+            if not data:
+                break
+            if chunked:
+                # Chunk-size lines never contain a blank line, so dropping them keeps events intact
+                data = b'\r\n'.join(line for line in data.split(b'\r\n') if not _is_chunk_size(line))
+            client.feed(data.replace(b'\r\n', b'\n'))
+    finally:
+        reading.cancel()
+        writer.close()
+
+
+def _is_chunk_size(line):
+    try:
+        int(line, 16)
+        return True
+    except ValueError:
+        return False
+
+
+def percentile(values, fraction):
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ('Open thousands of idle change-notification streams, then measure how fast published '
+            'events reach all of them. Raise the open-file limit (ulimit -n) for --url runs.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Username whose stream every connection opens')
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--idle', type=float, default=5, help='Seconds to hold the connections idle')
+        parser.add_argument('--events', type=int, default=20, help='Events to publish after the idle period')
+        parser.add_argument('--interval', type=float, default=0.05, help='Seconds between events')
+        parser.add_argument('--url', help='Server to connect to (e.g. http://localhost:8000); '
+                                          'default drives garmently_backend.asgi in this process')
+        parser.add_argument('--ramp', type=int, default=200, help='Connections opened per batch')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f'No user {options["user"]}')
+        token, _ = Token.objects.get_or_create(user=user)
+        asyncio.run(self.run(user.id, token.key, options))
+
+    async def run(self, user_id, token, options):
+        broker = get_broker()
+        if options['url']:
+            connect = lambda client, stop: run_over_tcp(client, options['url'], token, stop)
+            if type(broker).__name__ == 'LocalBroker':
+                self.stderr.write('The broker is in-process, so events published here will not reach '
+                                  'the server; set CHANGE_BROKER_URL to the server\'s Redis to measure delivery')
+        else:
+            from garmently_backend.asgi import application
+            connect = lambda client, stop: run_in_process(client, application, token, stop)
+
+        stop = asyncio.Event()
+        clients, tasks = [], []
+        memory_before = resident_mb()
+        started = time.perf_counter()
+        for offset in range(0, options['connections'], options['ramp']):
+            batch = [StreamClient() for _ in range(min(options['ramp'], options['connections'] - offset))]
+            clients.extend(batch)
+            tasks.extend(asyncio.ensure_future(connect(client, stop)) for client in batch)
+            await asyncio.wait_for(asyncio.gather(*(client.ready.wait() for client in batch)), 60)
+        opened = time.perf_counter() - started
+        failed = sum(client.status != 200 for client in clients)
+        memory_after = resident_mb()
+        self.stdout.write(f'Opened {len(clients) - failed} streams in {opened:.2f}s ({failed} failed); '
+                          f'broker {broker.stats()}')
+        if memory_before is not None and len(clients) > failed:
+            self.stdout.write(f'Memory: {memory_after - memory_before:.1f} MB for the streams, '
+                              f'{(memory_after - memory_before) * 1024 / (len(clients) - failed):.1f} KB each')
+
+        await asyncio.sleep(options['idle'])
+
+        published = {}
+        for number in range(options['events']):
+            event_id = -(number + 1)
+            published[event_id] = time.perf_counter()
+            # From a worker thread, as a request committing a change would
+            await asyncio.to_thread(broker.publish, user_id, {'type': 'loadtest', 'id': event_id, 'version': number})
+            await asyncio.sleep(options['interval'])
+        await asyncio.sleep(1)
+
+        latencies, missing = [], 0
+        for client in clients:
+            if client.status != 200:
+                continue
+            for event_id, sent_at in published.items():
+                if event_id in client.received:
+                    latencies.append((client.received[event_id] - sent_at) * 1000)
+                else:
+                    missing += 1
+        if latencies:
+            self.stdout.write(
+                f'Delivered {len(latencies)} events ({missing} missing): p50 {statistics.median(latencies):.1f}ms, '
+                f'p99 {percentile(latencies, 0.99):.1f}ms, max {max(latencies):.1f}ms'
+            )
+        else:
+            self.stdout.write(f'No events delivered ({missing} missing)')
+
+        stop.set()
+        await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 30)
+        await asyncio.sleep(0.5)
+        self.stdout.write(self.style.SUCCESS(f'Closed all streams; broker {broker.stats()}'))
@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from api.daily_outfits import compute_daily_outfits, save_daily_outfits
+from api.models import DailyOutfit, Garment
+
+
+def process_chunk(task):
+    """Pool worker: compute and store one chunk of users"""
+    user_ids, date, weather = task
+    started = time.perf_counter()
+    saved = save_daily_outfits(compute_daily_outfits(user_ids, date, weather))
+    return user_ids[0], user_ids[-1], len(user_ids), len(saved), time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = "Precompute each active user's outfit of the day with the local scoring engine"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to compute (YYYY-MM-DD, defaults to today)')
+        parser.add_argument('--weather', default='moderate')
+        parser.add_argument('--start-id', type=int, default=None, help='First user ID to process')
+        parser.add_argument('--end-id', type=int, default=None, help='Last user ID to process')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes (1 = no pool)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Users per worker task')
+        parser.add_argument('--active-days', type=int, default=30,
+                            help='Only users who logged in within this many days (0 = all active users)')
+        parser.add_argument('--overwrite', action='store_true', help='Recompute users that already have a row for the day')
+
+    def handle(self, *args, **options):
+        date = parse_date(options['date']) if options['date'] else timezone.localdate()
+        if date is None:
+            raise CommandError('--date must be YYYY-MM-DD')
+
+        users = User.objects.filter(is_active=True).filter(
+            Exists(Garment.objects.filter(owner=OuterRef('pk'), status='clean'))
+        )
+        if options['start_id'] is not None:
+            users = users.filter(id__gte=options['start_id'])
+        if options['end_id'] is not None:
+            users = users.filter(id__lte=options['end_id'])
+        if options['active_days']:
+            users = users.filter(last_login__gte=timezone.now() - timezone.timedelta(days=options['active_days']))
+        if not options['overwrite']:
+            # Users done by an earlier (interrupted) run are skipped, so reruns resume
+            users = users.exclude(Exists(DailyOutfit.objects.filter(owner=OuterRef('pk'), date=date)))
+        user_ids = list(users.order_by('id').values_list('id', flat=True))
+
+        if not user_ids:
+            self.stdout.write('No users to process')
+            return
+        chunk_size = max(1, options['chunk_size'])
+        tasks = [(user_ids[i:i + chunk_size], date, options['weather']) for i in range(0, len(user_ids), chunk_size)]
+        workers = max(1, min(options['workers'], len(tasks)))
+        if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            # Spawned workers would start without Django set up (e.g. on Windows)
+            self.stderr.write('Worker processes need the fork start method, which this platform lacks; running serially')
+            workers = 1
+        self.stdout.write(f'Computing outfits of the day for {date}: {len(user_ids)} users, {len(tasks)} chunks, {workers} workers')
+
+        started = time.perf_counter()
+        processed = saved = 0
+        finished_chunks = set()
+        resume_index = 0
+        if workers == 1:
+            results = map(process_chunk, tasks)
+            pool = None
+        else:
+            # Forked workers must not share the parent's database connection
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            results = pool.imap_unordered(process_chunk, tasks)
+        try:
+            for first_id, last_id, count, written, seconds in results:
+                processed += count
+                saved += written
+                finished_chunks.add(first_id)
+                # Every user below the first unfinished chunk is done
+                while resume_index < len(tasks) and tasks[resume_index][0][0] in finished_chunks:
+                    resume_index += 1
+                elapsed = time.perf_counter() - started
+                resume_from = tasks[resume_index][0][0] if resume_index < len(tasks) else None
+                self.stdout.write(
+                    f'  users {first_id}-{last_id}: {written} saved in {seconds:.2f}s | '
+                    f'{processed}/{len(user_ids)} users, {processed / elapsed:.0f} users/s'
+                    + (f' | resume with --start-id {resume_from}' if resume_from else '')
+                )
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {processed} users, {saved} outfits saved in {elapsed:.1f}s ({processed / elapsed:.0f} users/s)'
+        ))
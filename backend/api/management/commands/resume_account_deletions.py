@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api.account_deletion import run_account_deletion
+from api.models import AccountDeletion
+
+
+class Command(BaseCommand):
+    help = 'Finish account deletions that were interrupted (crash, deploy) or failed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-minutes', type=int, default=10,
+                            help='Only pick up deletions with no progress for this long')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Rows deleted per transaction')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timezone.timedelta(minutes=options['stale_minutes'])
+        deletions = list(AccountDeletion.objects.filter(
+            status__in=['pending', 'running', 'failed'], updated_at__lt=cutoff,
+        ).order_by('requested_at'))
+        if not deletions:
+            self.stdout.write('No interrupted account deletions')
+            return
+
+        finished = 0
+        for deletion in deletions:
+            self.stdout.write(f'Resuming deletion of {deletion.username} (user {deletion.user_id}) '
+                              f'from {deletion.stage or "the start"}')
+            try:
+                deletion = run_account_deletion(deletion.pk, chunk_size=options['chunk_size'])
+            except Exception as e:
+                self.stderr.write(f'  failed: {e}')
+                continue
+            finished += 1
+            self.stdout.write(f'  deleted {deletion.deleted}')
+        self.stdout.write(self.style.SUCCESS(f'Finished {finished} of {len(deletions)} account deletions'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from api.fake_openai import FakeOpenAIServer
+
+
+class Command(BaseCommand):
+    help = 'Run a fake OpenAI chat completions server for local testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before each response')
+        parser.add_argument('--chunk-delay', type=float, default=0.0, help='Seconds between streamed chunks')
+        parser.add_argument('--fail', action='store_true', help='Answer every completion with HTTP 500')
+
+    def handle(self, *args, **options):
+        server = FakeOpenAIServer(
+            host=options['host'],
+            port=options['port'],
+            delay=options['delay'],
+            fail=options['fail'],
+            chunk_delay=options['chunk_delay'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Fake OpenAI server listening on {server.base_url}'))
+        self.stdout.write(f'Run the backend with OPENAI_BASE_URL={server.base_url} and any OPENAI_API_KEY')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import mimetypes
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.heic')
+MB = 1024 * 1024
+
+# Error codes worth another attempt on top of botocore's own retries
+TRANSIENT_ERRORS = {'RequestTimeout', 'SlowDown', 'InternalError', 'ServiceUnavailable', 'Throttling'}
+
+
+def local_files(media_root, all_files=False):
+    """(key, path, size, mtime_ns) for every file to sync, in a stable order"""
+    for root, dirs, files in os.walk(media_root):
+        dirs.sort()
+        for filename in sorted(files):
+            if not all_files and not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            key = os.path.relpath(path, media_root).replace(os.sep, '/')
+            yield key, path, stat.st_size, stat.st_mtime_ns
+
+
+def local_etag(path, part_size, parts):
+    """The ETag S3 reports for this file when uploaded in `parts` parts (1 = plain MD5)"""
+    with open(path, 'rb') as file:
+        if parts <= 1:
+            digest = hashlib.md5()
+            for chunk in iter(lambda: file.read(MB), b''):
+                digest.update(chunk)
+            return digest.hexdigest()
+        part_digests = [hashlib.md5(chunk).digest() for chunk in iter(lambda: file.read(part_size), b'')]
+    return f'{hashlib.md5(b"".join(part_digests)).hexdigest()}-{len(part_digests)}'
+
+
+def is_transient(error):
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in TRANSIENT_ERRORS
+    return isinstance(error, (BotoCoreError, ConnectionError, TimeoutError))
+
+
+class Manifest:
+    """Append-only JSON lines of files already synced, so an interrupted run can resume"""
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.entries = {}
+        complete = True
+        if path and os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    complete = line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    self.entries[entry['key']] = entry
+        self._file = open(path, 'a') if path and not read_only else None
+        if self._file and not complete:
+            # Don't append the next entry to the cut-off line
+            self._file.write('\n')
+
+    def is_current(self, key, size, mtime_ns):
+        entry = self.entries.get(key)
+        return entry is not None and entry['size'] == size and entry['mtime_ns'] == mtime_ns
+
+    def record(self, key, size, mtime_ns):
+        self.entries[key] = {'key': key, 'size': size, 'mtime_ns': mtime_ns}
+        if self._file:
+            self._file.write(json.dumps(self.entries[key]) + '\n')
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+class Command(BaseCommand):
+    help = 'Upload local media files to the S3 bucket, skipping files that are already there'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=os.path.join(settings.BASE_DIR, 'media'), help='Local media directory')
+        parser.add_argument('--prefix', default='', help='Only sync keys under this prefix (e.g. garments/)')
+        parser.add_argument('--workers', type=int, default=16, help='Files uploaded in parallel')
+        parser.add_argument('--multipart-threshold', type=int, default=8, help='MB from which files are uploaded in parts')
+        parser.add_argument('--manifest', default=os.path.join(settings.BASE_DIR, '.s3_sync_manifest.jsonl'),
+                            help='Progress file for resuming; pass an empty string to disable')
+        parser.add_argument('--retries', type=int, default=5, help='Attempts per file for transient errors')
+        parser.add_argument('--all-files', action='store_true', help='Sync every file, not just images')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be uploaded')
+
+    def handle(self, *args, **options):
+        if not settings.USE_S3:
+            raise CommandError('S3 storage is not enabled; set the AWS_* environment variables first')
+        if not os.path.isdir(options['source']):
+            raise CommandError(f"{options['source']} is not a directory")
+
+        workers = max(1, options['workers'])
+        self.client = boto3.client(
+            's3',
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            region_name=settings.AWS_S3_REGION_NAME,
+            endpoint_url=getattr(settings, 'AWS_S3_ENDPOINT_URL', None),
+            config=Config(
+                retries={'max_attempts': options['retries'], 'mode': 'adaptive'},
+                max_pool_connections=workers * 4,
+            ),
+        )
+        self.bucket = settings.AWS_STORAGE_BUCKET_NAME
+        self.part_size = max(5, options['multipart_threshold']) * MB
+        self.transfer = TransferConfig(
+            multipart_threshold=options['multipart_threshold'] * MB,
+            multipart_chunksize=self.part_size,
+            max_concurrency=4,
+        )
+        self.retries = options['retries']
+        cache_control = getattr(settings, 'AWS_S3_OBJECT_PARAMETERS', {}).get('CacheControl')
+        self.extra_args = {'CacheControl': cache_control} if cache_control else {}
+
+        started = time.perf_counter()
+        remote = self.list_bucket(options['prefix'])
+        self.stdout.write(f'{len(remote)} objects in s3://{self.bucket}/{options["prefix"]} '
+                          f'(listed in {time.perf_counter() - started:.1f}s)')
+
+        manifest = Manifest(options['manifest'] or None, read_only=options['dry_run'])
+        files = [
+            (key, path, size, mtime_ns, remote.get(key))
+            for key, path, size, mtime_ns in local_files(options['source'], options['all_files'])
+            if key.startswith(options['prefix'])
+        ]
+        self.stdout.write(f'{len(files)} local files to check')
+
+        uploaded = skipped = failed = sent_bytes = 0
+        upload_started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(self.sync_file, manifest, *file, dry_run=options['dry_run']): file
+                    for file in files
+                }
+                for future in as_completed(futures):
+                    key, _, size, mtime_ns, _ = futures[future]
+                    outcome, error = future.result()
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'  {key}: {error}')
+                        continue
+                    if outcome == 'skipped':
+                        skipped += 1
+                    else:
+                        uploaded += 1
+                        sent_bytes += size
+                        if options['dry_run']:
+                            self.stdout.write(f'  would upload {key} ({size} bytes)')
+                            continue
+                    if not manifest.is_current(key, size, mtime_ns):
+                        manifest.record(key, size, mtime_ns)
+                    if outcome == 'uploaded' and uploaded % 100 == 0:
+                        elapsed = time.perf_counter() - upload_started
+                        self.stdout.write(f'  {uploaded} uploaded, {skipped} skipped, '
+                                          f'{uploaded / elapsed:.1f} files/s, {sent_bytes / MB / elapsed:.1f} MB/s')
+        finally:
+            manifest.close()
+
+        if options['dry_run']:
+            self.stdout.write(f'Would upload {uploaded} files ({sent_bytes / MB:.1f} MB); {skipped} already in sync')
+            return
+
+        elapsed = max(time.perf_counter() - upload_started, 1e-9)
+        self.stdout.write(self.style.SUCCESS(
+            f'Uploaded {uploaded} files ({sent_bytes / MB:.1f} MB) in {elapsed:.1f}s: '
+            f'{uploaded / elapsed:.1f} files/s, {sent_bytes / MB / elapsed:.1f} MB/s; '
+            f'{skipped} skipped, {failed} failed'
+        ))
+        if failed:
+            raise CommandError(f'{failed} files failed; run the command again to retry them')
+
+    def list_bucket(self, prefix):
+        """{key: (size, etag)} from one paginated ListObjectsV2 pass"""
+        remote = {}
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                remote[obj['Key']] = (obj['Size'], obj['ETag'].strip('"'))
+        return remote
+
+    def up_to_date(self, key, path, size, mtime_ns, remote, manifest):
+        if remote is None or remote[0] != size:
+            return False
+        if manifest.is_current(key, size, mtime_ns):
+            # Uploaded by an earlier run and unchanged locally since
+            return True
+        etag = remote[1]
+        parts = int(etag.rsplit('-', 1)[1]) if '-' in etag else 1
+        if parts > 1 and parts != -(-size // self.part_size):
+            # Uploaded with another part size; the size match will have to do
+            return True
+        return local_etag(path, self.part_size, parts) == etag
+
+    def sync_file(self, manifest, key, path, size, mtime_ns, remote, dry_run=False):
+        """Thread worker: ('skipped' | 'uploaded', error message or None) for one local file"""
+        try:
+            if self.up_to_date(key, path, size, mtime_ns, remote, manifest):
+                return 'skipped', None
+        except OSError as e:
+            return None, str(e)
+        if dry_run:
+            return 'uploaded', None
+        return 'uploaded', self.upload(key, path)
+
+    def upload(self, key, path):
+        """Upload one file, retrying transient errors; returns an error message or None"""
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        for attempt in range(1, self.retries + 1):
+            try:
+                self.client.upload_file(
+                    path, self.bucket, key,
+                    ExtraArgs=dict(self.extra_args, ContentType=content_type),
+                    Config=self.transfer,
+                )
+                return None
+            except Exception as e:
+                cause = getattr(e, '__cause__', None) or e
+                if attempt == self.retries or not (is_transient(e) or is_transient(cause)):
+                    return str(e)
+                time.sleep(min(2 ** attempt * 0.1, 5))
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+def create_username_pattern_index(apps, schema_editor):
+    """LIKE 'prefix%' index for username__startswith (PostgreSQL only)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        # The unique constraint on username usually comes with a *_like index already
+        cursor.execute(
+            "SELECT 1 FROM pg_indexes WHERE tablename = 'auth_user' AND indexdef LIKE %s",
+            ['%(username varchar_pattern_ops)%'],
+        )
+        if cursor.fetchone():
+            return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS auth_user_username_pattern_idx ON auth_user (username varchar_pattern_ops);'
+    )
+
+
+def drop_username_pattern_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS auth_user_username_pattern_idx;')
+
+
+class Migration(migrations.Migration):
+    """Case-insensitive index on auth_user.email for email__iexact lookups, and a
+    pattern index on auth_user.username for allocate_username's prefix scan"""
+
+    dependencies = [
+        ('api', '0006_profile_fcm_token'),
+        # Run after the last auth_user alteration; SQLite table rebuilds drop custom indexes
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS auth_user_email_upper_idx ON auth_user (UPPER(email));',
+            reverse_sql='DROP INDEX IF EXISTS auth_user_email_upper_idx;',
+        ),
+        migrations.RunPython(create_username_pattern_index, drop_username_pattern_index),
+    ]
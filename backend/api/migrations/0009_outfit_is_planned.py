@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_recommendationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outfit',
+            name='is_planned',
+            field=models.BooleanField(default=False, help_text='Created by the outfit planner; replaced when the range is re-planned'),
+        ),
+    ]
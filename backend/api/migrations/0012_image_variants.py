@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_llmusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='garment',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, help_text='Resized copies of image (see api/images.py)'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='profile_picture_variants',
+            field=models.JSONField(blank=True, default=dict, help_text='Resized copies of profile_picture (see api/images.py)'),
+        ),
+    ]
@@ -1,14 +1,17 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 import random
 import string
+import uuid
 
 class Profile(models.Model):
     """Extended user profile"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     bio = models.TextField(max_length=500, blank=True)
     profile_picture = models.ImageField(upload_to='profiles/', null=True, blank=True)
+    profile_picture_variants = models.JSONField(default=dict, blank=True, help_text="Resized copies of profile_picture (see api/images.py)")
     fcm_token = models.CharField(max_length=255, blank=True, null=True, help_text="Firebase Cloud Messaging token")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -91,6 +94,7 @@ class Garment(models.Model):
     
     # Image - S3 Upload
     image = models.ImageField(upload_to='garments/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, help_text="Resized copies of image (see api/images.py)")
     
     # Clothing Attributes
     season = models.CharField(max_length=10, choices=SEASON_CHOICES, default='all')
@@ -159,6 +163,7 @@ class Outfit(models.Model):
     # Weather/Date information
     weather = models.CharField(max_length=100, blank=True)
     date = models.DateField(blank=True, null=True)
+    is_planned = models.BooleanField(default=False, help_text="Created by the outfit planner; replaced when the range is re-planned")
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -214,3 +219,140 @@ class WearHistory(models.Model):
     
     class Meta:
         ordering = ['-date_worn']
+
+class RecommendationJob(models.Model):
+    """Outfit recommendation request processed by the background worker pool"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendation_jobs')
+    theme = models.CharField(max_length=200, blank=True)
+    weather = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Recommendation job {self.id} ({self.status})"
+    
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['owner', 'status']),
+        ]
+
+class DailyOutfit(models.Model):
+    """Precomputed outfit of the day for a user"""
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_outfits')
+    date = models.DateField()
+    weather = models.CharField(max_length=100, blank=True)
+    result = models.JSONField()
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Outfit of the day for {self.owner} on {self.date}"
+    
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'date'], name='unique_daily_outfit_per_day'),
+        ]
+
+class LLMUsage(models.Model):
+    """Token usage of one OpenAI call, for metering and daily budgets"""
+    SOURCE_CHOICES = [
+        ('recommendation', 'Recommendation'),
+        ('stream', 'Streaming recommendation'),
+    ]
+    
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='llm_usage')
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    model = models.CharField(max_length=50)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.owner} used {self.prompt_tokens + self.completion_tokens} tokens ({self.source})"
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['owner', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
+
+class StoredImage(models.Model):
+    """One stored copy of a garment photo, shared by every garment with the same bytes"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=100, unique=True, help_text="Storage name used by Garment.image")
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0, help_text="Garments whose image is this file")
+    phash = models.CharField(max_length=16, blank=True, help_text="64-bit difference hash for near-duplicate detection")
+    variants = models.JSONField(default=dict, blank=True, help_text="Resized copies, shared by the garments using it")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} garments)"
+
+class AccountDeletion(models.Model):
+    """Progress of a background account deletion; outlives the user row it deletes"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    # Not a foreign key: the user is the last thing deleted
+    user_id = models.IntegerField(unique=True)
+    username = models.CharField(max_length=150)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    stage = models.CharField(max_length=30, blank=True, help_text="Step in progress (see api/account_deletion.py)")
+    deleted = models.JSONField(default=dict, blank=True, help_text="Rows and files deleted per step")
+    error = models.TextField(blank=True)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Deletion of {self.username} ({self.status})"
+    
+    class Meta:
+        ordering = ['-requested_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+class IdempotencyKey(models.Model):
+    """Stored response for a client's Idempotency-Key, replayed when the request is retried"""
+    # Not a foreign key: rows are short-lived and purged by expiry
+    user_id = models.IntegerField()
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 of method, path and body")
+    # Null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    
+    def __str__(self):
+        return f"{self.key} for user {self.user_id} ({self.status_code or 'pending'})"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
@@ -0,0 +1,425 @@
+"""
+Replay of edits queued by the PWA while it was offline.
+
+apply_operations() takes the ordered queue in one request and applies it in
+a single transaction, returning one result per operation. Each operation
+carries a client op_id. Applied operations are remembered in IdempotencyKey
+(as "op:<op_id>"), so a queue resent after a dropped response replays the
+stored results instead of applying them twice. Later operations can refer
+to a garment or outfit created earlier in the queue as "@<op_id>"; the
+reference must name a create of the kind the field expects.
+
+Consecutive operations of the same kind are applied together where the
+SQL allows: runs of creates become one bulk_create, and runs of wear,
+toggle_favorite and laundry operations become a few UPDATEs. Other
+operations go through the same serializers as the REST endpoints, one
+savepoint each, so a failing operation leaves the rest of the queue applied.
+"""
+import hashlib
+import json
+from itertools import groupby
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import Http404
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from .changes import publish_changes
+from .models import Garment, IdempotencyKey, LaundryItem, Outfit
+from .serializers import GarmentSerializer, OutfitSerializer
+from .theme_index import theme_index
+
+OP_KEY_PREFIX = 'op:'
+MAX_OP_ID_LENGTH = 200
+
+
+class SyncError(Exception):
+    """Raised when the queue as a whole is malformed; the message is safe to show"""
+
+
+class SyncConflict(Exception):
+    """Another request is applying some of the same operations"""
+
+
+class OperationError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def ok(op, status_code, data):
+    return {'op_id': op['op_id'], 'status': status_code, 'data': data}
+
+
+def failed(op, status_code, error):
+    return {'op_id': op['op_id'], 'status': status_code, 'error': error}
+
+
+def op_fingerprint(op):
+    return hashlib.sha256(json.dumps(op, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def op_kind(op_type):
+    """'garment.create' -> 'garment': the kind of object an operation's 201 result created"""
+    return op_type.split('.', 1)[0]
+
+
+def op_data(op):
+    """An operation's "data" object ({} when absent)"""
+    data = op.get('data')
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise OperationError(400, {'data': ['Must be an object']})
+    return data
+
+
+class Replay:
+    """State shared by the operations of one queue: the user, request and IDs created so far"""
+
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user
+        # op_id -> (kind, pk) for each create applied or replayed
+        self.created = {}
+        self.created_garments = False
+
+    def resolve(self, value, field='id', kind='garment'):
+        """A primary key, or "@<op_id>" for an object of this kind created earlier in the queue"""
+        if isinstance(value, str) and value.startswith('@'):
+            if value[1:] not in self.created:
+                raise OperationError(400, {field: [f'No earlier create operation "{value[1:]}"']})
+            created_kind, pk = self.created[value[1:]]
+            if created_kind != kind:
+                raise OperationError(400, {field: [f'Operation "{value[1:]}" created a {created_kind}, not a {kind}']})
+            return pk
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise OperationError(400, {field: ['Must be an ID or "@<op_id>"']})
+
+    def garment(self, op, field='id'):
+        garment = Garment.objects.filter(owner=self.user, pk=self.resolve(op.get(field), field)).first()
+        if garment is None:
+            raise OperationError(404, 'Garment not found')
+        return garment
+
+    def outfit(self, op):
+        outfit = Outfit.objects.filter(owner=self.user, pk=self.resolve(op.get('id'), kind='outfit')).first()
+        if outfit is None:
+            raise OperationError(404, 'Outfit not found')
+        return outfit
+
+    def context(self):
+        return {'request': self.request}
+
+
+# ---- Operations applied one at a time ----
+
+def garment_update(replay, op):
+    serializer = GarmentSerializer(replay.garment(op), data=op_data(op), partial=True,
+                                   context=replay.context())
+    serializer.is_valid(raise_exception=True)
+    serializer.save()
+    return 200, serializer.data
+
+
+def garment_delete(replay, op):
+    replay.garment(op).delete()
+    return 204, None
+
+
+def outfit_data(replay, op):
+    data = dict(op_data(op))
+    if 'garment_ids' in data:
+        if not isinstance(data['garment_ids'], list):
+            raise OperationError(400, {'garment_ids': ['Must be a list']})
+        data['garment_ids'] = [replay.resolve(value, 'garment_ids') for value in data['garment_ids']]
+    return data
+
+
+def outfit_create(replay, op):
+    serializer = OutfitSerializer(data=outfit_data(replay, op), context=replay.context())
+    serializer.is_valid(raise_exception=True)
+    outfit = serializer.save(owner=replay.user)
+    replay.created[op['op_id']] = ('outfit', outfit.pk)
+    return 201, serializer.data
+
+
+def outfit_update(replay, op):
+    serializer = OutfitSerializer(replay.outfit(op), data=outfit_data(replay, op), partial=True,
+                                  context=replay.context())
+    serializer.is_valid(raise_exception=True)
+    serializer.save()
+    return 200, serializer.data
+
+
+def outfit_delete(replay, op):
+    replay.outfit(op).delete()
+    return 204, None
+
+
+# ---- Operations applied a run at a time ----
+# Each takes the run's operations and returns (op, status, data or error)
+# outcomes; only the operations that succeed are written, all at once.
+
+def garments_create(replay, ops):
+    outcomes = []
+    for op in ops:
+        try:
+            data = op_data(op)
+        except OperationError as e:
+            outcomes.append([op, e.status_code, e.detail])
+            continue
+        serializer = GarmentSerializer(data=data, context=replay.context())
+        if serializer.is_valid():
+            outcomes.append([op, 201, Garment(owner=replay.user, **serializer.validated_data)])
+        else:
+            outcomes.append([op, 400, serializer.errors])
+    created = [outcome for outcome in outcomes if outcome[1] == 201]
+    if created:
+        garments = Garment.objects.bulk_create([garment for _, _, garment in created])
+        replay.created_garments = True
+        rows = GarmentSerializer(garments, many=True, context=replay.context()).data
+        for outcome, garment, row in zip(created, garments, rows):
+            replay.created[outcome[0]['op_id']] = ('garment', garment.pk)
+            outcome[2] = row
+        publish_changes(replay.user.id, 'garment', [garment.pk for garment in garments])
+    return outcomes
+
+
+def run_garments(replay, ops, field='id'):
+    """(op, garment or None, error or None) per op, loading the run's garments in one query"""
+    resolved = []
+    for op in ops:
+        try:
+            resolved.append((op, replay.resolve(op.get(field), field), None))
+        except OperationError as e:
+            resolved.append((op, None, e))
+    garments = (
+        Garment.objects.filter(owner=replay.user, pk__in={pk for _, pk, _ in resolved if pk is not None})
+        .only('id', 'name', 'status', 'is_favorite').in_bulk()
+    )
+    return [
+        (op, garments.get(pk), error or (None if pk in garments else OperationError(404, 'Garment not found')))
+        for op, pk, error in resolved
+    ]
+
+
+def garments_wear(replay, ops):
+    outcomes, worn = [], []
+    for op, garment, error in run_garments(replay, ops):
+        if error is not None:
+            outcomes.append((op, error.status_code, error.detail))
+        elif not garment.is_available():
+            outcomes.append((op, 400, 'Garment not available'))
+        else:
+            garment.status = 'dirty'
+            worn.append(garment.pk)
+            outcomes.append((op, 200, {'message': f'{garment.name} marked as worn'}))
+    if worn:
+        Garment.objects.filter(pk__in=worn).update(
+            times_worn=F('times_worn') + 1, last_worn=timezone.now().date(), status='dirty',
+            updated_at=timezone.now(),
+        )
+        publish_changes(replay.user.id, 'garment', worn)
+    return outcomes
+
+
+def garments_toggle_favorite(replay, ops):
+    outcomes, toggled = [], {}
+    for op, garment, error in run_garments(replay, ops):
+        if error is not None:
+            outcomes.append((op, error.status_code, error.detail))
+            continue
+        toggled.setdefault(garment.pk, (garment, garment.is_favorite))
+        garment.is_favorite = not garment.is_favorite
+        outcomes.append((op, 200, {'id': garment.pk, 'is_favorite': garment.is_favorite}))
+    # An even number of toggles leaves a garment as it was
+    for value in (True, False):
+        changed = [pk for pk, (garment, before) in toggled.items() if garment.is_favorite == value != before]
+        if changed:
+            Garment.objects.filter(pk__in=changed).update(is_favorite=value, updated_at=timezone.now())
+            publish_changes(replay.user.id, 'garment', changed)
+    return outcomes
+
+
+def laundry_add(replay, ops):
+    outcomes = []
+    for op, garment, error in run_garments(replay, ops, field='garment_id'):
+        if error is not None:
+            outcomes.append([op, error.status_code, error.detail])
+        elif garment.status != 'dirty':
+            outcomes.append([op, 400, 'Only dirty garments can go in the laundry'])
+        else:
+            garment.status = 'washing'
+            outcomes.append([op, 201, LaundryItem(garment=garment, notes=op.get('notes') or '')])
+    added = [outcome for outcome in outcomes if outcome[1] == 201]
+    if added:
+        items = LaundryItem.objects.bulk_create([item for _, _, item in added])
+        Garment.objects.filter(pk__in=[item.garment_id for item in items]).update(
+            status='washing', updated_at=timezone.now(),
+        )
+        for outcome, item in zip(added, items):
+            outcome[2] = {'id': item.pk, 'garment_id': item.garment_id}
+        publish_changes(replay.user.id, 'laundry', [item.pk for item in items])
+        publish_changes(replay.user.id, 'garment', [item.garment_id for item in items])
+    return outcomes
+
+
+def laundry_complete(replay, ops):
+    ids = {}
+    for op in ops:
+        try:
+            ids[op['op_id']] = int(op.get('id'))
+        except (TypeError, ValueError):
+            pass
+    items = LaundryItem.objects.filter(garment__owner=replay.user, pk__in=ids.values()).in_bulk()
+    outcomes, completed = [], {}
+    for op in ops:
+        item = items.get(ids.get(op['op_id']))
+        if item is None:
+            outcomes.append((op, 404, 'Laundry item not found'))
+        else:
+            completed[item.pk] = item.garment_id
+            outcomes.append((op, 200, {'id': item.pk, 'garment_id': item.garment_id}))
+    if completed:
+        LaundryItem.objects.filter(pk__in=completed).update(is_completed=True, completion_date=timezone.now().date())
+        Garment.objects.filter(pk__in=set(completed.values())).update(status='clean', updated_at=timezone.now())
+        publish_changes(replay.user.id, 'laundry', list(completed))
+        publish_changes(replay.user.id, 'garment', set(completed.values()))
+    return outcomes
+
+
+SINGLE_OPERATIONS = {
+    'garment.update': garment_update,
+    'garment.delete': garment_delete,
+    'outfit.create': outfit_create,
+    'outfit.update': outfit_update,
+    'outfit.delete': outfit_delete,
+}
+RUN_OPERATIONS = {
+    'garment.create': garments_create,
+    'garment.wear': garments_wear,
+    'garment.toggle_favorite': garments_toggle_favorite,
+    'laundry.add': laundry_add,
+    'laundry.complete': laundry_complete,
+}
+OPERATION_TYPES = sorted(SINGLE_OPERATIONS) + sorted(RUN_OPERATIONS)
+
+
+def apply_single(replay, op):
+    try:
+        with transaction.atomic():
+            status_code, data = SINGLE_OPERATIONS[op['type']](replay, op)
+    except OperationError as e:
+        return failed(op, e.status_code, e.detail)
+    except ValidationError as e:
+        return failed(op, 400, e.detail)
+    except Http404:
+        return failed(op, 404, 'Not found')
+    return ok(op, status_code, data)
+
+
+def apply_run(replay, op_type, ops):
+    with transaction.atomic():
+        outcomes = RUN_OPERATIONS[op_type](replay, ops)
+    return [
+        ok(op, status_code, detail) if status_code < 400 else failed(op, status_code, detail)
+        for op, status_code, detail in outcomes
+    ]
+
+
+def check_operations(operations):
+    if not isinstance(operations, list) or not operations:
+        raise SyncError('operations must be a non-empty list')
+    limit = getattr(settings, 'OFFLINE_SYNC_MAX_OPERATIONS', 500)
+    if len(operations) > limit:
+        raise SyncError(f'At most {limit} operations per request')
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict):
+            raise SyncError(f'Operation {index} must be an object')
+        op_id = op.get('op_id')
+        if not isinstance(op_id, str) or not op_id or len(op_id) > MAX_OP_ID_LENGTH:
+            raise SyncError(f'Operation {index} needs an op_id string of at most {MAX_OP_ID_LENGTH} characters')
+        if op.get('type') not in SINGLE_OPERATIONS and op.get('type') not in RUN_OPERATIONS:
+            raise SyncError(f'Operation {op_id} has unknown type {op.get("type")!r}; '
+                            f'expected one of {", ".join(OPERATION_TYPES)}')
+
+
+def apply_operations(request, operations, all_or_nothing=False):
+    """Apply the queue in order; returns (results in queue order, committed)"""
+    check_operations(operations)
+    user_id = request.user.id
+    replay = Replay(request)
+    fingerprints, op_types = {}, {}
+    for op in operations:
+        fingerprints.setdefault(op['op_id'], op_fingerprint(op))
+        op_types.setdefault(op['op_id'], op['type'])
+
+    with transaction.atomic():
+        now = timezone.now()
+        keys = [OP_KEY_PREFIX + op_id for op_id in fingerprints]
+        IdempotencyKey.objects.filter(user_id=user_id, key__in=keys, expires_at__lte=now).delete()
+        stored = {
+            row.key[len(OP_KEY_PREFIX):]: row
+            for row in IdempotencyKey.objects.filter(user_id=user_id, key__in=keys)
+        }
+        results = {}
+        for op_id, row in stored.items():
+            if row.fingerprint != fingerprints[op_id]:
+                results[op_id] = {'op_id': op_id, 'status': 422,
+                                  'error': 'op_id was already used for a different operation'}
+                continue
+            results[op_id] = dict(row.response or {}, replayed=True)
+            # Creates replayed from an earlier request still resolve "@<op_id>"; the matching
+            # fingerprint means this queue's op has the type the stored result came from
+            if row.status_code == 201 and isinstance(results[op_id].get('data'), dict):
+                replay.created[op_id] = (op_kind(op_types[op_id]), results[op_id]['data'].get('id'))
+
+        # First occurrence of each op_id not seen before, in queue order
+        fresh, seen = [], set(results)
+        for op in operations:
+            if op['op_id'] not in seen:
+                seen.add(op['op_id'])
+                fresh.append(dict(op))
+        for op_type, run in groupby(fresh, key=lambda op: op['type']):
+            run = list(run)
+            if op_type in RUN_OPERATIONS:
+                run_results = apply_run(replay, op_type, run)
+            else:
+                run_results = [apply_single(replay, op) for op in run]
+            for result in run_results:
+                results[result['op_id']] = result
+
+        applied = [results[op['op_id']] for op in fresh]
+        committed = not (all_or_nothing and any(result['status'] >= 400 for result in applied))
+        if committed:
+            expires_at = now + timezone.timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+            try:
+                # Unique (user_id, key) stops a concurrent resend from applying the same operations
+                with transaction.atomic():
+                    IdempotencyKey.objects.bulk_create([
+                        IdempotencyKey(
+                            user_id=user_id, key=OP_KEY_PREFIX + result['op_id'],
+                            fingerprint=fingerprints[result['op_id']], status_code=result['status'],
+                            response=result, expires_at=expires_at,
+                        )
+                        for result in applied
+                    ])
+            except IntegrityError:
+                raise SyncConflict('Some of these operations are being applied by another request; retry shortly')
+        else:
+            transaction.set_rollback(True)
+
+    if committed and replay.created_garments:
+        theme_index.forget_user(user_id)
+    ordered, reported = [], set()
+    for op in operations:
+        result = results[op['op_id']]
+        if op['op_id'] in reported:
+            result = dict(result, replayed=True)
+        reported.add(op['op_id'])
+        ordered.append(result)
+    return ordered, committed
@@ -0,0 +1,206 @@
+"""
+Shared OpenAI clients with strict deadlines and a circuit breaker.
+
+One client per process (per event loop for the async client) so HTTP
+connections are reused across requests. Every call goes through
+`openai_breaker`: after OPENAI_BREAKER_FAILURES consecutive failures the
+breaker opens and calls fail immediately with CircuitOpenError, sending
+callers straight to the local recommender until OPENAI_BREAKER_RESET
+seconds pass and a single probe call succeeds.
+"""
+import asyncio
+import os
+import threading
+import time
+import weakref
+from collections import deque
+import httpx
+from django.conf import settings
+from openai import OpenAI, AsyncOpenAI
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling OpenAI while the breaker is open"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with latency counters"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, latency_window=200):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self.total_latency = 0.0
+        self._latencies = deque(maxlen=latency_window)
+
+    def allow_request(self):
+        """Return True if a call may go upstream now"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.short_circuited += 1
+                    return False
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                # Only one probe at a time while deciding whether to close
+                if self._probe_in_flight:
+                    self.short_circuited += 1
+                    return False
+                self._probe_in_flight = True
+            self.calls += 1
+            return True
+
+    def record_success(self, latency):
+        with self._lock:
+            self.successes += 1
+            self._record_latency(latency)
+            self.consecutive_failures = 0
+            self.state = self.CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self, latency):
+        with self._lock:
+            self.failures += 1
+            self._record_latency(latency)
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def _record_latency(self, latency):
+        self.total_latency += latency
+        self._latencies.append(latency)
+
+    def reset(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            recent = sorted(self._latencies)
+            completed = self.successes + self.failures
+
+            def percentile(fraction):
+                if not recent:
+                    return 0.0
+                return round(recent[min(len(recent) - 1, int(len(recent) * fraction))] * 1000, 1)
+
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'calls': self.calls,
+                'successes': self.successes,
+                'failures': self.failures,
+                'short_circuited': self.short_circuited,
+                'avg_latency_ms': round(self.total_latency / completed * 1000, 1) if completed else 0.0,
+                'p50_latency_ms': percentile(0.5),
+                'p95_latency_ms': percentile(0.95),
+            }
+
+
+openai_breaker = CircuitBreaker(
+    failure_threshold=getattr(settings, 'OPENAI_BREAKER_FAILURES', 5),
+    reset_timeout=getattr(settings, 'OPENAI_BREAKER_RESET', 30),
+)
+
+_client_lock = threading.Lock()
+_clients = {}
+# event loop -> {(api_key, base_url): AsyncOpenAI}; httpx async pools are bound to their loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _client_options():
+    return {
+        'api_key': os.getenv('OPENAI_API_KEY'),
+        'base_url': os.getenv('OPENAI_BASE_URL') or None,
+        'timeout': httpx.Timeout(
+            getattr(settings, 'OPENAI_TIMEOUT', 20),
+            connect=getattr(settings, 'OPENAI_CONNECT_TIMEOUT', 3),
+        ),
+        'max_retries': getattr(settings, 'OPENAI_MAX_RETRIES', 0),
+    }
+
+
+def get_client():
+    """Process-wide OpenAI client (one per key/base URL) that reuses connections"""
+    options = _client_options()
+    key = (options['api_key'], options['base_url'])
+    with _client_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = OpenAI(**options)
+        return client
+
+
+def get_async_client():
+    """AsyncOpenAI client shared by all requests on the running event loop"""
+    options = _client_options()
+    key = (options['api_key'], options['base_url'])
+    loop_clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = loop_clients.get(key)
+    if client is None:
+        client = loop_clients[key] = AsyncOpenAI(**options)
+    return client
+
+
+def chat_completion(**kwargs):
+    """Create a chat completion through the breaker; raises CircuitOpenError when open"""
+    if not openai_breaker.allow_request():
+        raise CircuitOpenError('OpenAI circuit breaker is open')
+    started = time.monotonic()
+    try:
+        response = get_client().chat.completions.create(**kwargs)
+    except Exception:
+        openai_breaker.record_failure(time.monotonic() - started)
+        raise
+    openai_breaker.record_success(time.monotonic() - started)
+    return response
+
+
+async def stream_chat_completion(on_usage=None, **kwargs):
+    """
+    Yield streamed completion text deltas through the breaker.
+
+    With on_usage, token usage is requested and on_usage(model, usage) is
+    called when the final chunk reports it.
+    """
+    if not openai_breaker.allow_request():
+        raise CircuitOpenError('OpenAI circuit breaker is open')
+    if on_usage is not None:
+        kwargs['stream_options'] = {'include_usage': True}
+    started = time.monotonic()
+    try:
+        stream = await get_async_client().chat.completions.create(stream=True, **kwargs)
+        async for chunk in stream:
+            if chunk.usage is not None and on_usage is not None:
+                on_usage(chunk.model, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except (GeneratorExit, asyncio.CancelledError):
+        # The consumer went away (client disconnect); upstream was healthy
+        openai_breaker.record_success(time.monotonic() - started)
+        raise
+    except Exception:
+        openai_breaker.record_failure(time.monotonic() - started)
+        raise
+    openai_breaker.record_success(time.monotonic() - started)
+
+
+def openai_stats():
+    """Breaker state and latency counters for this process"""
+    return openai_breaker.stats()
@@ -0,0 +1,187 @@
+"""
+Local multi-day outfit planner.
+
+Plans one outfit per day (one garment per category) with the local scoring
+engine. A garment worn on day d is not planned again before day
+d + laundry_gap. Garments that are dirty or in the laundry only become
+available once they could be washed. Every planned wear lowers a garment's
+score for the following days, which spreads wear across the wardrobe.
+Each day is scored as one bounded combination grid (see
+scoring.MAX_COMBINATIONS), so planning time grows linearly with the number
+of days and wardrobe size.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .changes import publish_changes
+from .models import Garment, LaundryItem, Outfit
+from .scoring import WardrobeArrays, garment_scores, score_combinations
+
+# Garments that can be planned at all (damaged ones are left out)
+PLANNABLE_STATUSES = ['clean', 'dirty', 'washing']
+
+# Score lost per planned wear within the range
+PLANNED_WEAR_PENALTY = 0.5
+
+# Longest theme and weather text that fit Outfit.name (with the date suffix) and Outfit.weather
+MAX_THEME_LENGTH = Outfit._meta.get_field('name').max_length - len(' - Mon Jan 01')
+MAX_WEATHER_LENGTH = Outfit._meta.get_field('weather').max_length
+
+
+class PlanError(Exception):
+    """Raised when a plan can't be made from the user's wardrobe"""
+
+
+def availability(statuses, last_worn, garment_ids, start_date, laundry_gap, washing_until=None):
+    """
+    First day offset (0 = start_date) on which each garment may be worn.
+
+    Clean garments are available once the laundry gap since they were last
+    worn has passed. Dirty garments need one laundry gap to be washed.
+    Garments in the laundry are available from their estimated completion
+    date, or after one laundry gap if there is no estimate.
+    """
+    washing_until = washing_until or {}
+    first_day = np.zeros(len(statuses), dtype=np.int32)
+    for i, (status, worn) in enumerate(zip(statuses, last_worn)):
+        if status == 'dirty':
+            first_day[i] = laundry_gap
+        elif status == 'washing':
+            estimate = washing_until.get(int(garment_ids[i]))
+            first_day[i] = (estimate - start_date).days if estimate else laundry_gap
+        if worn:
+            first_day[i] = max(first_day[i], (worn - start_date).days + laundry_gap)
+    return first_day
+
+
+def solve_plan(wardrobe, days, first_day, laundry_gap, seed=None):
+    """
+    Pick one outfit per day.
+
+    `days` is a list of (day offset, date, weather) tuples in date order, and
+    `first_day` comes from availability(). Returns a list of outfits, one
+    per day. Each outfit is a list of wardrobe row indices and may be empty
+    if nothing is available.
+    """
+    rng = np.random.default_rng(seed)
+    next_free = first_day.astype(np.int64)
+    planned_wears = np.zeros(len(wardrobe), dtype=np.float32)
+    plan = []
+    for offset, date, weather in days:
+        available = next_free <= offset
+        if not available.any():
+            plan.append([])
+            continue
+        scores = (
+            garment_scores(wardrobe, weather, today=date)
+            - PLANNED_WEAR_PENALTY * planned_wears
+            + rng.uniform(0, 0.15, len(wardrobe)).astype(np.float32)
+        )
+        grid, combo_scores = score_combinations(wardrobe, scores, available)
+        chosen = grid[int(np.argmax(combo_scores))]
+        next_free[chosen] = offset + max(laundry_gap, 1)
+        planned_wears[chosen] += 1
+        plan.append([int(row) for row in chosen])
+    return plan
+
+
+def occasion_for_theme(theme):
+    """Map a free-text theme to an Outfit occasion code, or '' if none matches"""
+    words = set(str(theme or '').lower().replace('-', ' ').split())
+    for code, label in Outfit.OCCASION_CHOICES:
+        if code in words or set(label.lower().split()) <= words:
+            return code
+    return ''
+
+
+def outfit_name(theme, date):
+    """Name of the outfit planned for `date`"""
+    return f"{theme.title()} - {date:%a %b %d}"
+
+
+def plan_outfits(user, start_date, end_date, themes, weather, laundry_gap=None, seed=None):
+    """
+    Plan and store an outfit for each day from start_date to end_date.
+
+    `themes` and `weather` map each date to its theme and weather. Outfits
+    from an earlier plan in the range are replaced. Days that already have
+    an outfit the user created are kept, and their garments count as worn
+    on that day. Returns (planned outfits, days left without an outfit,
+    days kept).
+    """
+    if laundry_gap is None:
+        laundry_gap = getattr(settings, 'PLANNER_LAUNDRY_GAP_DAYS', 3)
+    dates = [start_date + timezone.timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
+    rows = list(
+        Garment.objects.filter(owner=user, status__in=PLANNABLE_STATUSES)
+        .values_list(*WardrobeArrays.FIELDS, 'status')
+    )
+    if not rows:
+        raise PlanError('No garments available in your wardrobe')
+    wardrobe = WardrobeArrays([row[:-1] for row in rows], today=start_date)
+    washing_until = dict(
+        LaundryItem.objects.filter(garment__owner=user, is_completed=False, estimated_completion__isnull=False)
+        .values_list('garment_id', 'estimated_completion')
+    )
+    first_day = availability(
+        [row[-1] for row in rows], [row[5] for row in rows], wardrobe.ids,
+        start_date, laundry_gap, washing_until,
+    )
+
+    # The user's own outfits in (and just before) the range stay, and block their garments
+    row_index = {int(garment_id): i for i, garment_id in enumerate(wardrobe.ids)}
+    kept_dates = set()
+    manual = Outfit.garments.through.objects.filter(
+        outfit__owner=user,
+        outfit__is_planned=False,
+        outfit__date__gte=start_date - timezone.timedelta(days=laundry_gap),
+        outfit__date__lte=end_date,
+    ).values_list('outfit__date', 'garment_id')
+    for outfit_date, garment_id in manual:
+        if outfit_date >= start_date:
+            kept_dates.add(outfit_date)
+        if garment_id in row_index:
+            i = row_index[garment_id]
+            first_day[i] = max(first_day[i], (outfit_date - start_date).days + max(laundry_gap, 1))
+
+    plan_dates = [date for date in dates if date not in kept_dates]
+    plan = solve_plan(
+        wardrobe,
+        [((date - start_date).days, date, weather[date]) for date in plan_dates],
+        first_day, laundry_gap, seed,
+    )
+    plan_by_date = dict(zip(plan_dates, plan))
+
+    outfits = []
+    links = []
+    empty_dates = []
+    for date in plan_dates:
+        garment_rows = plan_by_date[date]
+        if not garment_rows:
+            empty_dates.append(date)
+            continue
+        theme = themes[date]
+        outfits.append(Outfit(
+            owner=user,
+            name=outfit_name(theme, date),
+            occasion=occasion_for_theme(theme),
+            weather=weather[date],
+            date=date,
+            notes=f"Planned for {theme} in {weather[date]} weather",
+            is_planned=True,
+        ))
+        links.append([int(wardrobe.ids[row]) for row in garment_rows])
+
+    with transaction.atomic():
+        Outfit.objects.filter(owner=user, is_planned=True, date__gte=start_date, date__lte=end_date).delete()
+        Outfit.objects.bulk_create(outfits)
+        Outfit.garments.through.objects.bulk_create([
+            Outfit.garments.through(outfit_id=outfit.id, garment_id=garment_id)
+            for outfit, garment_ids in zip(outfits, links)
+            for garment_id in garment_ids
+        ])
+        # bulk_create fires no signals; the deleted outfits publish their own events
+        publish_changes(user.id, 'outfit', [outfit.pk for outfit in outfits])
+    return outfits, empty_dates, sorted(kept_dates)
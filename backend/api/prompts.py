@@ -0,0 +1,162 @@
+"""
+Token-budgeted prompt construction for AI outfit recommendations.
+
+Garments are ranked per category by how well they match the theme (see
+theme_index), suit the season and weather, and how recently they were
+worn, then written as a compact
+pipe-separated table. Rows are added round-robin across categories until
+the PROMPT_TOKEN_BUDGET is reached, so every category stays represented
+and large wardrobes never overflow the model context.
+"""
+import re
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encoding = None
+
+# Words in the free-text weather that point at a season
+WEATHER_SEASONS = {
+    'summer': ['hot', 'warm', 'sunny', 'humid', 'heat', 'summer', 'beach'],
+    'winter': ['cold', 'freezing', 'snow', 'snowy', 'icy', 'winter', 'chilly'],
+    'autumn': ['cool', 'windy', 'autumn', 'fall', 'crisp'],
+    'spring': ['mild', 'rain', 'rainy', 'showers', 'spring', 'breezy'],
+}
+
+MONTH_SEASONS = {
+    12: 'winter', 1: 'winter', 2: 'winter',
+    3: 'spring', 4: 'spring', 5: 'spring',
+    6: 'summer', 7: 'summer', 8: 'summer',
+    9: 'autumn', 10: 'autumn', 11: 'autumn',
+}
+
+TABLE_HEADER = 'id|name|category|color|brand|season'
+
+
+def estimate_tokens(text):
+    """Count tokens with tiktoken when installed, otherwise a word/punctuation estimate"""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding('o200k_base')
+        return len(_encoding.encode(text))
+    # BPE tokenizers average about one token per word or punctuation mark,
+    # with long words split into ~4-character pieces
+    return sum(max(1, len(piece) // 4) for piece in re.findall(r'\w+|[^\w\s]', text))
+
+
+def target_seasons(weather, today=None):
+    """Seasons that suit the weather text, falling back to the calendar season"""
+    words = set(re.findall(r'[a-z]+', (weather or '').lower()))
+    seasons = {season for season, hints in WEATHER_SEASONS.items() if words & set(hints)}
+    if not seasons:
+        seasons = {MONTH_SEASONS[(today or timezone.now().date()).month]}
+    return seasons
+
+
+def score_garment(garment, seasons, today, relevance=None):
+    """Higher is better: matches the theme, suitable season, favorite, and not worn recently or often"""
+    score = 3.0 * relevance.get(garment.id, 0.0) if relevance else 0.0
+    if garment.season in seasons:
+        score += 3.0
+    elif garment.season == 'all':
+        score += 2.0
+    if garment.is_favorite:
+        score += 1.0
+    if garment.last_worn:
+        days_since = (today - garment.last_worn).days
+        if days_since < 7:
+            score -= (7 - days_since) * 0.3
+    score -= min(garment.times_worn or 0, 50) * 0.02
+    return score
+
+
+def clean_cell(value):
+    """Keep table cells on one line and free of the column separator"""
+    return ' '.join(str(value or '').replace('|', '/').split())
+
+
+def garment_row(garment):
+    return '|'.join([
+        str(garment.id),
+        clean_cell(garment.name),
+        clean_cell(garment.category.name if garment.category else 'Uncategorized'),
+        clean_cell(garment.color or 'unknown'),
+        clean_cell(garment.brand or '-'),
+        garment.season,
+    ])
+
+
+def rank_by_category(garments, weather, today=None, relevance=None):
+    """Group garments by category name, each group sorted best-first"""
+    today = today or timezone.now().date()
+    seasons = target_seasons(weather, today)
+    groups = {}
+    for g in garments:
+        cat_name = g.category.name if g.category else 'Uncategorized'
+        groups.setdefault(cat_name, []).append(g)
+    for items in groups.values():
+        items.sort(key=lambda g: (-score_garment(g, seasons, today, relevance), g.id))
+    return groups
+
+
+def select_rows(garments, weather, token_budget, today=None, relevance=None):
+    """
+    Pick garments round-robin across ranked categories until the budget is spent.
+
+    Returns (rows, included_ids) where rows are encoded table lines.
+    """
+    groups = list(rank_by_category(garments, weather, today, relevance).values())
+    rows = []
+    included_ids = []
+    used = estimate_tokens(TABLE_HEADER)
+    depth = 0
+    while True:
+        added = False
+        for items in groups:
+            if depth >= len(items):
+                continue
+            row = garment_row(items[depth])
+            # +1 for the newline joining the rows
+            cost = estimate_tokens(row) + 1
+            if used + cost > token_budget:
+                return rows, included_ids
+            rows.append(row)
+            included_ids.append(items[depth].id)
+            used += cost
+            added = True
+        if not added:
+            return rows, included_ids
+        depth += 1
+
+
+def build_recommendation_prompt(garments, theme, weather, token_budget=None, today=None, relevance=None):
+    """Build the stylist prompt; returns (prompt, included garment ids)"""
+    if token_budget is None:
+        token_budget = getattr(settings, 'PROMPT_TOKEN_BUDGET', 3000)
+    rows, included_ids = select_rows(garments, weather, token_budget, today, relevance)
+    table = '\n'.join([TABLE_HEADER] + rows)
+    prompt = f"""You are a fashion stylist assistant. Based on the following wardrobe items, recommend 3 complete outfits for the theme: "{theme}" with weather: "{weather}".
+
+Wardrobe items (one per line, columns separated by |, best matches first within each category):
+{table}
+
+IMPORTANT RULES:
+- Pick ONLY ONE item from each category per outfit
+- Do not repeat the same category multiple times in one outfit
+- Create balanced, complete outfits
+- Use only IDs from the table above
+
+For each outfit, provide:
+1. A creative outfit name
+2. List of garment IDs to use (ONE per category only)
+3. Brief reasoning why this combination works
+4. Style tip
+
+Return JSON format:
+{{"outfits": [{{"name": "outfit name", "garment_ids": [1, 2, 3], "reasoning": "why it works", "style_tip": "additional tip"}}]}}"""
+    return prompt, included_ids
@@ -0,0 +1,145 @@
+"""
+Background outfit recommendation jobs.
+
+Jobs are stored in RecommendationJob so any worker process can answer a
+poll, while a bounded thread pool in the submitting process runs the model
+call (or the local scoring fallback) outside the request/response cycle.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework import status
+from .models import RecommendationJob
+from .recommendations import generate_recommendations
+
+ACTIVE_STATUSES = ['queued', 'running']
+
+# Jobs still queued or running after this long were lost to a worker crash or
+# restart: they stop counting against the per-user limit and are marked failed
+STALE_JOB_MINUTES = 5
+STALE_JOB_ERROR = 'The recommendation job was interrupted. Please try again.'
+
+_executor = None
+_lock = threading.Lock()
+# job id -> Event, for jobs queued or running in this process
+_pending = {}
+
+
+class JobLimitError(Exception):
+    """Raised when the queue or the user's concurrency cap is full"""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_executor():
+    """Process-wide worker pool, created on first use"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECOMMENDATION_JOB_WORKERS,
+                thread_name_prefix='recommendation-job',
+            )
+        return _executor
+
+
+def fail_stale_jobs(jobs=None):
+    """Mark stale queued/running jobs (all of them, or those in `jobs`) failed; returns how many"""
+    jobs = RecommendationJob.objects.all() if jobs is None else jobs
+    with _lock:
+        # Still in this process's pool, so not lost, just slow
+        pending = list(_pending)
+    return jobs.filter(
+        status__in=ACTIVE_STATUSES,
+        created_at__lt=timezone.now() - timezone.timedelta(minutes=STALE_JOB_MINUTES),
+    ).exclude(id__in=pending).update(status='failed', error=STALE_JOB_ERROR, finished_at=timezone.now())
+
+
+def submit_recommendation_job(user, theme, weather):
+    """Queue a recommendation job and return it without waiting for the result"""
+    with transaction.atomic():
+        # Lock the user row so concurrent submissions can't both pass the cap
+        User.objects.select_for_update().filter(pk=user.pk).first()
+        fail_stale_jobs(RecommendationJob.objects.filter(owner=user))
+        active_jobs = RecommendationJob.objects.filter(
+            owner=user,
+            status__in=ACTIVE_STATUSES,
+            created_at__gte=timezone.now() - timezone.timedelta(minutes=STALE_JOB_MINUTES),
+        ).count()
+        if active_jobs >= settings.RECOMMENDATION_JOB_USER_LIMIT:
+            raise JobLimitError(
+                'You already have recommendations in progress. Please wait for them to finish.',
+                status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+
+        executor = get_executor()
+        with _lock:
+            if len(_pending) >= settings.RECOMMENDATION_JOB_QUEUE_LIMIT:
+                raise JobLimitError(
+                    'The recommendation service is busy. Please try again shortly.',
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                )
+            job = RecommendationJob.objects.create(owner=user, theme=theme, weather=weather)
+            _pending[job.id] = threading.Event()
+
+    # Committed above, so the worker thread can see the job
+    executor.submit(_run_job, job.id)
+    return job
+
+
+def _run_job(job_id):
+    """Worker entry point: generate recommendations and store the outcome"""
+    jobs = RecommendationJob.objects.filter(id=job_id)
+    try:
+        job = jobs.select_related('owner').get()
+        jobs.update(status='running')
+        try:
+            result = generate_recommendations(job.owner, job.theme, job.weather)
+        except Exception as e:
+            jobs.update(status='failed', error=str(e), finished_at=timezone.now())
+        else:
+            jobs.update(status='done', result=result, finished_at=timezone.now())
+    except Exception as e:
+        print(f"Recommendation job {job_id} crashed: {e}")
+    finally:
+        with _lock:
+            event = _pending.pop(job_id, None)
+        if event is not None:
+            event.set()
+        # Pool threads are long-lived; don't leave a connection open per thread
+        connection.close()
+
+
+def wait_for_job(job_id, user, wait=0):
+    """
+    Return the user's job, waiting up to `wait` seconds for it to finish.
+
+    Jobs running in this process are awaited on their Event; jobs owned by
+    another process are re-read from the database at a short interval.
+    """
+    job = RecommendationJob.objects.filter(id=job_id, owner=user).first()
+    if job is not None and not job.is_finished() and fail_stale_jobs(RecommendationJob.objects.filter(pk=job.pk)):
+        job.refresh_from_db()
+    if job is None or job.is_finished() or wait <= 0:
+        return job
+
+    with _lock:
+        event = _pending.get(job.id)
+    if event is not None:
+        event.wait(wait)
+    else:
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(0.25)
+            job.refresh_from_db(fields=['status'])
+            if job.is_finished():
+                break
+
+    job.refresh_from_db()
+    return job
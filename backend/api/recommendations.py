@@ -0,0 +1,243 @@
+"""
+Outfit recommendation helpers used by the AI recommendation endpoints.
+
+Model results are cached per user, keyed by a fingerprint of the clean
+wardrobe plus the normalized theme and weather, so repeated "refresh" taps
+are served from a pool of earlier results instead of calling OpenAI again.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from .models import Garment
+from .openai_client import chat_completion
+from .prompts import build_recommendation_prompt
+from .scoring import WardrobeArrays, local_recommendations
+from .singleflight import SingleFlight
+from .theme_index import theme_index
+from .usage import over_budget, record_usage
+
+SYSTEM_PROMPT = "You are a professional fashion stylist who creates practical, stylish outfit recommendations."
+
+
+class NoCleanGarmentsError(Exception):
+    """Raised when the user has nothing clean to recommend from"""
+
+
+def normalize_text(value):
+    """Lowercase and collapse whitespace so equivalent themes share a cache entry"""
+    return ' '.join(str(value or '').lower().split())
+
+
+def wardrobe_fingerprint(garment_rows):
+    """Hash (id, updated_at) pairs of the clean garments; any edit changes the fingerprint"""
+    digest = hashlib.sha1()
+    for garment_id, updated_at in sorted(garment_rows):
+        digest.update(f"{garment_id}:{updated_at.timestamp() if updated_at else ''};".encode())
+    return digest.hexdigest()
+
+
+def validate_outfit(outfit, wardrobe_ids):
+    """Keep only known garment IDs (deduplicated, in order); None if nothing valid remains"""
+    if not isinstance(outfit, dict):
+        return None
+    garment_ids = []
+    for garment_id in outfit.get('garment_ids') or []:
+        try:
+            garment_id = int(garment_id)
+        except (TypeError, ValueError):
+            continue
+        if garment_id in wardrobe_ids and garment_id not in garment_ids:
+            garment_ids.append(garment_id)
+    if not garment_ids:
+        return None
+    return dict(outfit, garment_ids=garment_ids)
+
+
+def request_model_recommendations(garments, theme, weather, relevance=None, user_id=None):
+    """
+    Ask OpenAI for outfit recommendations; returns the parsed JSON document.
+
+    Garment IDs are checked against the garments included in the prompt, the
+    same way the streaming endpoint checks them; raises ValueError if no
+    outfit survives.
+    """
+    prompt, included_ids = build_recommendation_prompt(garments, theme, weather, relevance=relevance)
+    response = chat_completion(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.8,
+        response_format={ "type": "json_object" }
+    )
+    if user_id is not None:
+        record_usage(user_id, 'recommendation', response.model, response.usage)
+    result = json.loads(response.choices[0].message.content)
+    if not isinstance(result, dict) or not isinstance(result.get('outfits'), list):
+        raise ValueError('Model response has no outfits list')
+    wardrobe_ids = set(included_ids)
+    outfits = [outfit for outfit in (validate_outfit(outfit, wardrobe_ids) for outfit in result['outfits']) if outfit]
+    if not outfits:
+        raise ValueError('Model response has no outfits from the wardrobe')
+    return dict(result, outfits=outfits)
+
+
+class RecommendationCache:
+    """
+    Thread-safe LRU/TTL cache of model recommendation sets.
+
+    Each key holds a pool of up to `pool_size` result sets. While the pool is
+    filling, callers are told to ask the model for a new alternate; once it
+    is full, requests rotate through the pool until the entry expires.
+    """
+
+    def __init__(self, max_entries=512, ttl=3600, pool_size=3):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.pool_size = pool_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.model_calls = 0
+        self.model_seconds = 0.0
+        self.seconds_saved = 0.0
+
+    def make_key(self, user_id, fingerprint, theme, weather):
+        return (user_id, fingerprint, normalize_text(theme), normalize_text(weather))
+
+    def get(self, key):
+        """Return the next cached alternate for key, or None if the model should be called"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry['created'] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None or len(entry['pool']) < self.pool_size:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            result = entry['pool'][entry['cursor'] % len(entry['pool'])]
+            entry['cursor'] += 1
+            self.hits += 1
+            if self.model_calls:
+                self.seconds_saved += self.model_seconds / self.model_calls
+            return result
+
+    def add(self, key, result, model_seconds):
+        """Store a fresh model result in the pool for key"""
+        with self._lock:
+            self.model_calls += 1
+            self.model_seconds += model_seconds
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {'pool': [], 'cursor': 0, 'created': time.monotonic()}
+                self._entries[key] = entry
+            entry['pool'].append(result)
+            del entry['pool'][:-self.pool_size]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'model_calls': self.model_calls,
+                'avg_model_latency_ms': round(self.model_seconds / self.model_calls * 1000, 1) if self.model_calls else 0.0,
+                'model_latency_saved_ms': round(self.seconds_saved * 1000, 1),
+            }
+
+
+recommendation_cache = RecommendationCache(
+    max_entries=getattr(settings, 'RECOMMENDATION_CACHE_SIZE', 512),
+    ttl=getattr(settings, 'RECOMMENDATION_CACHE_TTL', 3600),
+    pool_size=getattr(settings, 'RECOMMENDATION_CACHE_POOL_SIZE', 3),
+)
+
+
+# Concurrent identical model requests (double taps, client retries) share one upstream call
+model_flights = SingleFlight(
+    'recommendations',
+    lock_timeout=getattr(settings, 'RECOMMENDATION_COALESCE_TIMEOUT', 30),
+)
+
+
+def flight_key(cache_key):
+    """Stable string form of a recommendation cache key, usable across processes"""
+    return hashlib.sha1(json.dumps(cache_key).encode()).hexdigest()
+
+
+def generate_recommendations(user, theme, weather, engine=None, seed=None):
+    """
+    Recommend outfits from the user's clean garments.
+
+    engine='local' (or RECOMMENDATION_ENGINE='local') uses only the local
+    scoring engine. Otherwise OpenAI is used when OPENAI_API_KEY is set
+    (through the result cache), with the local engine as the fallback and
+    for users over their daily token budget.
+    """
+    engine = engine or getattr(settings, 'RECOMMENDATION_ENGINE', 'ai')
+    garments = Garment.objects.filter(owner=user, status='clean').select_related('category')
+
+    if engine == 'local':
+        wardrobe = WardrobeArrays.from_queryset(garments)
+        if not len(wardrobe):
+            raise NoCleanGarmentsError('No clean garments available in your wardrobe')
+        return local_recommendations(wardrobe, theme, weather, seed=seed, relevance=theme_index.relevance(user.id, theme))
+
+    # Fingerprint the clean wardrobe with a cheap (id, updated_at) query
+    garment_rows = list(garments.values_list('id', 'updated_at'))
+    if not garment_rows:
+        raise NoCleanGarmentsError('No clean garments available in your wardrobe')
+
+    garment_list = None
+    relevance = None
+    if os.getenv('OPENAI_API_KEY'):
+        cache_key = recommendation_cache.make_key(
+            user.id, wardrobe_fingerprint(garment_rows), theme, weather
+        )
+        cached = recommendation_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached, cached=True)
+
+        if over_budget(user.id):
+            # Cached results above are free; new model calls wait until tomorrow
+            print(f"User {user.id} is over the daily OpenAI token budget; using the local engine")
+        else:
+            # Theme relevance ranks garments for the prompt's token budget
+            relevance = theme_index.relevance(user.id, theme)
+
+            def call_model():
+                started = time.monotonic()
+                result = request_model_recommendations(garment_list, theme, weather, relevance, user.id)
+                recommendation_cache.add(cache_key, result, time.monotonic() - started)
+                return result
+
+            try:
+                garment_list = list(garments)
+                return model_flights.do(flight_key(cache_key), call_model)
+            except Exception as e:
+                print(f"OpenAI API error: {e}")
+                # Fall through to the local engine
+
+    if relevance is None:
+        relevance = theme_index.relevance(user.id, theme)
+    if garment_list is None:
+        wardrobe = WardrobeArrays.from_queryset(garments)
+    else:
+        wardrobe = WardrobeArrays.from_garments(garment_list)
+    return local_recommendations(wardrobe, theme, weather, seed=seed, relevance=relevance)
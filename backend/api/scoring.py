@@ -0,0 +1,254 @@
+"""
+Local outfit-scoring engine.
+
+The wardrobe is loaded into compact NumPy arrays (category, season,
+canonical color, times worn, days since last worn). Each garment gets a
+unary score for season/weather fit, freshness and wear balance; candidate
+outfits (one garment per category) are then scored in bulk with a color
+compatibility matrix, and the top-k outfits are picked greedily so they
+share as few garments as possible. Results are deterministic for a seed.
+"""
+import math
+import re
+import numpy as np
+from django.utils import timezone
+from .prompts import target_seasons
+
+SEASONS = ['spring', 'summer', 'autumn', 'winter', 'all']
+OPPOSITE_SEASONS = {'summer': 'winter', 'winter': 'summer', 'spring': 'autumn', 'autumn': 'spring'}
+
+# Canonical color families and the words that map to them
+COLOR_FAMILIES = {
+    'black': ['black', 'charcoal', 'onyx', 'jet'],
+    'white': ['white', 'ivory', 'cream', 'offwhite', 'eggshell'],
+    'grey': ['grey', 'gray', 'silver', 'heather', 'ash'],
+    'beige': ['beige', 'tan', 'khaki', 'camel', 'sand', 'nude', 'taupe', 'stone'],
+    'brown': ['brown', 'chocolate', 'coffee', 'cognac', 'mocha'],
+    'navy': ['navy', 'midnight'],
+    'blue': ['blue', 'denim', 'sky', 'cobalt', 'teal', 'turquoise', 'aqua', 'indigo'],
+    'green': ['green', 'olive', 'sage', 'mint', 'emerald', 'forest'],
+    'red': ['red', 'burgundy', 'maroon', 'wine', 'crimson', 'scarlet'],
+    'pink': ['pink', 'rose', 'blush', 'magenta', 'fuchsia'],
+    'purple': ['purple', 'lavender', 'violet', 'lilac', 'plum', 'mauve'],
+    'yellow': ['yellow', 'mustard', 'gold', 'lemon'],
+    'orange': ['orange', 'rust', 'coral', 'peach', 'terracotta'],
+    'other': [],
+}
+COLORS = list(COLOR_FAMILIES)
+NEUTRALS = {'black', 'white', 'grey', 'beige', 'brown', 'navy'}
+COMPLEMENTARY = [('blue', 'orange'), ('red', 'green'), ('purple', 'yellow'), ('pink', 'green'), ('navy', 'yellow')]
+ANALOGOUS = [('blue', 'green'), ('blue', 'purple'), ('red', 'pink'), ('red', 'orange'),
+             ('purple', 'pink'), ('yellow', 'orange'), ('yellow', 'green')]
+
+_COLOR_LOOKUP = {word: family for family, words in COLOR_FAMILIES.items() for word in words}
+
+# Weight of theme relevance (0-1, from the theme index) relative to season fit (2.0)
+THEME_WEIGHT = 1.5
+
+# Cap on how many combinations are scored per request
+MAX_COMBINATIONS = 20000
+NEVER_WORN_DAYS = 365
+
+
+def canonical_color(color):
+    """Map free-text color ("Navy Blue", "light olive") to a color family index"""
+    for word in re.findall(r'[a-z]+', (color or '').lower().replace('off-white', 'offwhite')):
+        if word in _COLOR_LOOKUP:
+            return COLORS.index(_COLOR_LOOKUP[word])
+    return COLORS.index('other')
+
+
+def build_color_matrix():
+    """Pairwise color compatibility in [0, 1]"""
+    size = len(COLORS)
+    matrix = np.full((size, size), 0.2, dtype=np.float32)
+    for i, a in enumerate(COLORS):
+        for j, b in enumerate(COLORS):
+            if a == 'other' or b == 'other':
+                matrix[i, j] = 0.5
+            elif a in NEUTRALS and b in NEUTRALS:
+                matrix[i, j] = 0.8 if a != b else 0.6
+            elif a in NEUTRALS or b in NEUTRALS:
+                matrix[i, j] = 0.9
+            elif a == b:
+                matrix[i, j] = 0.5
+    for pairs, value in ((COMPLEMENTARY, 0.7), (ANALOGOUS, 0.6)):
+        for a, b in pairs:
+            i, j = COLORS.index(a), COLORS.index(b)
+            matrix[i, j] = matrix[j, i] = value
+    return matrix
+
+
+COLOR_MATRIX = build_color_matrix()
+
+
+class WardrobeArrays:
+    """Column arrays for a set of garments; row i describes ids[i]"""
+
+    FIELDS = ('id', 'category_id', 'season', 'color', 'times_worn', 'last_worn', 'is_favorite')
+
+    def __init__(self, rows, today=None):
+        today = today or timezone.now().date()
+        count = len(rows)
+        self.ids = np.empty(count, dtype=np.int64)
+        self.category = np.empty(count, dtype=np.int64)
+        self.season = np.empty(count, dtype=np.int8)
+        self.color = np.empty(count, dtype=np.int8)
+        self.times_worn = np.empty(count, dtype=np.int32)
+        self.days_since_worn = np.empty(count, dtype=np.int32)
+        self.favorite = np.empty(count, dtype=bool)
+        season_index = {season: i for i, season in enumerate(SEASONS)}
+        color_cache = {}
+        for i, (garment_id, category_id, season, color, times_worn, last_worn, is_favorite) in enumerate(rows):
+            self.ids[i] = garment_id
+            self.category[i] = category_id or 0
+            self.season[i] = season_index.get(season, season_index['all'])
+            if color not in color_cache:
+                color_cache[color] = canonical_color(color)
+            self.color[i] = color_cache[color]
+            self.times_worn[i] = times_worn or 0
+            self.days_since_worn[i] = (today - last_worn).days if last_worn else NEVER_WORN_DAYS
+            self.favorite[i] = bool(is_favorite)
+
+    @classmethod
+    def from_queryset(cls, queryset, today=None):
+        """Load straight from the database without building model instances"""
+        return cls(list(queryset.values_list(*cls.FIELDS)), today)
+
+    @classmethod
+    def from_garments(cls, garments, today=None):
+        return cls([
+            (g.id, g.category_id, g.season, g.color, g.times_worn, g.last_worn, g.is_favorite)
+            for g in garments
+        ], today)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def relevance_vector(self, relevance):
+        """Align a {garment_id: relevance} mapping with the rows"""
+        return np.array([relevance.get(int(garment_id), 0.0) for garment_id in self.ids], dtype=np.float32)
+
+
+def season_fit_vector(weather, today=None):
+    """Fit in [0, 1] for each season code given the weather text"""
+    targets = target_seasons(weather, today)
+    opposites = {OPPOSITE_SEASONS[season] for season in targets}
+    fit = np.full(len(SEASONS), 0.4, dtype=np.float32)
+    for i, season in enumerate(SEASONS):
+        if season in targets:
+            fit[i] = 1.0
+        elif season == 'all':
+            fit[i] = 0.8
+        elif season in opposites:
+            fit[i] = 0.0
+    return fit
+
+
+def garment_scores(wardrobe, weather, today=None):
+    """Unary score per garment: season fit, freshness, wear balance and favorites"""
+    season_fit = season_fit_vector(weather, today)[wardrobe.season]
+    freshness = np.minimum(wardrobe.days_since_worn, 14) / 14.0
+    wear_balance = 1.0 - np.log1p(wardrobe.times_worn) / np.log1p(max(int(wardrobe.times_worn.max(initial=0)), 1))
+    return (2.0 * season_fit + 0.8 * freshness + 0.6 * wear_balance + 0.3 * wardrobe.favorite).astype(np.float32)
+
+
+def candidate_counts(category_sizes, limit=MAX_COMBINATIONS):
+    """
+    How many of the best garments to keep per category so the grid holds
+    at most `limit` combinations.
+
+    Starts from an even share (limit ** (1 / categories)) and hands the room
+    left by small categories to the larger ones. With very many categories
+    some keep a single candidate.
+    """
+    per_category = max(1, int(limit ** (1.0 / len(category_sizes))))
+    counts = [min(size, per_category) for size in category_sizes]
+    while math.prod(counts) > limit:
+        counts[counts.index(max(counts))] -= 1
+    grown = True
+    while grown:
+        grown = False
+        for i, size in enumerate(category_sizes):
+            if counts[i] < size and math.prod(counts) // counts[i] * (counts[i] + 1) <= limit:
+                counts[i] += 1
+                grown = True
+    return counts
+
+
+def score_combinations(wardrobe, scores, available=None):
+    """
+    Score every outfit (one garment per category) from per-garment scores.
+
+    Candidates per category are pruned to the best few so the full
+    combination grid stays under MAX_COMBINATIONS (see candidate_counts). Garments outside the
+    `available` mask are left out; categories with none available are
+    dropped. Returns (grid of wardrobe row indices, combo scores).
+    """
+    rows = np.arange(len(wardrobe)) if available is None else np.flatnonzero(available)
+    categories = np.unique(wardrobe.category[rows])
+    if not len(categories):
+        return np.empty((0, 0), dtype=np.int64), np.empty(0, dtype=np.float32)
+    members = [rows[wardrobe.category[rows] == category] for category in categories]
+    candidates = [
+        group[np.argsort(-scores[group], kind='stable')[:count]]
+        for group, count in zip(members, candidate_counts([len(group) for group in members]))
+    ]
+
+    # Every combination of one candidate per category: shape (n_combos, n_categories)
+    grid = np.stack(np.meshgrid(*candidates, indexing='ij'), axis=-1).reshape(-1, len(candidates))
+    combo_scores = scores[grid].mean(axis=1)
+
+    if grid.shape[1] > 1:
+        colors = wardrobe.color[grid]
+        left, right = np.triu_indices(grid.shape[1], k=1)
+        combo_scores += COLOR_MATRIX[colors[:, left], colors[:, right]].mean(axis=1)
+    return grid, combo_scores
+
+
+def top_k_outfits(wardrobe, weather, k=3, seed=None, today=None, relevance=None):
+    """
+    Return up to k outfits as lists of garment IDs, best first.
+
+    `relevance` optionally maps garment IDs to theme relevance in [0, 1].
+    """
+    if len(wardrobe) == 0:
+        return []
+    rng = np.random.default_rng(seed)
+    # Small seeded jitter breaks ties and varies results between seeds
+    scores = garment_scores(wardrobe, weather, today) + rng.uniform(0, 0.15, len(wardrobe)).astype(np.float32)
+    if relevance:
+        scores += THEME_WEIGHT * wardrobe.relevance_vector(relevance)
+    grid, combo_scores = score_combinations(wardrobe, scores)
+
+    # Greedy diverse selection: after each pick, rule out combos sharing more
+    # than half their garments with it. Small wardrobes may not allow k such
+    # outfits, so remaining slots are filled with the next best distinct combos.
+    max_shared = grid.shape[1] // 2
+    remaining = combo_scores.copy()
+    diverse = np.ones(len(grid), dtype=bool)
+    picks = []
+    while len(picks) < k:
+        candidates_left = np.isfinite(remaining)
+        if not candidates_left.any():
+            break
+        pool = diverse & candidates_left
+        index = int(np.argmax(np.where(pool if pool.any() else candidates_left, remaining, -np.inf)))
+        chosen = grid[index]
+        picks.append([int(garment_id) for garment_id in wardrobe.ids[chosen]])
+        remaining[index] = -np.inf
+        diverse &= np.isin(grid, chosen).sum(axis=1) <= max_shared
+    return picks
+
+
+def local_recommendations(wardrobe, theme, weather, k=3, seed=None, relevance=None):
+    """Recommendation document in the same shape as the model's response"""
+    outfits = []
+    for i, garment_ids in enumerate(top_k_outfits(wardrobe, weather, k=k, seed=seed, relevance=relevance)):
+        outfits.append({
+            "name": f"{theme.title()} Look {i+1}",
+            "garment_ids": garment_ids,
+            "reasoning": f"Picked for {theme} in {weather} weather: season-appropriate pieces you haven't worn recently, in colors that work together",
+            "style_tip": "Each outfit uses one item per category for a balanced look!"
+        })
+    return {"outfits": outfits}
@@ -1,19 +1,22 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Category, Garment, Outfit, LaundryItem, WearHistory, Profile
+from .accounts import create_user_with_unique_username
+from .images import variant_urls
 
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for User model"""
     profile_picture = serializers.ImageField(required=False, allow_null=True, write_only=True)
     profile_picture_url = serializers.SerializerMethodField()
+    profile_picture_variants = serializers.SerializerMethodField()
     bio = serializers.CharField(required=False, allow_blank=True, max_length=500, write_only=True)
     bio_value = serializers.SerializerMethodField()
     has_usable_password = serializers.SerializerMethodField()
     
     class Meta:
         model = User
-        fields = ['id', 'username', 'first_name', 'last_name', 'email', 'profile_picture', 'profile_picture_url', 'bio', 'bio_value', 'has_usable_password']
-        read_only_fields = ['id', 'has_usable_password', 'profile_picture_url', 'bio_value']
+        fields = ['id', 'username', 'first_name', 'last_name', 'email', 'profile_picture', 'profile_picture_url', 'profile_picture_variants', 'bio', 'bio_value', 'has_usable_password']
+        read_only_fields = ['id', 'has_usable_password', 'profile_picture_url', 'profile_picture_variants', 'bio_value']
     
     def get_has_usable_password(self, obj):
         """Check if user has a usable password (not OAuth-only account)"""
@@ -25,6 +28,12 @@ class UserSerializer(serializers.ModelSerializer):
             return obj.profile.profile_picture.url
         return None
     
+    def get_profile_picture_variants(self, obj):
+        """Thumbnail and medium WebP URLs, once generated"""
+        if hasattr(obj, 'profile'):
+            return variant_urls(obj.profile.profile_picture, obj.profile.profile_picture_variants, self.context.get('request'))
+        return {}
+    
     def get_bio_value(self, obj):
         """Get bio from profile"""
         if hasattr(obj, 'profile'):
@@ -54,12 +63,10 @@ class UserSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         """Return profile data properly"""
         data = super().to_representation(instance)
-        # Map the fields to frontend expectations
-        data['profile_picture'] = self.get_profile_picture_url(instance)
-        data['bio'] = self.get_bio_value(instance)
-        # Remove write-only fields from response
-        data.pop('profile_picture_url', None)
-        data.pop('bio_value', None)
+        # Map the fields to frontend expectations, reusing the values the
+        # method fields already computed instead of reading the profile again
+        data['profile_picture'] = data.pop('profile_picture_url', None)
+        data['bio'] = data.pop('bio_value', '')
         return data
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -70,22 +77,29 @@ class RegisterSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['username', 'email', 'password', 'password2', 'first_name', 'last_name']
+        extra_kwargs = {
+            # Username may be omitted; one is then derived from the email address
+            'username': {'required': False, 'allow_blank': True}
+        }
     
     def validate(self, data):
         if data['password'] != data['password2']:
             raise serializers.ValidationError({"password": "Passwords must match."})
+        if not data.get('username') and not data.get('email'):
+            raise serializers.ValidationError({"username": "A username or email is required."})
         return data
     
     def create(self, validated_data):
         validated_data.pop('password2')
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data.get('email', ''),
-            password=validated_data['password'],
-            first_name=validated_data.get('first_name', ''),
-            last_name=validated_data.get('last_name', '')
-        )
-        return user
+        user_fields = {
+            'email': validated_data.get('email', ''),
+            'password': validated_data['password'],
+            'first_name': validated_data.get('first_name', ''),
+            'last_name': validated_data.get('last_name', '')
+        }
+        if validated_data.get('username'):
+            return User.objects.create_user(username=validated_data['username'], **user_fields)
+        return create_user_with_unique_username(user_fields['email'].split('@')[0], **user_fields)
 
 class LoginSerializer(serializers.Serializer):
     """Serializer for user login"""
@@ -109,6 +123,7 @@ class GarmentSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     category_icon = serializers.CharField(source='category.icon', read_only=True)
     image_url = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
     owner_username = serializers.CharField(source='owner.username', read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     size_display = serializers.CharField(source='get_size_display', read_only=True)
@@ -120,7 +135,7 @@ class GarmentSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'description', 'category', 'category_name', 'category_icon',
             'color', 'size', 'size_display', 'price', 'brand', 'image', 'image_url',
-            'season', 'season_display', 'material', 'care_instructions',
+            'image_variants', 'season', 'season_display', 'material', 'care_instructions',
             'status', 'status_display', 'is_favorite', 'times_worn', 'last_worn', 
             'purchase_date', 'owner', 'owner_username', 'is_available',
             'created_at', 'updated_at'
@@ -141,18 +156,46 @@ class GarmentSerializer(serializers.ModelSerializer):
             return url
         print(f"No image for {obj.name}")
         return None
+    
+    def get_image_variants(self, obj):
+        """Thumbnail and medium WebP URLs, once generated"""
+        return variant_urls(obj.image, obj.image_variants, self.context.get('request'))
+
+class CategoryNameField(serializers.Field):
+    """Category given by name, matched case-insensitively against context['categories'] ({lowercase name: Category})"""
+    
+    def to_internal_value(self, data):
+        category = self.context['categories'].get(str(data).strip().lower())
+        if category is None:
+            raise serializers.ValidationError(f'Unknown category "{data}"')
+        return category
+    
+    def to_representation(self, value):
+        return value.name
+
+class GarmentImportSerializer(GarmentSerializer):
+    """GarmentSerializer's rules for one imported row; the category is given by name"""
+    category = CategoryNameField()
+    
+    class Meta(GarmentSerializer.Meta):
+        fields = [
+            'name', 'description', 'category', 'color', 'size', 'price', 'brand', 'season',
+            'material', 'care_instructions', 'status', 'is_favorite', 'times_worn', 'last_worn',
+            'purchase_date',
+        ]
 
 class GarmentSummarySerializer(serializers.ModelSerializer):
     """Simplified garment serializer for lists and summaries"""
     category_name = serializers.CharField(source='category.name', read_only=True)
     image_url = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     
     class Meta:
         model = Garment
         fields = [
             'id', 'name', 'category_name', 'color', 'size', 
-            'image_url', 'status', 'status_display', 'is_favorite'
+            'image_url', 'image_variants', 'status', 'status_display', 'is_favorite'
         ]
     
     def get_image_url(self, obj):
@@ -163,6 +206,9 @@ class GarmentSummarySerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(url)
             return url
         return None
+    
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image, obj.image_variants, self.context.get('request'))
 
 class OutfitSerializer(serializers.ModelSerializer):
     garments = GarmentSummarySerializer(many=True, read_only=True)
@@ -183,10 +229,11 @@ class OutfitSerializer(serializers.ModelSerializer):
             'id', 'name', 'garments', 'garment_ids', 'occasion', 'occasion_display',
             'season', 'season_display', 'notes', 'layout', 'rating', 'is_favorite',
             'times_worn', 'last_worn', 'owner', 'owner_username', 'weather',
-            'date', 'garment_count', 'is_complete', 'created_at', 'updated_at'
+            'date', 'is_planned', 'garment_count', 'is_complete', 'created_at', 'updated_at'
         ]
         extra_kwargs = {
-            'owner': {'read_only': True}
+            'owner': {'read_only': True},
+            'is_planned': {'read_only': True}
         }
     
     def get_garment_count(self, obj):
@@ -275,4 +322,10 @@ class WardrobeStatsSerializer(serializers.Serializer):
     favorite_garments = serializers.IntegerField()
     total_outfits = serializers.IntegerField()
     categories = serializers.DictField()
-    recent_activity = serializers.ListField()
\ No newline at end of file
+    recent_activity = serializers.ListField()
+
+# AI Request Serializers
+class RecommendationRequestSerializer(serializers.Serializer):
+    """Theme and weather of an AI recommendation request (stored on RecommendationJob)"""
+    theme = serializers.CharField(max_length=200, allow_blank=True, default='casual day')
+    weather = serializers.CharField(max_length=100, allow_blank=True, default='moderate')
@@ -0,0 +1,136 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_init, pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .authentication import invalidate_token, invalidate_user_tokens
+from .models import Category, Garment, LaundryItem, Outfit, Profile
+from .changes import change_event, publish_change
+from .images import schedule_refresh, variants_outdated
+from .image_dedup import store_garment_image, release_image
+from .theme_index import theme_index
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_auth_cache(sender, instance, update_fields=None, **kwargs):
+    """Password changes, deactivation and profile edits must not serve a stale cached user"""
+    # Logins only touch last_login, which the cached user doesn't need fresh
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    invalidate_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile_auth_cache(sender, instance, **kwargs):
+    """The cached user carries its profile, so refresh it when the profile changes"""
+    invalidate_user_tokens(instance.user_id)
+
+
+@receiver(post_save, sender=Profile)
+def refresh_profile_picture_variants(sender, instance, **kwargs):
+    if variants_outdated(instance.profile_picture, instance.profile_picture_variants):
+        schedule_refresh('api.Profile', instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Logout, rotation and account deletion all remove the token row"""
+    invalidate_token(instance.key)
+
+
+@receiver(post_init, sender=Garment)
+def remember_loaded_garment_image(sender, instance, **kwargs):
+    """Note the photo a garment was loaded with, so saves that keep it skip the lookup below"""
+    if instance.pk is not None and 'image' in instance.__dict__:
+        instance._previous_image = getattr(instance.__dict__['image'], 'name', instance.__dict__['image'])
+
+
+@receiver(pre_save, sender=Garment)
+def store_garment_image_by_content(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Store new photos once per distinct content, remembering the photo being replaced"""
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    unchanged = (
+        instance.pk is not None and instance.image._committed
+        and getattr(instance, '_previous_image', None) == instance.image.name
+    )
+    if not unchanged:
+        instance._previous_image = (
+            Garment.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+            if instance.pk else None
+        )
+    if instance.image and not instance.image._committed:
+        store_garment_image(instance.image)
+
+
+@receiver(post_save, sender=Garment)
+def release_replaced_garment_image(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_image', None)
+    if previous and previous != instance.image.name:
+        release_image(previous, instance.image.storage)
+    instance._previous_image = instance.image.name
+
+
+@receiver(post_save, sender=Garment)
+def index_saved_garment(sender, instance, **kwargs):
+    """Keep the owner's theme index current without rebuilding it (once the save commits)"""
+    transaction.on_commit(lambda: theme_index.update_garment(instance))
+
+
+@receiver(post_save, sender=Garment)
+def refresh_garment_image_variants(sender, instance, **kwargs):
+    """Render thumbnails in the background when the photo is added or replaced"""
+    if variants_outdated(instance.image, instance.image_variants):
+        schedule_refresh('api.Garment', instance.pk)
+
+
+@receiver(post_delete, sender=Garment)
+def unindex_deleted_garment(sender, instance, **kwargs):
+    owner_id, garment_id = instance.owner_id, instance.id
+    transaction.on_commit(lambda: theme_index.remove_garment(owner_id, garment_id))
+
+
+@receiver(post_delete, sender=Garment)
+def release_deleted_garment_image(sender, instance, **kwargs):
+    release_image(instance.image.name, instance.image.storage)
+
+
+@receiver(post_save, sender=Category)
+def reset_theme_indexes(sender, instance, **kwargs):
+    """Category names are indexed for every garment in them; rare enough to rebuild"""
+    transaction.on_commit(theme_index.clear)
+
+
+@receiver(post_save, sender=Garment)
+@receiver(post_save, sender=Outfit)
+def publish_saved_object(sender, instance, raw=False, **kwargs):
+    """Tell the owner's open clients to refetch the object (see api/changes.py)"""
+    if not raw:
+        publish_change(instance.owner_id, change_event(sender._meta.model_name, instance))
+
+
+@receiver(post_delete, sender=Garment)
+@receiver(post_delete, sender=Outfit)
+def publish_deleted_object(sender, instance, **kwargs):
+    publish_change(instance.owner_id, change_event(sender._meta.model_name, instance, deleted=True))
+
+
+@receiver(m2m_changed, sender=Outfit.garments.through)
+def publish_outfit_garments(sender, instance, action, reverse, **kwargs):
+    if action.startswith('post_') and not reverse:
+        publish_change(instance.owner_id, change_event('outfit', instance))
+
+
+def laundry_owner_id(item):
+    if 'garment' in item._state.fields_cache:
+        return item.garment.owner_id
+    return Garment.objects.filter(pk=item.garment_id).values_list('owner_id', flat=True).first()
+
+
+@receiver(post_save, sender=LaundryItem)
+def publish_saved_laundry_item(sender, instance, raw=False, **kwargs):
+    """Laundry rows are only deleted along with their garment, which publishes its own delete"""
+    if not raw:
+        publish_change(laundry_owner_id(instance), change_event('laundry', instance))
+
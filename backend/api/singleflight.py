@@ -0,0 +1,107 @@
+"""
+Single-flight coalescing of identical concurrent calls.
+
+Within a process, callers with the same key wait on one in-flight call and
+share its result (or exception). Across processes, the leader also takes a
+lock in the Django cache and publishes its result there, so followers in
+other workers wait for it instead of repeating the upstream call. The
+cross-process part needs a shared cache backend (see CACHES / REDIS_URL in
+settings); with the default local-memory cache it is a per-process no-op.
+"""
+import threading
+import time
+import uuid
+from django.core.cache import cache
+
+_MISSING = object()
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, namespace, lock_timeout=30, result_ttl=30, poll_interval=0.05):
+        self.namespace = namespace
+        self.lock_timeout = lock_timeout
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.local_followers = 0
+        self.remote_followers = 0
+
+    def do(self, key, fn):
+        """Run fn() once for all concurrent callers with the same key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.local_followers += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_shared(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def _run_shared(self, key, fn):
+        """Run fn() under the cross-process lock, or wait for another process's result"""
+        lock_key = f'singleflight:{self.namespace}:{key}:lock'
+        deadline = time.monotonic() + self.lock_timeout
+        token = uuid.uuid4().hex
+
+        while time.monotonic() < deadline:
+            if cache.add(lock_key, token, self.lock_timeout):
+                with self._lock:
+                    self.leaders += 1
+                try:
+                    result = fn()
+                    cache.set(f'singleflight:{self.namespace}:{key}:{token}', result, self.result_ttl)
+                    return result
+                finally:
+                    if cache.get(lock_key) == token:
+                        cache.delete(lock_key)
+
+            holder = cache.get(lock_key)
+            while holder is not None and time.monotonic() < deadline:
+                result = cache.get(f'singleflight:{self.namespace}:{key}:{holder}', _MISSING)
+                if result is not _MISSING:
+                    with self._lock:
+                        self.remote_followers += 1
+                    return result
+                if cache.get(lock_key) != holder:
+                    # The holder failed or its lock expired; try to take over
+                    break
+                time.sleep(self.poll_interval)
+
+        # Waited the full lock timeout without a result: run it ourselves
+        with self._lock:
+            self.leaders += 1
+        return fn()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'upstream_calls': self.leaders,
+                'coalesced_local': self.local_followers,
+                'coalesced_remote': self.remote_followers,
+            }
@@ -0,0 +1,164 @@
+"""
+Server-Sent Events delivery of AI outfit recommendations.
+
+The model is called with stream=True and its JSON document is parsed
+incrementally: each outfit object is emitted as an SSE event as soon as its
+closing brace arrives, after its garment IDs are checked against the
+user's clean wardrobe. Served by the async view in views.py, so under the
+ASGI application in garmently_backend/asgi.py a stream does not hold a
+worker thread while it waits on OpenAI.
+"""
+import json
+import logging
+import os
+import time
+from asgiref.sync import sync_to_async
+from .models import Garment
+from .openai_client import stream_chat_completion
+from .prompts import build_recommendation_prompt
+from .recommendations import SYSTEM_PROMPT, recommendation_cache, validate_outfit, wardrobe_fingerprint
+from .scoring import WardrobeArrays, local_recommendations
+from .theme_index import theme_index
+from .usage import over_budget, record_usage
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event, data):
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class OutfitStreamParser:
+    """
+    Incremental parser for {"outfits": [{...}, {...}]} documents.
+
+    feed() takes raw text chunks and returns the outfit objects completed by
+    that chunk. Objects are recognised by nesting depth, so it only needs to
+    track brackets and string/escape state, never the whole document.
+    """
+
+    OUTFIT_DEPTH = 2  # root object -> "outfits" array -> outfit object
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.current = None
+
+    def feed(self, chunk):
+        completed = []
+        for char in chunk:
+            if self.current is not None:
+                self.current.append(char)
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+            elif char in '{[':
+                if char == '{' and self.depth == self.OUTFIT_DEPTH:
+                    self.current = [char]
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == self.OUTFIT_DEPTH and self.current is not None:
+                    try:
+                        completed.append(json.loads(''.join(self.current)))
+                    except ValueError:
+                        pass
+                    self.current = None
+        return completed
+
+
+async def stream_model_outfits(garments, theme, weather, relevance=None, user_id=None):
+    """Yield validated outfits from a streaming OpenAI completion as they complete"""
+    prompt, included_ids = build_recommendation_prompt(garments, theme, weather, relevance=relevance)
+    wardrobe_ids = set(included_ids)
+    parser = OutfitStreamParser()
+    usage = []
+
+    stream = stream_chat_completion(
+        on_usage=lambda model, tokens: usage.append((model, tokens)),
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.8,
+        response_format={ "type": "json_object" },
+    )
+    async for delta in stream:
+        for outfit in parser.feed(delta):
+            outfit = validate_outfit(outfit, wardrobe_ids)
+            if outfit is not None:
+                yield outfit
+    if usage and user_id is not None:
+        await sync_to_async(record_usage)(user_id, 'stream', *usage[-1])
+
+
+async def stream_recommendations(user, theme, weather):
+    """
+    Async generator of SSE-encoded recommendation events.
+
+    Emits an "outfit" event per outfit, then "done" with the source
+    (cache, model or fallback). Errors before the first outfit fall back
+    to the local scoring engine; errors after it end the stream with "error".
+    """
+    garments = [
+        g async for g in Garment.objects.filter(owner=user, status='clean').select_related('category')
+    ]
+    if not garments:
+        yield sse_event('error', {'error': 'No clean garments available in your wardrobe'})
+        return
+
+    started = time.monotonic()
+    sent = 0
+    relevance = await sync_to_async(theme_index.relevance)(user.id, theme)
+
+    if os.getenv('OPENAI_API_KEY'):
+        cache_key = recommendation_cache.make_key(
+            user.id, wardrobe_fingerprint((g.id, g.updated_at) for g in garments), theme, weather
+        )
+        cached = recommendation_cache.get(cache_key)
+        if cached is not None:
+            for outfit in cached.get('outfits', []):
+                yield sse_event('outfit', outfit)
+            yield sse_event('done', {'source': 'cache', 'count': len(cached.get('outfits', []))})
+            return
+
+        outfits = []
+        if await sync_to_async(over_budget)(user.id):
+            print(f"User {user.id} is over the daily OpenAI token budget; using the local engine")
+        else:
+            try:
+                async for outfit in stream_model_outfits(garments, theme, weather, relevance, user.id):
+                    if not outfits:
+                        logger.debug('Time to first outfit: %.0fms', (time.monotonic() - started) * 1000)
+                    outfits.append(outfit)
+                    sent += 1
+                    yield sse_event('outfit', outfit)
+            except Exception as e:
+                print(f"OpenAI streaming error: {e}")
+                if sent:
+                    yield sse_event('error', {'error': 'Recommendation stream interrupted'})
+                    return
+                # Fall through to the local engine
+
+        if outfits:
+            recommendation_cache.add(cache_key, {'outfits': outfits}, time.monotonic() - started)
+            yield sse_event('done', {'source': 'model', 'count': sent})
+            return
+
+    # Local scoring engine fallback
+    fallback = local_recommendations(WardrobeArrays.from_garments(garments), theme, weather, relevance=relevance)
+    for outfit in fallback['outfits']:
+        yield sse_event('outfit', outfit)
+    yield sse_event('done', {'source': 'fallback', 'count': len(fallback['outfits'])})
@@ -1,3 +1,1845 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from collections import Counter
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
+import boto3
+import numpy as np
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from .account_deletion import _run_in_background, delete_in_chunks, run_account_deletion
+from .accounts import allocate_username, create_user_with_unique_username, find_user_by_email
+from .authentication import CachedTokenAuthentication, token_cache_key, token_cache_ttl
+from .changes import issue_ticket, websocket_changes
+from .daily_outfits import compute_daily_outfits, save_daily_outfits
+from .export import ZipSink, buffered
+from .fake_openai import FakeOpenAIServer
+from .garment_import import IMPORT_BATCH_SIZE, GarmentImportError, import_garments
+from .images import variant_name
+from .management.commands._synthetic import synthetic_wardrobe
+from .management.commands.gc_media import BloomFilter
+from .models import (
+    AccountDeletion, Category, DailyOutfit, Garment, IdempotencyKey, LaundryItem, LLMUsage, Outfit, Profile,
+    RecommendationJob, StoredImage, WearHistory,
+)
+from .openai_client import CircuitBreaker, CircuitOpenError, _client_options, chat_completion, openai_breaker
+from .planner import MAX_THEME_LENGTH, MAX_WEATHER_LENGTH
+from .prompts import TABLE_HEADER, build_recommendation_prompt, estimate_tokens, select_rows
+from .recommendation_jobs import STALE_JOB_ERROR
+from .recommendations import (
+    RecommendationCache, generate_recommendations, model_flights, recommendation_cache, request_model_recommendations,
+    wardrobe_fingerprint,
+)
+from .scoring import (
+    MAX_COMBINATIONS, WardrobeArrays, candidate_counts, garment_scores, score_combinations, top_k_outfits,
+)
+from .theme_index import ThemeIndex, ThemeIndexRegistry, query_terms, stem, theme_index, tokenize
+from .usage import over_budget, record_usage, tokens_used_today, usage_cache_key, usage_summary
 
-# Create your tests here.
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+
+def make_wardrobe(user, count=6):
+    """A few clean garments across two categories"""
+    tops = Category.objects.create(name='Tops')
+    bottoms = Category.objects.create(name='Bottoms')
+    return [
+        Garment.objects.create(
+            owner=user, name=f'Garment {i}', category=tops if i % 2 else bottoms,
+            color='blue', size='M', price=20,
+        )
+        for i in range(count)
+    ]
+
+
+class FakeOpenAIMixin:
+    """Points the OpenAI client at a fresh fake server for each test"""
+    fake_server_options = {}
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeOpenAIServer(**self.fake_server_options).start()
+        self.addCleanup(self.server.stop)
+        environ = mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'fake-key', 'OPENAI_BASE_URL': self.server.base_url})
+        environ.start()
+        self.addCleanup(environ.stop)
+        recommendation_cache.clear()
+        self.addCleanup(recommendation_cache.clear)
+
+
+@override_settings(RECOMMENDATION_JOB_WSGI_MAX_WAIT=10)
+class RecommendationJobTests(FakeOpenAIMixin, TransactionTestCase):
+    """Job mode runs in worker threads, which only see committed rows"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('jobs', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def submit(self, **data):
+        return self.client.post('/api/ai/outfit-recommendations/', dict(data, theme='office', **{'async': True}),
+                                format='json')
+
+    def poll(self, job_id, wait=10):
+        return self.client.get(f'/api/ai/outfit-recommendations/jobs/{job_id}/', {'wait': wait})
+
+    def test_submit_and_poll(self):
+        make_wardrobe(self.user)
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'queued')
+
+        response = self.poll(response.data['job_id'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'done')
+        self.assertEqual(len(response.data['result']['outfits']), 3)
+        self.assertEqual(self.server.call_count, 1)
+
+    def test_job_without_clean_garments_fails(self):
+        response = self.poll(self.submit().data['job_id'])
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertIn('No clean garments', response.data['error'])
+        self.assertEqual(self.server.call_count, 0)
+
+    def test_upstream_failure_falls_back_to_local_engine(self):
+        make_wardrobe(self.user)
+        self.server.fail = True
+        response = self.poll(self.submit().data['job_id'])
+        self.assertEqual(response.data['status'], 'done')
+        self.assertTrue(response.data['result']['outfits'])
+        self.assertEqual(self.server.call_count, 1)
+
+    @override_settings(RECOMMENDATION_JOB_USER_LIMIT=0)
+    def test_user_limit(self):
+        response = self.submit()
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(RecommendationJob.objects.exists())
+
+    @override_settings(RECOMMENDATION_JOB_USER_LIMIT=1)
+    def test_user_limit_counts_active_jobs(self):
+        make_wardrobe(self.user)
+        self.server.delay = 0.5
+        first = self.submit()
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(self.submit().status_code, 429)
+        self.assertEqual(self.poll(first.data['job_id']).data['status'], 'done')
+        second = self.submit()
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(self.poll(second.data['job_id']).data['status'], 'done')
+        self.assertEqual(RecommendationJob.objects.count(), 2)
+
+    def test_invalid_theme_or_weather_is_rejected(self):
+        for data in ({'theme': 'x' * 201}, {'weather': 'x' * 101}, {'theme': ['office']}, {'weather': {'t': 20}}):
+            with self.subTest(data=data):
+                response = self.client.post('/api/ai/outfit-recommendations/', dict(data, **{'async': True}),
+                                            format='json')
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(RecommendationJob.objects.exists())
+
+    def test_poll_rejects_invalid_wait(self):
+        job = RecommendationJob.objects.create(owner=self.user, status='done', result={'outfits': []})
+        for wait in ('nan', 'inf', '-1', 'soon'):
+            with self.subTest(wait=wait):
+                self.assertEqual(self.poll(job.id, wait).status_code, 400)
+
+    @override_settings(RECOMMENDATION_JOB_WSGI_MAX_WAIT=0)
+    def test_wait_is_capped_under_wsgi(self):
+        job = RecommendationJob.objects.create(owner=self.user)
+        started = time.monotonic()
+        response = self.poll(job.id, wait=5)
+        self.assertEqual(response.data['status'], 'queued')
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_stale_job_is_marked_failed(self):
+        job = RecommendationJob.objects.create(owner=self.user, status='running')
+        RecommendationJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timezone.timedelta(minutes=10))
+        response = self.poll(job.id, wait=0)
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertEqual(response.data['error'], STALE_JOB_ERROR)
+
+    def test_other_users_job_is_not_found(self):
+        other = User.objects.create_user('other', password='secret')
+        job = RecommendationJob.objects.create(owner=other, status='done', result={'outfits': []})
+        self.assertEqual(self.poll(job.id, wait=0).status_code, 404)
+
+
+class PromptBudgetTests(SimpleTestCase):
+    def setUp(self):
+        self.garments = synthetic_wardrobe(300, random.Random(7))
+        self.by_id = {g.id: g for g in self.garments}
+
+    def test_rows_fit_the_token_budget(self):
+        for budget in (50, 200, 1000):
+            with self.subTest(budget=budget):
+                rows, included_ids = select_rows(self.garments, 'sunny', budget)
+                self.assertTrue(rows)
+                self.assertLessEqual(estimate_tokens('\n'.join([TABLE_HEADER] + rows)), budget)
+                self.assertLess(len(included_ids), len(self.garments))
+
+    @override_settings(PROMPT_TOKEN_BUDGET=120)
+    def test_prompt_uses_the_configured_budget(self):
+        _, included_ids = build_recommendation_prompt(self.garments, 'office', 'sunny')
+        self.assertEqual(included_ids, select_rows(self.garments, 'sunny', 120)[1])
+
+    def test_large_budget_includes_everything(self):
+        _, included_ids = select_rows(self.garments, 'sunny', 10 ** 6)
+        self.assertCountEqual(included_ids, self.by_id)
+
+    def test_categories_are_round_robined(self):
+        _, included_ids = select_rows(self.garments, 'sunny', 10 ** 6)
+        categories = [self.by_id[garment_id].category.name for garment_id in included_ids]
+        category_count = len(set(categories))
+        # Each pass takes one garment from every category before the next pass starts
+        self.assertEqual(len(set(categories[:category_count])), category_count)
+        self.assertEqual(len(set(categories[category_count:2 * category_count])), category_count)
+
+    def test_relevance_ranks_within_a_category(self):
+        tops = [g for g in self.garments if g.category.name == 'Tops']
+        favorite = tops[-1]
+        _, included_ids = select_rows(tops, 'sunny', 10 ** 6, relevance={favorite.id: 10.0})
+        self.assertEqual(included_ids[0], favorite.id)
+
+    def test_regex_estimate_without_tiktoken(self):
+        with mock.patch('api.prompts.tiktoken', None):
+            self.assertEqual(estimate_tokens('Blue shirt, size M'), 5)
+            # Long words count as ~4-character pieces
+            self.assertEqual(estimate_tokens('abcdefghijkl'), 3)
+            self.assertEqual(estimate_tokens(''), 0)
+
+    def test_tiktoken_is_used_when_installed(self):
+        encoding = mock.Mock()
+        encoding.encode.return_value = [1, 2]
+        fake_tiktoken = mock.Mock(get_encoding=mock.Mock(return_value=encoding))
+        with mock.patch('api.prompts.tiktoken', fake_tiktoken), mock.patch('api.prompts._encoding', None):
+            self.assertEqual(estimate_tokens('Blue shirt, size M'), 2)
+        fake_tiktoken.get_encoding.assert_called_once_with('o200k_base')
+
+
+class LocalScoringTests(SimpleTestCase):
+    today = timezone.datetime(2024, 7, 1).date()
+
+    def wardrobe(self, categories, per_category):
+        colors = ['navy', 'white', 'red', 'olive', 'beige']
+        seasons = ['summer', 'all', 'winter', 'spring']
+        rows = [
+            (category * 100 + i, category, seasons[i % len(seasons)], colors[(category + i) % len(colors)],
+             i * 3, self.today - timezone.timedelta(days=i * 5) if i else None, i == 1)
+            for category in range(1, categories + 1)
+            for i in range(per_category)
+        ]
+        return WardrobeArrays(rows, today=self.today)
+
+    def test_ranking_is_deterministic_for_a_seed(self):
+        wardrobe = self.wardrobe(4, 6)
+        first = top_k_outfits(wardrobe, 'sunny', seed=3, today=self.today)
+        self.assertEqual(first, top_k_outfits(wardrobe, 'sunny', seed=3, today=self.today))
+        self.assertEqual(len(first), 3)
+        # One garment per category in every outfit
+        for outfit in first:
+            self.assertEqual(sorted(garment_id // 100 for garment_id in outfit), [1, 2, 3, 4])
+
+    def test_best_outfit_comes_first(self):
+        wardrobe = self.wardrobe(3, 5)
+        scores = garment_scores(wardrobe, 'sunny', self.today)
+        grid, combo_scores = score_combinations(wardrobe, scores)
+        best = [int(garment_id) for garment_id in wardrobe.ids[grid[int(np.argmax(combo_scores))]]]
+        # Without jitter (same scores), the greedy pick starts from the top combination
+        with mock.patch('api.scoring.np.random.default_rng') as rng:
+            rng.return_value.uniform.return_value = np.zeros(len(wardrobe))
+            self.assertEqual(top_k_outfits(wardrobe, 'sunny', today=self.today)[0], best)
+
+    def test_outfits_share_at_most_half_their_garments(self):
+        wardrobe = self.wardrobe(4, 6)
+        outfits = top_k_outfits(wardrobe, 'sunny', k=3, seed=1, today=self.today)
+        for i, outfit in enumerate(outfits):
+            for other in outfits[i + 1:]:
+                self.assertLessEqual(len(set(outfit) & set(other)), 2)
+
+    def test_small_wardrobe_still_fills_k_distinct_outfits(self):
+        wardrobe = self.wardrobe(2, 2)
+        outfits = top_k_outfits(wardrobe, 'sunny', k=3, seed=1, today=self.today)
+        self.assertEqual(len(outfits), 3)
+        self.assertEqual(len({tuple(outfit) for outfit in outfits}), 3)
+
+    def test_candidate_counts_respect_the_cap(self):
+        for sizes in ([200] * 3, [3] * 20, [1, 10000], [50000], [100] * 60):
+            with self.subTest(categories=len(sizes)):
+                counts = candidate_counts(sizes)
+                self.assertLessEqual(np.prod(counts, dtype=object), MAX_COMBINATIONS)
+                self.assertTrue(all(1 <= count <= size for count, size in zip(counts, sizes)))
+        # Room left by a small category goes to the others
+        self.assertEqual(candidate_counts([1, 10000]), [1, 10000])
+
+    def test_many_categories_stay_under_the_cap(self):
+        wardrobe = self.wardrobe(20, 3)
+        grid, combo_scores = score_combinations(wardrobe, garment_scores(wardrobe, 'sunny', self.today))
+        self.assertLessEqual(len(grid), MAX_COMBINATIONS)
+        self.assertEqual(grid.shape[1], 20)
+        self.assertEqual(len(top_k_outfits(wardrobe, 'sunny', seed=0, today=self.today)), 3)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        clock = mock.patch('api.openai_client.time.monotonic', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow_request())
+            self.breaker.record_failure(0.1)
+
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(2):
+            self.breaker.allow_request()
+            self.breaker.record_failure(0.1)
+        self.breaker.allow_request()
+        self.breaker.record_success(0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.consecutive_failures, 0)
+        self.open_breaker()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.stats()['short_circuited'], 1)
+
+    def test_half_open_allows_a_single_probe(self):
+        self.open_breaker()
+        self.now += 29
+        self.assertFalse(self.breaker.allow_request())
+        self.now += 2
+        self.assertTrue(self.breaker.allow_request())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # Concurrent callers are short-circuited while the probe is in flight
+        self.assertFalse(self.breaker.allow_request())
+        self.breaker.record_success(0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_failed_probe_reopens(self):
+        self.open_breaker()
+        self.now += 31
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_failure(0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        # The reset timeout restarts from the failed probe
+        self.now += 31
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_latency_stats(self):
+        for latency in (0.1, 0.2, 0.3):
+            self.breaker.allow_request()
+            self.breaker.record_success(latency)
+        stats = self.breaker.stats()
+        self.assertEqual((stats['calls'], stats['successes']), (3, 3))
+        self.assertEqual(stats['avg_latency_ms'], 200.0)
+        self.assertEqual(stats['p50_latency_ms'], 200.0)
+
+
+class OpenAIClientTests(FakeOpenAIMixin, SimpleTestCase):
+    fake_server_options = {'delay': 1.0}
+
+    def setUp(self):
+        super().setUp()
+        openai_breaker.reset()
+        self.addCleanup(openai_breaker.reset)
+
+    @override_settings(OPENAI_TIMEOUT=7, OPENAI_CONNECT_TIMEOUT=2, OPENAI_MAX_RETRIES=1)
+    def test_timeouts_come_from_settings(self):
+        options = _client_options()
+        self.assertEqual(options['timeout'].read, 7)
+        self.assertEqual(options['timeout'].connect, 2)
+        self.assertEqual(options['max_retries'], 1)
+        self.assertEqual(options['base_url'], self.server.base_url)
+
+    @override_settings(OPENAI_TIMEOUT=0.2, OPENAI_MAX_RETRIES=0)
+    def test_slow_upstream_times_out_and_counts_as_failure(self):
+        started = time.monotonic()
+        with self.assertRaises(Exception) as raised:
+            chat_completion(model='gpt-4o-mini', messages=[{'role': 'user', 'content': 'hi'}])
+        self.assertNotIsInstance(raised.exception, CircuitOpenError)
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(openai_breaker.consecutive_failures, 1)
+
+    def test_open_breaker_skips_upstream(self):
+        with mock.patch.object(openai_breaker, 'allow_request', return_value=False):
+            with self.assertRaises(CircuitOpenError):
+                chat_completion(model='gpt-4o-mini', messages=[])
+        self.assertEqual(self.server.call_count, 0)
+
+
+class ThemeIndexTests(SimpleTestCase):
+    def test_stemming(self):
+        cases = {'dresses': 'dress', 'shoes': 'shoe', 'accessories': 'accessory', 'watches': 'watch',
+                 'boxes': 'box', 'jeans': 'jean', 'glass': 'glass', 'bus': 'bus'}
+        for word, expected in cases.items():
+            with self.subTest(word=word):
+                self.assertEqual(stem(word), expected)
+
+    def test_tokenize_drops_stopwords(self):
+        self.assertEqual(tokenize('Something for the Beach, with Sandals!'), ['beach', 'sandal'])
+        self.assertEqual(tokenize(None), [])
+
+    def test_query_expands_occasions_at_lower_weight(self):
+        weights = query_terms('beach wedding')
+        self.assertEqual(weights['beach'], 1.0)
+        self.assertEqual(weights['linen'], 0.5)
+        self.assertEqual(weights['suit'], 0.5)
+
+    def test_add_score_and_remove(self):
+        index = ThemeIndex()
+        index.add(1, Counter(tokenize('linen shirt linen')))
+        index.add(2, Counter(tokenize('wool coat')))
+        scores = index.score('beach')
+        self.assertEqual(set(scores), {1})
+        # Re-adding replaces the old terms
+        index.add(1, Counter(tokenize('wool sweater')))
+        self.assertEqual(index.score('beach'), {})
+        self.assertNotIn('linen', index.postings)
+        index.remove(2)
+        index.remove(2)
+        self.assertEqual(len(index), 1)
+        self.assertNotIn('coat', index.postings)
+
+
+class ThemeIndexRegistryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('themes', password='secret')
+        self.category = Category.objects.create(name='Tops')
+        self.linen = Garment.objects.create(owner=self.user, name='Linen shirt', category=self.category,
+                                            color='white', size='M', price=30)
+        self.wool = Garment.objects.create(owner=self.user, name='Wool sweater', category=self.category,
+                                           color='grey', size='M', price=60)
+        theme_index.clear()
+        self.addCleanup(theme_index.clear)
+
+    def test_relevance_is_normalized(self):
+        relevance = theme_index.relevance(self.user.id, 'beach')
+        self.assertEqual(relevance, {self.linen.id: 1.0})
+
+    def test_saves_update_the_loaded_index_on_commit(self):
+        theme_index.relevance(self.user.id, 'beach')
+        self.wool.name = 'Linen trousers'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.wool.save()
+            # Not visible until the save commits
+            self.assertNotIn(self.wool.id, theme_index.relevance(self.user.id, 'beach'))
+        with self.assertNumQueries(0):
+            self.assertIn(self.wool.id, theme_index.relevance(self.user.id, 'beach'))
+
+    def test_rolled_back_save_is_not_indexed(self):
+        theme_index.relevance(self.user.id, 'beach')
+        self.wool.name = 'Linen trousers'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.wool.save()
+        # Dropping the callbacks is what a rollback does
+        callbacks.clear()
+        self.assertNotIn(self.wool.id, theme_index.relevance(self.user.id, 'beach'))
+
+    def test_deletes_update_the_loaded_index_on_commit(self):
+        theme_index.relevance(self.user.id, 'beach')
+        linen_id = self.linen.id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.linen.delete()
+        self.assertEqual(theme_index.relevance(self.user.id, 'beach'), {})
+        self.assertNotIn(linen_id, theme_index._indexes[self.user.id][0].doc_terms)
+
+    def test_least_recently_used_user_is_evicted(self):
+        registry = ThemeIndexRegistry(max_users=1, ttl=600)
+        other = User.objects.create_user('themes-2', password='secret')
+        registry.relevance(self.user.id, 'beach')
+        registry.relevance(other.id, 'beach')
+        self.assertEqual(list(registry._indexes), [other.id])
+        with self.assertNumQueries(1):
+            registry.relevance(self.user.id, 'beach')
+
+    def test_index_is_rebuilt_after_the_ttl(self):
+        registry = ThemeIndexRegistry(ttl=60)
+        with mock.patch('api.theme_index.time.monotonic', return_value=1000.0):
+            registry.relevance(self.user.id, 'beach')
+        # A change made by another process, which sends no signal here
+        Garment.objects.filter(pk=self.wool.pk).update(name='Linen trousers')
+        with mock.patch('api.theme_index.time.monotonic', return_value=1059.0), self.assertNumQueries(0):
+            self.assertNotIn(self.wool.id, registry.relevance(self.user.id, 'beach'))
+        with mock.patch('api.theme_index.time.monotonic', return_value=1061.0):
+            self.assertIn(self.wool.id, registry.relevance(self.user.id, 'beach'))
+
+
+class RecommendationCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = RecommendationCache(max_entries=2, ttl=60, pool_size=2)
+        self.key = self.cache.make_key(1, 'fingerprint', 'Casual  Day', 'Sunny')
+
+    def test_equivalent_themes_share_a_key(self):
+        self.assertEqual(self.key, self.cache.make_key(1, 'fingerprint', 'casual day', ' SUNNY '))
+        self.assertNotEqual(self.key, self.cache.make_key(2, 'fingerprint', 'casual day', 'sunny'))
+
+    def test_pool_fills_before_rotating(self):
+        self.assertIsNone(self.cache.get(self.key))
+        self.cache.add(self.key, {'outfits': ['a']}, 1.0)
+        # One alternate isn't a full pool yet, so the model is asked again
+        self.assertIsNone(self.cache.get(self.key))
+        self.cache.add(self.key, {'outfits': ['b']}, 1.0)
+        served = [self.cache.get(self.key)['outfits'][0] for _ in range(4)]
+        self.assertEqual(served, ['a', 'b', 'a', 'b'])
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['model_calls']), (4, 2, 2))
+        self.assertEqual(stats['model_latency_saved_ms'], 4000.0)
+
+    def test_pool_keeps_the_newest_results(self):
+        for name in ['a', 'b', 'c']:
+            self.cache.add(self.key, {'outfits': [name]}, 0.1)
+        self.assertEqual({self.cache.get(self.key)['outfits'][0] for _ in range(2)}, {'b', 'c'})
+
+    def test_entries_expire(self):
+        with mock.patch('api.recommendations.time.monotonic', return_value=1000.0):
+            self.cache.add(self.key, {'outfits': ['a']}, 0.1)
+            self.cache.add(self.key, {'outfits': ['b']}, 0.1)
+        with mock.patch('api.recommendations.time.monotonic', return_value=1059.0):
+            self.assertIsNotNone(self.cache.get(self.key))
+        with mock.patch('api.recommendations.time.monotonic', return_value=1061.0):
+            self.assertIsNone(self.cache.get(self.key))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        keys = [self.cache.make_key(1, 'fingerprint', f'theme {i}', 'sunny') for i in range(3)]
+        for key in keys[:2]:
+            self.cache.add(key, {}, 0.1)
+            self.cache.add(key, {}, 0.1)
+        self.cache.get(keys[0])
+        self.cache.add(keys[2], {}, 0.1)
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+
+    def test_clear(self):
+        self.cache.add(self.key, {}, 0.1)
+        self.cache.add(self.key, {}, 0.1)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(self.key))
+
+
+class RecommendationCacheInvalidationTests(FakeOpenAIMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('cached-looks', password='secret')
+        self.garments = make_wardrobe(self.user)
+
+    def fingerprint(self):
+        return wardrobe_fingerprint(Garment.objects.filter(owner=self.user, status='clean').values_list('id', 'updated_at'))
+
+    def test_garment_edit_changes_the_key(self):
+        before = self.fingerprint()
+        self.garments[0].color = 'red'
+        self.garments[0].save()
+        self.assertNotEqual(before, self.fingerprint())
+
+    def test_cached_pool_is_not_served_after_an_edit(self):
+        pool_size = recommendation_cache.pool_size
+        for _ in range(pool_size):
+            generate_recommendations(self.user, 'office', 'sunny')
+        self.assertTrue(generate_recommendations(self.user, 'office', 'sunny').get('cached'))
+        self.assertEqual(self.server.call_count, pool_size)
+
+        Garment.objects.filter(pk=self.garments[0].pk).update(status='dirty')
+        self.assertFalse(generate_recommendations(self.user, 'office', 'sunny').get('cached'))
+        self.assertEqual(self.server.call_count, pool_size + 1)
+
+
+class ModelRecommendationValidationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('validated', password='secret')
+        self.garments = make_wardrobe(self.user)
+        other = User.objects.create_user('stranger', password='secret')
+        self.foreign = Garment.objects.create(owner=other, name='Not yours', category=self.garments[0].category,
+                                              color='red', size='S', price=5)
+
+    def model_reply(self, outfits):
+        response = SimpleNamespace(
+            model='gpt-4o-mini', usage=None,
+            choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps({'outfits': outfits})))],
+        )
+        return mock.patch('api.recommendations.chat_completion', return_value=response)
+
+    def test_unknown_garment_ids_are_dropped(self):
+        own = [g.id for g in self.garments]
+        outfits = [
+            {'name': 'Mixed', 'garment_ids': [own[0], self.foreign.id, 'x', own[0], own[1]]},
+            {'name': 'Foreign', 'garment_ids': [self.foreign.id, 99999]},
+            'not an outfit',
+        ]
+        with self.model_reply(outfits):
+            result = request_model_recommendations(self.garments, 'office', 'sunny')
+        self.assertEqual(result['outfits'], [{'name': 'Mixed', 'garment_ids': [own[0], own[1]]}])
+
+    def test_no_valid_outfit_raises(self):
+        with self.model_reply([{'name': 'Foreign', 'garment_ids': [self.foreign.id]}]):
+            with self.assertRaises(ValueError):
+                request_model_recommendations(self.garments, 'office', 'sunny')
+
+    def test_invalid_model_result_falls_back_to_local(self):
+        recommendation_cache.clear()
+        self.addCleanup(recommendation_cache.clear)
+        with mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'fake-key'}), \
+                self.model_reply([{'name': 'Foreign', 'garment_ids': [self.foreign.id]}]):
+            result = generate_recommendations(self.user, 'office', 'sunny')
+        own = {g.id for g in self.garments}
+        self.assertTrue(result['outfits'])
+        self.assertTrue(all(set(outfit['garment_ids']) <= own for outfit in result['outfits']))
+        self.assertEqual(recommendation_cache.stats()['entries'], 0)
+
+
+class RecommendationCoalescingTests(FakeOpenAIMixin, TransactionTestCase):
+    fake_server_options = {'delay': 0.5}
+
+    def test_concurrent_identical_requests_share_one_upstream_call(self):
+        user = User.objects.create_user('coalesce', password='secret')
+        make_wardrobe(user)
+        count = 8
+        barrier = threading.Barrier(count)
+        results, errors = [], []
+
+        def request():
+            barrier.wait()
+            try:
+                results.append(generate_recommendations(user, 'office', 'sunny'))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        followers_before = model_flights.local_followers
+        threads = [threading.Thread(target=request) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), count)
+        self.assertTrue(all(len(result['outfits']) == 3 for result in results))
+        self.assertEqual(self.server.call_count, 1)
+        self.assertGreater(model_flights.local_followers, followers_before)
+
+
+class SharedCacheMixin:
+    """Swaps in a cache backend every worker would share (the default is per process)"""
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        shared_cache = self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir.name,
+        }})
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+
+
+class CachedTokenAuthenticationTests(SharedCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('cached', password='secret')
+        Profile.objects.create(user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def authenticate(self):
+        return self.auth.authenticate_credentials(self.token.key)
+
+    def test_per_process_cache_disables_caching(self):
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual(token_cache_ttl(), 0)
+            self.authenticate()
+            with self.assertNumQueries(1):
+                self.authenticate()
+
+    def test_cache_hit_skips_the_database(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+            self.assertEqual(user, self.user)
+            self.assertEqual(user.profile.user_id, self.user.id)
+        self.assertEqual(token.key, self.token.key)
+
+    def test_user_change_invalidates(self):
+        self.authenticate()
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+        self.assertEqual(self.authenticate()[0].first_name, 'Renamed')
+
+    def test_login_does_not_invalidate(self):
+        self.authenticate()
+        self.user.save(update_fields=['last_login'])
+        self.assertIsNotNone(cache.get(token_cache_key(self.token.key)))
+
+    def test_profile_change_invalidates(self):
+        self.authenticate()
+        self.user.profile.bio = 'New bio'
+        self.user.profile.save()
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+        self.assertEqual(self.authenticate()[0].profile.bio, 'New bio')
+
+    def test_deleted_token_is_rejected(self):
+        self.authenticate()
+        self.token.delete()
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    @override_settings(AUTH_TOKEN_EXPIRY_HOURS=1)
+    def test_expired_token_is_deleted(self):
+        self.authenticate()
+        Token.objects.filter(pk=self.token.pk).update(created=timezone.now() - timezone.timedelta(hours=2))
+        # The cached token still carries the old creation time
+        self.assertIsNotNone(self.authenticate())
+        cache.delete(token_cache_key(self.token.key))
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+        self.assertFalse(Token.objects.filter(pk=self.token.pk).exists())
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+
+    def test_rotation_revokes_the_old_token(self):
+        self.authenticate()
+        response = self.client.post('/api/auth/rotate-token/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 200)
+        new_key = response.json()['token']
+        self.assertNotEqual(new_key, self.token.key)
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+        self.assertEqual(self.client.get('/api/auth/user/', HTTP_AUTHORIZATION=f'Token {self.token.key}').status_code, 401)
+        self.assertEqual(self.client.get('/api/auth/user/', HTTP_AUTHORIZATION=f'Token {new_key}').status_code, 200)
+
+
+class AccountLookupTests(TestCase):
+    def test_base_username_is_used_when_free(self):
+        User.objects.create_user('alice2')
+        self.assertEqual(allocate_username('alice'), 'alice')
+
+    def test_lowest_free_suffix_is_picked(self):
+        for username in ['alice', 'alice1', 'alice3', 'alice_x', 'alice2b']:
+            User.objects.create_user(username)
+        with self.assertNumQueries(1):
+            self.assertEqual(allocate_username('alice'), 'alice2')
+
+    def test_long_base_leaves_room_for_the_suffix(self):
+        username = allocate_username('a' * 200)
+        self.assertLessEqual(len(username) + 6, User._meta.get_field('username').max_length)
+
+    def test_taken_username_is_retried(self):
+        User.objects.create_user('bob')
+        # A concurrent signup takes 'bob' between allocation and insert
+        with mock.patch('api.accounts.allocate_username', side_effect=['bob', 'bob1']) as allocate:
+            user = create_user_with_unique_username('bob', email='bob@example.com')
+        self.assertEqual(user.username, 'bob1')
+        self.assertEqual(allocate.call_count, 2)
+
+    def test_retries_give_up(self):
+        User.objects.create_user('bob')
+        with mock.patch('api.accounts.allocate_username', return_value='bob'):
+            with self.assertRaises(IntegrityError):
+                create_user_with_unique_username('bob', max_attempts=3)
+
+    def test_email_lookup_ignores_case(self):
+        first = User.objects.create_user('first', email='Mixed@Example.com', password='secret')
+        User.objects.create_user('second', email='mixed@example.com', password='other')
+        self.assertEqual(find_user_by_email('MIXED@example.COM'), first)
+        self.assertIsNone(find_user_by_email(''))
+
+    def test_login_with_differently_cased_email(self):
+        User.objects.create_user('carol', email='carol@example.com', password='secret')
+        response = self.client.post('/api/auth/login/', {'username': 'CAROL@Example.com', 'password': 'secret'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['username'], 'carol')
+
+    def test_registration_rejects_differently_cased_email(self):
+        User.objects.create_user('dave', email='dave@example.com', password='secret')
+        response = self.client.post('/api/auth/send-verification/', {'email': 'Dave@EXAMPLE.com'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Email already registered')
+
+
+def usage(prompt_tokens, completion_tokens):
+    return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+class UsageLedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('spender', password='secret')
+
+    def test_ledger_totals_today_only(self):
+        record_usage(self.user.id, 'recommendation', 'gpt-4o-mini', usage(100, 20))
+        record_usage(self.user.id, 'stream', 'gpt-4o-mini', usage(30, None))
+        record_usage(self.user.id, 'stream', 'gpt-4o-mini', None)
+        old = LLMUsage.objects.create(owner=self.user, source='stream', model='gpt-4o-mini', prompt_tokens=500)
+        LLMUsage.objects.filter(pk=old.pk).update(created_at=timezone.now() - timezone.timedelta(days=2))
+        self.assertEqual(LLMUsage.objects.filter(owner=self.user).count(), 3)
+        self.assertEqual(tokens_used_today(self.user.id), 150)
+
+    def test_per_process_cache_reads_the_ledger(self):
+        record_usage(self.user.id, 'recommendation', 'gpt-4o-mini', usage(100, 0))
+        self.assertEqual(tokens_used_today(self.user.id), 100)
+        # Written by another worker, whose counter this process would never see
+        LLMUsage.objects.create(owner=self.user, source='stream', model='gpt-4o-mini', prompt_tokens=50)
+        self.assertEqual(tokens_used_today(self.user.id), 150)
+        self.assertIsNone(cache.get(usage_cache_key(self.user.id)))
+
+    @override_settings(LLM_DAILY_TOKEN_BUDGET=100)
+    def test_budget(self):
+        record_usage(self.user.id, 'recommendation', 'gpt-4o-mini', usage(60, 30))
+        self.assertFalse(over_budget(self.user.id))
+        record_usage(self.user.id, 'recommendation', 'gpt-4o-mini', usage(5, 5))
+        self.assertTrue(over_budget(self.user.id))
+        with self.settings(LLM_DAILY_TOKEN_BUDGET=0):
+            self.assertFalse(over_budget(self.user.id))
+
+
+class SharedUsageCounterTests(SharedCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('spender', password='secret')
+
+    def test_counter_is_cached_and_incremented(self):
+        record_usage(self.user.id, 'recommendation', 'gpt-4o-mini', usage(100, 0))
+        self.assertEqual(tokens_used_today(self.user.id), 100)
+        record_usage(self.user.id, 'recommendation', 'gpt-4o-mini', usage(10, 5))
+        with self.assertNumQueries(0):
+            self.assertEqual(tokens_used_today(self.user.id), 115)
+        self.assertEqual(cache.get(usage_cache_key(self.user.id)), 115)
+
+
+class UsageSummaryTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='secret')
+        self.bob = User.objects.create_user('bob', password='secret')
+        record_usage(self.alice.id, 'recommendation', 'gpt-4o-mini', usage(100, 50))
+        record_usage(self.bob.id, 'stream', 'gpt-4o-mini', usage(300, 100))
+        record_usage(self.bob.id, 'stream', 'gpt-4o-mini', usage(10, 0))
+        old = LLMUsage.objects.create(owner=self.alice, source='stream', model='gpt-4o-mini', prompt_tokens=999)
+        LLMUsage.objects.filter(pk=old.pk).update(created_at=timezone.now() - timezone.timedelta(days=30))
+        self.client = APIClient()
+
+    def test_summary(self):
+        summary = usage_summary(days=7)
+        self.assertEqual(summary['totals'], {'calls': 3, 'prompt_tokens': 410, 'completion_tokens': 150, 'users': 2})
+        self.assertEqual(summary['per_day'], [{
+            'day': timezone.localdate().isoformat(), 'calls': 3, 'prompt_tokens': 410, 'completion_tokens': 150,
+        }])
+        self.assertEqual([(row['username'], row['tokens']) for row in summary['top_users']], [('bob', 410), ('alice', 150)])
+
+    def test_endpoint_is_admin_only(self):
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.client.get('/api/ai/usage/').status_code, 403)
+
+    def test_endpoint_clamps_days(self):
+        self.client.force_authenticate(User.objects.create_superuser('admin', password='secret'))
+        response = self.client.get('/api/ai/usage/', {'days': 365})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['days'], 90)
+        self.assertEqual(response.data['totals']['prompt_tokens'], 1409)
+        self.assertEqual(self.client.get('/api/ai/usage/', {'days': 'week'}).data['days'], 7)
+
+
+class GarmentBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('batcher', password='secret')
+        self.garments = make_wardrobe(self.user, count=10)
+        other = User.objects.create_user('neighbour', password='secret')
+        self.foreign = Garment.objects.create(owner=other, name='Not yours', category=self.garments[0].category,
+                                              color='red', size='S', price=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, ids):
+        return self.client.get('/api/garments-api/batch/', {'ids': ','.join(str(i) for i in ids)})
+
+    def test_garments_are_returned_in_the_order_asked(self):
+        ids = [self.garments[3].id, self.garments[0].id, self.garments[3].id, self.garments[7].id]
+        response = self.batch(ids)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([g['id'] for g in response.data['garments']], [ids[0], ids[1], ids[3]])
+        self.assertEqual(response.data['missing'], [])
+
+    def test_other_users_garments_are_missing(self):
+        response = self.batch([self.garments[0].id, self.foreign.id, 999999])
+        self.assertEqual([g['id'] for g in response.data['garments']], [self.garments[0].id])
+        # Someone else's garment looks exactly like one that doesn't exist
+        self.assertEqual(response.data['missing'], [self.foreign.id, 999999])
+
+    def test_invalid_ids_are_rejected(self):
+        for ids in ('', '1,two', '1.5', ','):
+            with self.subTest(ids=ids):
+                response = self.client.get('/api/garments-api/batch/', {'ids': ids})
+                self.assertEqual(response.status_code, 400)
+
+    @override_settings(GARMENT_BATCH_LIMIT=3)
+    def test_limit(self):
+        self.assertEqual(self.batch([g.id for g in self.garments[:3]]).status_code, 200)
+        self.assertEqual(self.batch([g.id for g in self.garments[:4]]).status_code, 400)
+        # Repeated ids count once
+        self.assertEqual(self.batch([self.garments[0].id] * 5).status_code, 200)
+
+    def test_query_count_does_not_grow_with_ids(self):
+        with CaptureQueriesContext(connection) as few:
+            self.batch([g.id for g in self.garments[:2]])
+        with CaptureQueriesContext(connection) as many:
+            self.batch([g.id for g in self.garments])
+        self.assertEqual(len(few), len(many))
+
+    def test_include_garments_only_lists_own_garments(self):
+        own = self.garments[0]
+        result = {'outfits': [{'name': 'Look', 'garment_ids': [own.id, self.foreign.id]}]}
+        with mock.patch('api.views.generate_recommendations', return_value=result):
+            response = self.client.post('/api/ai/outfit-recommendations/',
+                                        {'theme': 'office', 'include_garments': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.data['garments']), [str(own.id)])
+        self.assertEqual(response.data['garments'][str(own.id)]['name'], own.name)
+
+    def test_include_garments_query_count(self):
+        def run(count):
+            result = {'outfits': [{'name': 'Look', 'garment_ids': [g.id for g in self.garments[:count]]}]}
+            with mock.patch('api.views.generate_recommendations', return_value=result), \
+                    CaptureQueriesContext(connection) as queries:
+                self.client.post('/api/ai/outfit-recommendations/', {'include_garments': '1'}, format='json')
+            return len(queries)
+        self.assertEqual(run(2), run(10))
+
+
+class AccountDeletionTests(TestCase):
+    confirmation = 'i want to delete my garmently account'
+
+    def setUp(self):
+        self.user = User.objects.create_user('leaving', email='leaving@example.com', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        Profile.objects.create(user=self.user)
+        self.garments = make_wardrobe(self.user, count=5)
+        outfit = Outfit.objects.create(owner=self.user, name='Last look')
+        outfit.garments.set(self.garments[:2])
+        LLMUsage.objects.create(owner=self.user, source='stream', model='gpt-4o-mini', prompt_tokens=10)
+        self.other = User.objects.create_user('staying', password='secret')
+        self.other_garment = Garment.objects.create(owner=self.other, name='Mine', category=self.garments[0].category,
+                                                    color='red', size='S', price=5)
+
+    def delete(self, confirmation=confirmation):
+        return self.client.post('/api/auth/delete-account/', {'confirmation': confirmation},
+                                content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def assert_user_data_gone(self):
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Garment.objects.filter(owner_id=self.user.pk).exists())
+        self.assertFalse(Outfit.objects.filter(owner_id=self.user.pk).exists())
+        self.assertFalse(Profile.objects.filter(user_id=self.user.pk).exists())
+        self.assertTrue(Garment.objects.filter(pk=self.other_garment.pk).exists())
+
+    def test_wrong_confirmation_is_rejected(self):
+        self.assertEqual(self.delete('delete me').status_code, 400)
+        self.assertTrue(User.objects.get(pk=self.user.pk).is_active)
+        self.assertFalse(AccountDeletion.objects.exists())
+
+    def test_request_deactivates_and_schedules_after_commit(self):
+        with mock.patch('api.account_deletion.get_executor') as get_executor:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.delete()
+                # Nothing runs before the request's transaction commits
+                get_executor.assert_not_called()
+            self.assertEqual(len(callbacks), 1)
+            callbacks[0]()
+        self.assertEqual(response.status_code, 202)
+        deletion = AccountDeletion.objects.get(user_id=self.user.pk)
+        self.assertEqual(response.json()['deletion_id'], deletion.pk)
+        self.assertEqual((deletion.status, deletion.username), ('pending', 'leaving'))
+        self.assertFalse(User.objects.get(pk=self.user.pk).is_active)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+        get_executor.return_value.submit.assert_called_once_with(_run_in_background, deletion.pk)
+
+    @override_settings(ACCOUNT_DELETION_ASYNC=False)
+    def test_deletion_removes_only_the_users_data(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.delete()
+        self.assert_user_data_gone()
+        deletion = AccountDeletion.objects.get(user_id=self.user.pk)
+        self.assertEqual(deletion.status, 'done')
+        self.assertEqual(deletion.deleted['garments'], 5)
+        self.assertEqual(deletion.deleted['outfit_garments'], 2)
+        self.assertEqual(deletion.deleted['user'], 1)
+        # Signed out straight away
+        self.assertEqual(self.client.get('/api/auth/user/', HTTP_AUTHORIZATION=f'Token {self.token.key}').status_code, 401)
+
+    def test_chunks_record_progress(self):
+        deletion = AccountDeletion.objects.create(user_id=self.user.pk, username=self.user.username)
+        with CaptureQueriesContext(connection) as queries:
+            delete_in_chunks(deletion, 'garments', Garment.objects.filter(owner=self.user), chunk_size=2)
+        self.assertFalse(Garment.objects.filter(owner=self.user).exists())
+        deletion.refresh_from_db()
+        self.assertEqual((deletion.stage, deletion.deleted), ('garments', {'garments': 5}))
+        progress_updates = [q for q in queries if q['sql'].startswith('UPDATE "api_accountdeletion"')]
+        self.assertEqual(len(progress_updates), 3)
+
+    def test_failed_run_resumes_where_it_stopped(self):
+        self.user.is_active = False
+        self.user.save()
+        deletion = AccountDeletion.objects.create(user_id=self.user.pk, username=self.user.username)
+        with mock.patch('api.account_deletion.unshared_files', side_effect=[[], OSError('storage is down')]):
+            with self.assertRaises(OSError):
+                run_account_deletion(deletion.pk, chunk_size=2)
+        deletion.refresh_from_db()
+        self.assertEqual((deletion.status, deletion.stage), ('failed', 'garments'))
+        self.assertEqual(deletion.deleted['garments'], 2)
+        self.assertEqual(deletion.error, 'storage is down')
+        self.assertEqual(Garment.objects.filter(owner_id=self.user.pk).count(), 3)
+
+        AccountDeletion.objects.filter(pk=deletion.pk).update(updated_at=timezone.now() - timezone.timedelta(hours=1))
+        out = StringIO()
+        call_command('resume_account_deletions', stdout=out)
+        self.assertIn('Finished 1 of 1', out.getvalue())
+        deletion.refresh_from_db()
+        self.assertEqual((deletion.status, deletion.error), ('done', ''))
+        self.assertEqual(deletion.deleted['garments'], 5)
+        self.assert_user_data_gone()
+        # A finished deletion is left alone
+        self.assertEqual(run_account_deletion(deletion.pk).status, 'done')
+
+
+class RecommendationStreamAuthTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('streamer', password='secret')
+        self.token = Token.objects.create(user=self.user)
+
+    def test_session_login_is_not_accepted(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/api/ai/outfit-recommendations/stream/', {'theme': 'office'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_non_object_body_is_rejected(self):
+        response = self.client.post('/api/ai/outfit-recommendations/stream/', ['office'],
+                                    content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 400)
+
+
+class PlanOutfitWeekTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('planner', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def plan(self, **data):
+        return self.client.post('/api/ai/outfit-plan/', dict({'start_date': '2024-03-04', 'end_date': '2024-03-06'}, **data),
+                                format='json')
+
+    def test_impossible_date_is_rejected(self):
+        self.assertEqual(self.plan(start_date='2024-02-30', end_date='2024-03-02').status_code, 400)
+
+    def test_overlong_theme_or_weather_is_rejected(self):
+        make_wardrobe(self.user)
+        for data in (
+            {'theme': 'x' * (MAX_THEME_LENGTH + 1)},
+            {'weather': 'x' * (MAX_WEATHER_LENGTH + 1)},
+            {'themes': ['office', 'x' * (MAX_THEME_LENGTH + 1)]},
+            {'weathers': {'2024-03-05': 'x' * (MAX_WEATHER_LENGTH + 1)}},
+        ):
+            with self.subTest(data=list(data)):
+                self.assertEqual(self.plan(**data).status_code, 400)
+        self.assertFalse(Outfit.objects.exists())
+
+    def test_longest_theme_and_weather_fit(self):
+        make_wardrobe(self.user)
+        response = self.plan(theme='x' * MAX_THEME_LENGTH, weathers=['y' * MAX_WEATHER_LENGTH])
+        self.assertEqual(response.status_code, 201)
+        names = Outfit.objects.filter(owner=self.user).values_list('name', flat=True)
+        self.assertEqual(len(names), 3)
+        self.assertTrue(all(len(name) <= Outfit._meta.get_field('name').max_length for name in names))
+
+
+class OutfitOfTheDayTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('daily', password='secret')
+        make_wardrobe(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        save_daily_outfits(compute_daily_outfits([self.user.id], timezone.localdate(), 'moderate'))
+
+    def test_precomputed_outfit_is_used_without_weather(self):
+        response = self.client.get('/api/ai/outfit-of-the-day/')
+        self.assertTrue(response.data['precomputed'])
+        self.assertEqual(response.data['weather'], 'moderate')
+
+    def test_other_weather_recomputes(self):
+        response = self.client.get('/api/ai/outfit-of-the-day/', {'weather': 'rainy'})
+        self.assertFalse(response.data['precomputed'])
+        self.assertEqual(response.data['weather'], 'rainy')
+        self.assertEqual(DailyOutfit.objects.get(owner=self.user).weather, 'rainy')
+
+    def test_overlong_weather_is_rejected(self):
+        response = self.client.get('/api/ai/outfit-of-the-day/', {'weather': 'x' * 101})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(DailyOutfit.objects.get(owner=self.user).weather, 'moderate')
+
+
+class VariantNameTests(SimpleTestCase):
+    def test_sources_differing_only_by_extension_get_distinct_variants(self):
+        self.assertEqual(variant_name('garments/x.jpg', 'thumb'), 'garments/x.jpg.thumb.webp')
+        self.assertNotEqual(variant_name('garments/x.jpg', 'thumb'), variant_name('garments/x.png', 'thumb'))
+
+
+S3_SETTINGS = {
+    'USE_S3': True,
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_STORAGE_BUCKET_NAME': 'garmently-test',
+    'AWS_S3_REGION_NAME': 'us-east-1',
+    'AWS_S3_ENDPOINT_URL': None,
+    'AWS_QUERYSTRING_AUTH': False,
+    'IMAGE_VARIANTS_ASYNC': False,
+    'STORAGES': dict(settings.STORAGES, default={'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage'}),
+}
+
+
+class WardrobeExportTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = media_root.name
+
+        self.user = User.objects.create_user('exporter', email='exporter@example.com', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.garments = make_wardrobe(self.user, count=3)
+        self.outfit = Outfit.objects.create(owner=self.user, name='Weekend')
+        self.outfit.garments.set(self.garments[:2])
+        Outfit.objects.create(owner=self.user, name='Empty')
+        WearHistory.objects.create(garment=self.garments[0], occasion='work')
+        LaundryItem.objects.create(garment=self.garments[1])
+        self.attach_photo(self.garments[0], 'garments/shirt.jpg', b'shirt-bytes')
+
+        other = User.objects.create_user('bystander', password='secret')
+        other_garment = Garment.objects.create(owner=other, name='Private', category=self.garments[0].category,
+                                               color='red', size='S', price=5)
+        Outfit.objects.create(owner=other, name='Private look').garments.set([other_garment])
+        WearHistory.objects.create(garment=other_garment)
+        LaundryItem.objects.create(garment=other_garment)
+        self.attach_photo(other_garment, 'garments/private.jpg', b'private-bytes')
+
+    def attach_photo(self, garment, name, content):
+        path = os.path.join(self.media_root, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+        Garment.objects.filter(pk=garment.pk).update(image=name)
+
+    def export(self, mode=None):
+        response = self.client.get('/api/export/', {'mode': mode} if mode else {},
+                                   HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def records(self, content):
+        records = {}
+        for line in content.decode().splitlines():
+            entry = json.loads(line)
+            records.setdefault(entry['type'], []).append(entry['data'])
+        return records
+
+    def test_ndjson_export(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('.ndjson"', response['Content-Disposition'])
+        records = self.records(content)
+        self.assertEqual(content.decode().splitlines()[0], json.dumps({'type': 'export', 'data': records['export'][0]}))
+        self.assertEqual(records['export'][0]['user']['username'], 'exporter')
+        self.assertEqual([g['id'] for g in records['garment']], [g.id for g in self.garments])
+        self.assertEqual(records['garment'][0]['category'], self.garments[0].category.name)
+        self.assertEqual(records['garment'][0]['image'], 'garments/shirt.jpg')
+        outfits = {o['name']: o['garment_ids'] for o in records['outfit']}
+        self.assertEqual(outfits, {'Weekend': [self.garments[0].id, self.garments[1].id], 'Empty': []})
+        self.assertEqual(len(records['wear_history']), 1)
+        self.assertEqual(len(records['laundry']), 1)
+
+    def test_zip_export(self):
+        response, content = self.export('zip')
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['wardrobe.ndjson', 'images/garments/shirt.jpg'])
+            self.assertEqual(archive.read('images/garments/shirt.jpg'), b'shirt-bytes')
+            records = self.records(archive.read('wardrobe.ndjson'))
+        self.assertEqual(len(records['garment']), 3)
+
+    def test_missing_photo_is_skipped(self):
+        os.remove(os.path.join(self.media_root, 'garments', 'shirt.jpg'))
+        _, content = self.export('zip')
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            self.assertEqual(archive.namelist(), ['wardrobe.ndjson'])
+
+    def import_as_new_user(self, content, filename, **options):
+        importer = User.objects.create_user(f'importer-{filename}', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            report = import_garments(importer, BytesIO(content), filename, **options)
+        return importer, report
+
+    @override_settings(IMAGE_VARIANTS_ASYNC=False)
+    def test_ndjson_export_imports_without_its_photos(self):
+        _, content = self.export()
+        importer, report = self.import_as_new_user(content, 'wardrobe.ndjson')
+        self.assertEqual((report['created'], report['failed'], report['images']), (3, 0, 0))
+        self.assertEqual([w['row'] for w in report['warnings']], [1])
+        self.assertIn('no images zip', report['warnings'][0]['warnings']['image'][0])
+        imported = Garment.objects.filter(owner=importer).order_by('name')
+        self.assertEqual([g.name for g in imported], [g.name for g in self.garments])
+        self.assertFalse(any(g.image for g in imported))
+
+    @override_settings(IMAGE_VARIANTS_ASYNC=False)
+    def test_zip_export_imports_with_its_photos(self):
+        self.attach_photo(self.garments[0], 'garments/shirt.jpg', jpeg_bytes())
+        _, content = self.export('zip')
+        importer, report = self.import_as_new_user(content, 'wardrobe.zip')
+        self.assertEqual((report['created'], report['failed'], report['images'], report['warnings']), (3, 0, 1, []))
+        photo = Garment.objects.get(owner=importer, name=self.garments[0].name).image
+        with photo.open('rb') as file:
+            self.assertEqual(file.read(), jpeg_bytes())
+
+    def test_invalid_mode(self):
+        response = self.client.get('/api/export/', {'mode': 'csv'}, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_asgi_export_streams_asynchronously(self):
+        response = await self.async_client.get('/api/export/', {'mode': 'zip'},
+                                               headers={'Authorization': f'Token {self.token.key}'})
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            self.assertEqual(archive.namelist(), ['wardrobe.ndjson', 'images/garments/shirt.jpg'])
+
+    def test_buffered_groups_small_chunks(self):
+        self.assertEqual(list(buffered([b'ab', b'cd', b'e'], size=3)), [b'abcd', b'e'])
+        self.assertEqual(list(buffered([])), [])
+
+    def test_zip_sink_needs_no_seek(self):
+        sink = ZipSink()
+        chunks = []
+        with zipfile.ZipFile(sink, 'w') as archive:
+            with archive.open('a.txt', 'w') as entry:
+                entry.write(b'hello')
+                chunks.extend(sink.drain())
+        chunks.extend(sink.drain())
+        with zipfile.ZipFile(BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(archive.read('a.txt'), b'hello')
+        self.assertEqual(list(sink.drain()), [])
+
+
+class GcMediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = media_root.name
+        user = User.objects.create_user('collector', password='secret')
+        self.garment = make_wardrobe(user, count=1)[0]
+        Garment.objects.filter(pk=self.garment.pk).update(
+            image='garments/kept.jpg',
+            image_variants={'source': 'garments/kept.jpg', 'thumb': 'garments/kept.jpg.thumb.webp'},
+        )
+        StoredImage.objects.create(name='garments/stored.jpg', ref_count=1)
+        old = time.time() - 3 * 86400
+        for name in ('garments/kept.jpg', 'garments/kept.jpg.thumb.webp', 'garments/stored.jpg',
+                     'garments/orphan.jpg', 'garments/orphan.jpg.thumb.webp', 'profiles/orphan.png'):
+            self.write(name, mtime=old)
+        self.write('garments/just-uploaded.jpg')
+
+    def write(self, name, mtime=None):
+        path = os.path.join(self.media_root, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(b'x' * 10)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def remaining(self):
+        return {
+            os.path.relpath(os.path.join(directory, filename), self.media_root).replace(os.sep, '/')
+            for directory, _, files in os.walk(self.media_root)
+            for filename in files
+        }
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command('gc_media', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_orphans_are_deleted(self):
+        output = self.collect()
+        self.assertEqual(self.remaining(), {
+            'garments/kept.jpg', 'garments/kept.jpg.thumb.webp', 'garments/stored.jpg', 'garments/just-uploaded.jpg',
+        })
+        self.assertIn('3 orphans', output)
+        self.assertIn('1 too recent to judge', output)
+        self.assertIn('deleted 3', output)
+
+    def test_grace_period(self):
+        self.collect('--grace-hours', '100')
+        self.assertIn('garments/orphan.jpg', self.remaining())
+        self.collect('--grace-hours', '0')
+        self.assertNotIn('garments/just-uploaded.jpg', self.remaining())
+
+    def test_dry_run_deletes_nothing(self):
+        before = self.remaining()
+        output = self.collect('--dry-run')
+        self.assertEqual(self.remaining(), before)
+        self.assertIn('orphan: garments/orphan.jpg', output)
+        self.assertIn('dry run, nothing deleted', output)
+
+    def test_prefix(self):
+        self.collect('--prefix', 'profiles/')
+        self.assertNotIn('profiles/orphan.png', self.remaining())
+        self.assertIn('garments/orphan.jpg', self.remaining())
+
+    def test_names_missed_by_the_filter_are_checked_exactly(self):
+        # As if the filter missed kept.jpg (it was saved after the scan): the exact
+        # check before deleting still finds the reference
+        with mock.patch('api.management.commands.gc_media.BloomFilter.__contains__', return_value=False):
+            self.collect()
+        self.assertEqual(self.remaining(), {
+            'garments/kept.jpg', 'garments/kept.jpg.thumb.webp', 'garments/stored.jpg', 'garments/just-uploaded.jpg',
+        })
+
+    def test_false_positive_only_keeps_an_orphan(self):
+        with mock.patch('api.management.commands.gc_media.BloomFilter.__contains__', return_value=True):
+            output = self.collect()
+        self.assertIn('garments/orphan.jpg', self.remaining())
+        self.assertIn('0 orphans', output)
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000)
+        names = [f'garments/{i}.jpg' for i in range(1000)]
+        for name in names:
+            bloom.add(name)
+        self.assertTrue(all(name in bloom for name in names))
+        false_positives = sum(f'profiles/{i}.png' in bloom for i in range(10000))
+        self.assertLess(false_positives, 50)
+
+
+@unittest.skipUnless(mock_aws, 'moto is not installed')
+@override_settings(**S3_SETTINGS)
+class SyncImagesToS3Tests(SimpleTestCase):
+    def setUp(self):
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='garmently-test')
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.media = os.path.join(workdir.name, 'media')
+        self.manifest = os.path.join(workdir.name, 'manifest.jsonl')
+        self.write('garments/a.jpg', b'a' * 100)
+        self.write('profiles/b.png', b'b' * 50)
+        self.write('garments/notes.txt', b'not an image')
+
+    def write(self, key, content, mtime=1_700_000_000):
+        path = os.path.join(self.media, *key.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+        os.utime(path, (mtime, mtime))
+
+    def sync(self, *args, **options):
+        out = StringIO()
+        options.setdefault('manifest', self.manifest)
+        call_command('sync_images_to_s3', *args, source=self.media, workers=2, stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def remote(self):
+        return {obj['Key']: obj['Size'] for obj in self.s3.list_objects_v2(Bucket='garmently-test').get('Contents', [])}
+
+    def test_uploads_images(self):
+        self.assertIn('Uploaded 2 files', self.sync())
+        self.assertEqual(self.remote(), {'garments/a.jpg': 100, 'profiles/b.png': 50})
+        head = self.s3.head_object(Bucket='garmently-test', Key='garments/a.jpg')
+        self.assertEqual(head['ContentType'], 'image/jpeg')
+
+    def test_unchanged_files_are_skipped(self):
+        self.sync(manifest='')
+        with mock.patch('boto3.s3.transfer.S3Transfer.upload_file') as upload:
+            output = self.sync(manifest='')
+        upload.assert_not_called()
+        self.assertIn('Uploaded 0 files', output)
+        self.assertIn('2 skipped', output)
+
+    def test_size_change_is_uploaded(self):
+        self.sync()
+        self.write('garments/a.jpg', b'a' * 120)
+        self.assertIn('Uploaded 1 files', self.sync())
+        self.assertEqual(self.remote()['garments/a.jpg'], 120)
+
+    def test_etag_change_is_uploaded(self):
+        self.sync(manifest='')
+        # Same size, different bytes: only the ETag tells them apart
+        self.write('garments/a.jpg', b'c' * 100, mtime=1_700_000_100)
+        self.assertIn('Uploaded 1 files', self.sync(manifest=''))
+        body = self.s3.get_object(Bucket='garmently-test', Key='garments/a.jpg')['Body'].read()
+        self.assertEqual(body, b'c' * 100)
+
+    def test_resume_from_manifest(self):
+        self.sync()
+        with open(self.manifest) as file:
+            self.assertEqual({json.loads(line)['key'] for line in file}, {'garments/a.jpg', 'profiles/b.png'})
+        # Files recorded in the manifest with the same size and mtime aren't hashed again
+        with mock.patch('api.management.commands.sync_images_to_s3.local_etag') as etag:
+            output = self.sync()
+        etag.assert_not_called()
+        self.assertIn('2 skipped', output)
+
+    def test_interrupted_manifest_resumes(self):
+        self.s3.put_object(Bucket='garmently-test', Key='garments/a.jpg', Body=b'a' * 100)
+        with open(self.manifest, 'w') as file:
+            file.write(json.dumps({'key': 'garments/a.jpg', 'size': 100, 'mtime_ns': 1_700_000_000 * 10 ** 9}) + '\n')
+            file.write('{"key": "profiles/b.p')
+        output = self.sync()
+        self.assertIn('Uploaded 1 files', output)
+        self.assertIn('1 skipped', output)
+        self.assertEqual(set(self.remote()), {'garments/a.jpg', 'profiles/b.png'})
+        # The entry written after the cut-off line can be read back
+        with mock.patch('api.management.commands.sync_images_to_s3.local_etag') as etag:
+            self.assertIn('2 skipped', self.sync())
+        etag.assert_not_called()
+
+    def test_dry_run_uploads_nothing(self):
+        output = self.sync('--dry-run')
+        self.assertIn('Would upload 2 files', output)
+        self.assertEqual(self.remote(), {})
+        self.assertFalse(os.path.exists(self.manifest))
+
+    def test_all_files(self):
+        self.sync('--all-files')
+        self.assertIn('garments/notes.txt', self.remote())
+
+
+@unittest.skipUnless(mock_aws, 'moto is not installed')
+@override_settings(**S3_SETTINGS)
+class DirectUploadTests(TestCase):
+    def setUp(self):
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='garmently-test')
+        self.user = User.objects.create_user('uploader', password='secret')
+        self.garments = make_wardrobe(self.user, count=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self):
+        """Issue a presigned POST, then put a small JPEG at its key as the client would"""
+        response = self.client.post('/api/garments-api/upload-url/', {'content_type': 'image/jpeg'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['fields']['key'], response.data['key'])
+        buffer = BytesIO()
+        Image.new('RGB', (32, 32), 'red').save(buffer, 'JPEG')
+        self.s3.put_object(Bucket='garmently-test', Key=response.data['key'], Body=buffer.getvalue(),
+                           ContentType='image/jpeg')
+        return response.data['key']
+
+    def confirm(self, garment, key):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/garments-api/{garment.pk}/confirm-upload/', {'key': key}, format='json')
+
+    def exists(self, key):
+        try:
+            self.s3.head_object(Bucket='garmently-test', Key=key)
+            return True
+        except ClientError:
+            return False
+
+    def test_confirm_attaches_and_renders_variants(self):
+        key = self.upload()
+        self.assertEqual(self.confirm(self.garments[0], key).status_code, 200)
+        garment = Garment.objects.get(pk=self.garments[0].pk)
+        self.assertEqual(garment.image.name, key)
+        self.assertEqual(StoredImage.objects.get(name=key).ref_count, 1)
+        self.assertEqual(garment.image_variants['source'], key)
+        self.assertTrue(self.exists(garment.image_variants['thumb']))
+
+    def test_key_can_only_be_attached_once(self):
+        key = self.upload()
+        self.confirm(self.garments[0], key)
+        response = self.confirm(self.garments[1], key)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Garment.objects.get(pk=self.garments[1].pk).image)
+
+    def test_other_users_key_is_rejected(self):
+        other = User.objects.create_user('other', password='secret')
+        self.s3.put_object(Bucket='garmently-test', Key=f'garments/{other.pk}/photo.jpg', Body=b'x',
+                           ContentType='image/jpeg')
+        response = self.confirm(self.garments[0], f'garments/{other.pk}/photo.jpg')
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_upload_is_rejected(self):
+        response = self.confirm(self.garments[0], f'garments/{self.user.pk}/never-uploaded.jpg')
+        self.assertEqual(response.status_code, 400)
+
+    def test_replaced_upload_is_deleted(self):
+        first = self.upload()
+        self.confirm(self.garments[0], first)
+        thumb = Garment.objects.get(pk=self.garments[0].pk).image_variants['thumb']
+        self.confirm(self.garments[0], self.upload())
+        self.assertFalse(self.exists(first))
+        self.assertFalse(self.exists(thumb))
+        self.assertFalse(StoredImage.objects.filter(name=first).exists())
+
+    def test_deleted_garment_releases_upload(self):
+        key = self.upload()
+        self.confirm(self.garments[0], key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/garments-api/{self.garments[0].pk}/')
+        self.assertFalse(self.exists(key))
+
+
+class GarmentImageReferenceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('photos', password='secret')
+        self.garment = make_wardrobe(self.user, count=1)[0]
+
+    def test_save_without_image_change_skips_the_lookup(self):
+        garment = Garment.objects.get(pk=self.garment.pk)
+        garment.name = 'Renamed'
+        with CaptureQueriesContext(connection) as queries:
+            garment.save()
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT "api_garment"."image"')])
+
+    def test_changed_image_releases_the_previous_one(self):
+        StoredImage.objects.create(sha256='a' * 64, name='garments/a.jpg', ref_count=1)
+        Garment.objects.filter(pk=self.garment.pk).update(image='garments/a.jpg')
+        garment = Garment.objects.get(pk=self.garment.pk)
+        garment.image.name = 'garments/b.jpg'
+        garment.save()
+        self.assertFalse(StoredImage.objects.filter(name='garments/a.jpg').exists())
+
+    def test_recount_keeps_recent_unreferenced_images(self):
+        recent = StoredImage.objects.create(sha256='b' * 64, name='garments/recent.jpg', ref_count=1)
+        old = StoredImage.objects.create(sha256='c' * 64, name='garments/old.jpg', ref_count=1)
+        StoredImage.objects.filter(pk=old.pk).update(created_at=timezone.now() - timezone.timedelta(hours=2))
+        call_command('dedupe_garment_images', stdout=StringIO())
+        self.assertTrue(StoredImage.objects.filter(pk=recent.pk).exists())
+        self.assertFalse(StoredImage.objects.filter(pk=old.pk).exists())
+
+
+def photo_zip(**members):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def jpeg_bytes(color='red'):
+    buffer = BytesIO()
+    Image.new('RGB', (16, 16), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@override_settings(IMAGE_VARIANTS_ASYNC=False)
+class GarmentImportTests(TestCase):
+    header = 'name,category,color,size,price,image\n'
+
+    def setUp(self):
+        self.user = User.objects.create_user('importer', password='secret')
+        Category.objects.create(name='Tops')
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = media_root.name
+
+    def csv(self, *rows):
+        return BytesIO((self.header + ''.join(f'{row}\n' for row in rows)).encode())
+
+    def test_unreadable_csv_after_saved_batches_reports_the_partial_import(self):
+        rows = [f'Shirt {i},Tops,blue,M,10,' for i in range(IMPORT_BATCH_SIZE + 100)]
+        file = BytesIO(self.csv(*rows).getvalue() + b'Bad \xff row,Tops,blue,M,10,\n')
+        report = import_garments(self.user, file, 'garments.csv')
+        # Text is decoded in blocks, so the rows sharing a block with the bad bytes are lost too
+        self.assertGreater(report['created'], 0)
+        self.assertIn('Could not read the CSV file', report['truncated'])
+        self.assertEqual(Garment.objects.filter(owner=self.user).count(), report['created'])
+
+    def test_unreadable_csv_without_rows_is_an_error(self):
+        with self.assertRaises(GarmentImportError):
+            import_garments(self.user, BytesIO(b'name,category\n\xff\xfe,Tops\n'), 'garments.csv')
+
+    @override_settings(GARMENT_IMPORT_MAX_PHOTO_BYTES=100)
+    def test_oversized_photo_is_a_row_error(self):
+        images = photo_zip(**{'big.jpg': jpeg_bytes() + b'\0' * 200})
+        report = import_garments(self.user, self.csv('Shirt,Tops,blue,M,10,big.jpg'), 'garments.csv', images=images)
+        self.assertEqual((report['created'], report['failed']), (0, 1))
+        self.assertIn('image', report['errors'][0]['errors'])
+
+    def test_photo_missing_from_the_zip_is_a_warning(self):
+        images = photo_zip(**{'other.jpg': jpeg_bytes()})
+        report = import_garments(self.user, self.csv('Shirt,Tops,blue,M,10,shirt.jpg'), 'garments.csv', images=images)
+        self.assertEqual((report['created'], report['failed'], report['images']), (1, 0, 0))
+        self.assertEqual(report['warnings'][0]['row'], 1)
+        self.assertIn('not in the images zip', report['warnings'][0]['warnings']['image'][0])
+        self.assertFalse(Garment.objects.get(owner=self.user).image)
+
+    @override_settings(GARMENT_IMPORT_MAX_ZIP_BYTES=1000)
+    def test_oversized_zip_is_rejected_before_reading(self):
+        images = photo_zip(**{'big.jpg': b'\0' * 5000})
+        with self.assertRaises(GarmentImportError):
+            import_garments(self.user, self.csv('Shirt,Tops,blue,M,10,big.jpg'), 'garments.csv', images=images)
+
+    def test_failed_batch_deletes_the_photos_it_stored(self):
+        images = photo_zip(**{'shirt.jpg': jpeg_bytes()})
+        with mock.patch.object(Garment.objects, 'bulk_create', side_effect=RuntimeError('insert failed')):
+            with self.assertRaises(RuntimeError):
+                import_garments(self.user, self.csv('Shirt,Tops,blue,M,10,shirt.jpg'), 'garments.csv', images=images)
+        self.assertFalse(StoredImage.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'garments')), [])
+
+    def test_photos_are_imported(self):
+        images = photo_zip(**{'shirt.jpg': jpeg_bytes()})
+        with self.captureOnCommitCallbacks(execute=True):
+            report = import_garments(self.user, self.csv('Shirt,Tops,blue,M,10,shirt.jpg'), 'garments.csv', images=images)
+        self.assertEqual((report['created'], report['images']), (1, 1))
+        garment = Garment.objects.get(owner=self.user)
+        self.assertEqual(StoredImage.objects.get(name=garment.image.name).ref_count, 1)
+        self.assertEqual(garment.image_variants['source'], garment.image.name)
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('retrier', password='secret')
+        self.category = Category.objects.create(name='Tops')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, key, name='Shirt', client=None):
+        data = {'name': name, 'category': self.category.pk, 'color': 'blue', 'size': 'M', 'price': '10'}
+        return (client or self.client).post('/api/garments-api/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.create('k1')
+        retry = self.create('k1')
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Garment.objects.filter(owner=self.user).count(), 1)
+
+    def test_key_reused_for_another_body_is_rejected(self):
+        self.create('k1')
+        response = self.create('k1', name='Jacket')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Garment.objects.filter(owner=self.user).count(), 1)
+
+    def test_retry_while_the_first_attempt_runs_is_a_conflict(self):
+        # A pending row is what a concurrent first attempt leaves until it finishes
+        self.create('k1')
+        IdempotencyKey.objects.filter(user_id=self.user.id).update(status_code=None, response=None)
+        response = self.create('k1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_expired_key_runs_the_request_again(self):
+        self.create('k1')
+        IdempotencyKey.objects.filter(user_id=self.user.id).update(expires_at=timezone.now())
+        response = self.create('k1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Garment.objects.filter(owner=self.user).count(), 2)
+
+    def test_keys_are_scoped_per_user(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('other', password='secret'))
+        self.create('k1')
+        response = self.create('k1', client=other)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Garment.objects.count(), 2)
+
+    def test_header_keys_do_not_collide_with_sync_ops(self):
+        op = {'op_id': 'g1', 'type': 'garment.create',
+              'data': {'name': 'Synced', 'category': self.category.pk, 'color': 'blue', 'size': 'M', 'price': '10'}}
+        self.client.post('/api/sync/', {'operations': [op]}, format='json')
+        response = self.create('op:g1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['name'], 'Shirt')
+
+    def test_returned_4xx_is_stored(self):
+        response = self.client.post('/api/garments/', {'name': 'Shirt'}, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(response.status_code, 400)
+        retry = self.client.post('/api/garments/', {'name': 'Shirt'}, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual((retry.status_code, retry['Idempotent-Replayed']), (400, 'true'))
+
+    def test_raised_errors_release_the_key(self):
+        response = self.client.post('/api/garments-api/', {'name': 'Shirt'}, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(response.status_code, 400)
+        with mock.patch('api.views.GarmentViewSet.perform_create', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.create('k2')
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class OfflineSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('offline', password='secret')
+        self.category = Category.objects.create(name='Tops')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, *operations, **options):
+        return self.client.post('/api/sync/', dict(options, operations=list(operations)), format='json')
+
+    def garment_create(self, op_id):
+        return {'op_id': op_id, 'type': 'garment.create',
+                'data': {'name': 'Shirt', 'category': self.category.pk, 'color': 'blue', 'size': 'M', 'price': '10'}}
+
+    def test_create_and_refer_to_it(self):
+        response = self.sync(self.garment_create('g1'), {'op_id': 'w1', 'type': 'garment.wear', 'id': '@g1'})
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 200])
+
+    def test_reference_to_another_kind_is_rejected(self):
+        garment = make_wardrobe(self.user, count=1)[0]
+        garment.status = 'dirty'
+        garment.save()
+        response = self.sync(
+            {'op_id': 'l1', 'type': 'laundry.add', 'garment_id': garment.pk},
+            {'op_id': 'w1', 'type': 'garment.wear', 'id': '@l1'},
+        )
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 400])
+
+    def test_replayed_laundry_create_is_not_a_garment(self):
+        garment = make_wardrobe(self.user, count=1)[0]
+        Garment.objects.filter(pk=garment.pk).update(status='dirty')
+        add = {'op_id': 'l1', 'type': 'laundry.add', 'garment_id': garment.pk}
+        self.assertEqual(self.sync(add).data['results'][0]['status'], 201)
+        response = self.sync(add, {'op_id': 'f1', 'type': 'garment.toggle_favorite', 'id': '@l1'})
+        self.assertTrue(response.data['results'][0]['replayed'])
+        self.assertEqual(response.data['results'][1]['status'], 400)
+
+    def test_non_object_data_is_a_per_op_error(self):
+        response = self.sync(
+            {'op_id': 'o1', 'type': 'outfit.create', 'data': 'abc'},
+            {'op_id': 'g1', 'type': 'garment.create', 'data': ['abc']},
+            self.garment_create('g2'),
+        )
+        self.assertEqual([result['status'] for result in response.data['results']], [400, 400, 201])
+
+    def test_non_object_body_is_rejected(self):
+        response = self.client.post('/api/sync/', [self.garment_create('g1')], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_all_or_nothing_accepts_string_flags(self):
+        response = self.sync(self.garment_create('g1'), {'op_id': 'd1', 'type': 'garment.delete', 'id': 0},
+                             all_or_nothing='true')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Garment.objects.filter(owner=self.user).exists())
+
+
+class ChangeStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('watcher', password='secret')
+        self.token = Token.objects.create(user=self.user)
+
+    def ticket(self):
+        return issue_ticket(self.user.id, self.token.key)
+
+    def test_ticket_needs_token_auth(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.post('/api/changes/ticket/').status_code, 403)
+        response = self.client.post('/api/changes/ticket/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(self.token.key, response.json()['ticket'])
+
+    def test_stream_is_refused_under_wsgi(self):
+        response = self.client.get('/api/changes/stream/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 501)
+
+    async def test_stream_accepts_a_ticket(self):
+        response = await self.async_client.get('/api/changes/stream/', {'ticket': self.ticket()})
+        self.assertEqual(response.status_code, 200)
+        chunks = aiter(response.streaming_content)
+        self.assertIn(b'event: ready', await anext(chunks))
+        await chunks.aclose()
+
+    async def test_stream_rejects_tokens_in_the_url(self):
+        response = await self.async_client.get('/api/changes/stream/', {'token': self.token.key})
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(CHANGE_STREAM_TICKET_MAX_AGE=-1)
+    async def test_stream_rejects_expired_tickets(self):
+        response = await self.async_client.get('/api/changes/stream/', {'ticket': self.ticket()})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_stream_rejects_tickets_of_deleted_tokens(self):
+        ticket = self.ticket()
+        await Token.objects.filter(pk=self.token.pk).adelete()
+        response = await self.async_client.get('/api/changes/stream/', {'ticket': ticket})
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(CHANGE_STREAM_KEEPALIVE=0.05, CHANGE_STREAM_REVALIDATE=0)
+    async def test_websocket_closes_when_the_token_is_deleted(self):
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        await inbox.put({'type': 'websocket.connect'})
+        scope = {'type': 'websocket', 'path': '/ws/changes/', 'headers': [],
+                 'query_string': f'ticket={self.ticket()}'.encode()}
+        connection_task = asyncio.ensure_future(websocket_changes(scope, inbox.get, outbox.put))
+        self.assertEqual((await outbox.get())['type'], 'websocket.accept')
+        self.assertIn('ready', (await outbox.get())['text'])
+
+        await Token.objects.filter(pk=self.token.pk).adelete()
+        while True:
+            message = await asyncio.wait_for(outbox.get(), 5)
+            if message['type'] == 'websocket.close':
+                break
+        self.assertEqual(message['code'], 4401)
+        await asyncio.wait_for(connection_task, 5)
+
+
+class PlannerChangeTests(TestCase):
+    def test_planned_outfits_are_published(self):
+        user = User.objects.create_user('plans', password='secret')
+        make_wardrobe(user)
+        client = APIClient()
+        client.force_authenticate(user)
+        today = timezone.localdate()
+        with mock.patch('api.changes._publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/ai/outfit-plan/', {
+                'start_date': today.isoformat(), 'end_date': (today + timezone.timedelta(days=2)).isoformat(),
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        published = {event['id'] for _, event in (call.args for call in publish.call_args_list) if event['type'] == 'outfit'}
+        self.assertEqual(published, set(Outfit.objects.filter(owner=user).values_list('pk', flat=True)))
+        self.assertTrue(published)
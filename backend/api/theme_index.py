@@ -0,0 +1,194 @@
+"""
+Local TF-IDF index for matching free-text themes to garments.
+
+Each user's garments are indexed as sparse term vectors built from name,
+description, material, brand, category, color and season. A theme such as
+"beach wedding" is tokenized and expanded with occasion vocabulary (beach
+-> linen, sandals, ...), then scored against the inverted index in a few
+milliseconds without calling the model.
+
+Indexes live in this process and are built on first use. Garment signals
+keep loaded indexes up to date one garment at a time. Each index is rebuilt
+after THEME_INDEX_TTL seconds so changes made in other processes show up.
+"""
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from django.conf import settings
+from .models import Garment
+
+STOPWORDS = {
+    'a', 'an', 'and', 'at', 'for', 'in', 'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with',
+    'my', 'some', 'something', 'outfit', 'outfits', 'look', 'day', 'wear', 'style',
+}
+
+# Extra terms implied by common occasions, added to the query at lower weight
+THEME_VOCABULARY = {
+    'beach': 'linen swim swimsuit shorts sandals straw cotton tank sunglasses summer',
+    'wedding': 'suit dress blazer silk satin heels tie loafers formal',
+    'formal': 'suit blazer dress shirt tie heels oxford silk trousers',
+    'work': 'blazer shirt trousers chinos loafers oxford blouse skirt',
+    'office': 'blazer shirt trousers chinos loafers oxford blouse skirt',
+    'interview': 'suit blazer shirt trousers oxford loafers',
+    'gym': 'athletic sneakers leggings shorts tank hoodie sport jersey',
+    'exercise': 'athletic sneakers leggings shorts tank hoodie sport jersey',
+    'workout': 'athletic sneakers leggings shorts tank hoodie sport jersey',
+    'party': 'sequin dress heels silk velvet leather skirt',
+    'date': 'dress blouse heels boots leather silk jacket',
+    'casual': 'jeans tee shirt sneakers hoodie denim cotton',
+    'travel': 'sneakers jacket jeans cardigan comfortable',
+    'hiking': 'boots fleece waterproof jacket outdoor shorts',
+    'rain': 'raincoat waterproof boots jacket umbrella',
+    'winter': 'wool coat sweater boots scarf knit puffer',
+    'cold': 'wool coat sweater boots scarf knit puffer',
+    'summer': 'linen shorts sandals tank cotton dress',
+}
+EXPANSION_WEIGHT = 0.5
+
+
+def stem(word):
+    """Very light plural stripping so "dresses" matches "dress" and "shoes" matches "shoe" """
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith('es') and word[-3] in 'sxz' or word.endswith(('ches', 'shes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    return [stem(word) for word in re.findall(r'[a-z0-9]+', str(text or '').lower()) if word not in STOPWORDS]
+
+
+def garment_terms(name, description, material, brand, category, color, season):
+    """Term counts for one garment; the name counts twice"""
+    return Counter(tokenize(f"{name} {name} {description} {material} {brand} {category} {color} {season}"))
+
+
+def query_terms(theme):
+    """Weighted query terms: the theme's own words plus their occasion vocabulary"""
+    weights = defaultdict(float)
+    for word in re.findall(r'[a-z0-9]+', str(theme or '').lower()):
+        if word in STOPWORDS:
+            continue
+        weights[stem(word)] = 1.0
+        for term in tokenize(THEME_VOCABULARY.get(word, '')):
+            weights[term] = max(weights[term], EXPANSION_WEIGHT)
+    return weights
+
+
+class ThemeIndex:
+    """Inverted index of sparse TF-IDF garment vectors that supports add/remove"""
+
+    def __init__(self):
+        self.postings = defaultdict(dict)  # term -> {garment_id: term count}
+        self.doc_terms = {}  # garment_id -> Counter
+        self.doc_norms = {}  # garment_id -> sqrt(number of terms)
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def add(self, garment_id, terms):
+        self.remove(garment_id)
+        self.doc_terms[garment_id] = terms
+        self.doc_norms[garment_id] = math.sqrt(sum(terms.values())) or 1.0
+        for term, count in terms.items():
+            self.postings[term][garment_id] = count
+
+    def remove(self, garment_id):
+        terms = self.doc_terms.pop(garment_id, None)
+        if terms is None:
+            return
+        del self.doc_norms[garment_id]
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(garment_id, None)
+            if not postings:
+                del self.postings[term]
+
+    def score(self, theme):
+        """{garment_id: relevance} for garments sharing at least one term with the theme"""
+        total = len(self.doc_terms)
+        scores = defaultdict(float)
+        for term, weight in query_terms(theme).items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log((1 + total) / (1 + len(postings))) + 1.0
+            for garment_id, count in postings.items():
+                scores[garment_id] += weight * idf * (1.0 + math.log(count)) / self.doc_norms[garment_id]
+        return scores
+
+
+class ThemeIndexRegistry:
+    """Per-user ThemeIndex instances, LRU-bounded and rebuilt after a TTL"""
+
+    FIELDS = ('id', 'name', 'description', 'material', 'brand', 'category__name', 'color', 'season')
+
+    def __init__(self, max_users=1000, ttl=600):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._indexes = OrderedDict()  # user_id -> (ThemeIndex, built_at)
+        self._lock = threading.Lock()
+
+    def _get(self, user_id):
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+                self._indexes.move_to_end(user_id)
+                return entry[0]
+
+        index = ThemeIndex()
+        for garment_id, *fields in Garment.objects.filter(owner_id=user_id).values_list(*self.FIELDS):
+            index.add(garment_id, garment_terms(*fields))
+        with self._lock:
+            self._indexes[user_id] = (index, time.monotonic())
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def relevance(self, user_id, theme):
+        """{garment_id: relevance in [0, 1]} for the user's garments matching the theme"""
+        index = self._get(user_id)
+        with self._lock:
+            scores = index.score(theme)
+        top = max(scores.values(), default=0.0)
+        return {garment_id: score / top for garment_id, score in scores.items()} if top else {}
+
+    def update_garment(self, garment):
+        """Re-index one garment if its owner's index is loaded"""
+        with self._lock:
+            entry = self._indexes.get(garment.owner_id)
+        if entry is None:
+            return
+        terms = garment_terms(
+            garment.name, garment.description, garment.material, garment.brand,
+            garment.category.name if garment.category_id else '', garment.color, garment.season,
+        )
+        with self._lock:
+            entry[0].add(garment.id, terms)
+
+    def remove_garment(self, owner_id, garment_id):
+        with self._lock:
+            entry = self._indexes.get(owner_id)
+            if entry is not None:
+                entry[0].remove(garment_id)
+
+    def forget_user(self, user_id):
+        """Drop a user's index so it is rebuilt on next use (after bulk changes)"""
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+theme_index = ThemeIndexRegistry(
+    max_users=getattr(settings, 'THEME_INDEX_MAX_USERS', 1000),
+    ttl=getattr(settings, 'THEME_INDEX_TTL', 600),
+)
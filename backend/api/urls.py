@@ -20,16 +20,33 @@ api_urlpatterns = [
     path('api/auth/register/', views.register, name='api_register'),
     path('api/auth/login/', views.login_view, name='api_login'),
     path('api/auth/logout/', views.logout_view, name='api_logout'),
+    path('api/auth/rotate-token/', views.rotate_auth_token, name='rotate_auth_token'),
     path('api/auth/user/', views.current_user, name='current_user'),
     path('api/auth/set-password/', views.set_password, name='set_password'),
     path('api/auth/change-password/', views.change_password, name='change_password'),
     path('api/auth/delete-account/', views.delete_account, name='delete_account'),
     
+    # Data export
+    path('api/export/', views.export_wardrobe, name='export_wardrobe'),
+    
+    # Offline edit replay
+    path('api/sync/', views.sync_operations, name='sync_operations'),
+    
+    # Real-time change notifications (WebSocket clients use /ws/changes/, see asgi.py)
+    path('api/changes/stream/', views.change_stream, name='change_stream'),
+    path('api/changes/ticket/', views.change_stream_ticket, name='change_stream_ticket'),
+    
     # Firebase Cloud Messaging
     path('api/save-fcm-token/', views.save_fcm_token, name='save_fcm_token'),
     
     # AI Features
     path('api/ai/outfit-recommendations/', views.ai_outfit_recommendation, name='ai_outfit_recommendation'),
+    path('api/ai/outfit-recommendations/stream/', views.ai_outfit_recommendation_stream, name='ai_outfit_recommendation_stream'),
+    path('api/ai/outfit-recommendations/jobs/<uuid:job_id>/', views.ai_recommendation_job, name='ai_recommendation_job'),
+    path('api/ai/outfit-plan/', views.plan_outfit_week, name='plan_outfit_week'),
+    path('api/ai/outfit-of-the-day/', views.outfit_of_the_day, name='outfit_of_the_day'),
+    path('api/ai/recommendation-stats/', views.ai_recommendation_stats, name='ai_recommendation_stats'),
+    path('api/ai/usage/', views.ai_usage, name='ai_usage'),
     
     # Legacy endpoints
     path('api/hello/', views.hello_world, name='hello_world'),
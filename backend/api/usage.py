@@ -0,0 +1,114 @@
+"""
+Per-user OpenAI token metering and daily budgets.
+
+Every model call writes one LLMUsage row. With a cache shared by all
+workers (REDIS_URL), the tokens a user has spent today are cached and
+incremented as calls are recorded, so checking the budget on each request
+doesn't need a query. With the per-process default cache a counter would
+only see its own worker's calls, so the budget check sums today's ledger
+rows instead (an indexed owner/created_at range). Users over
+LLM_DAILY_TOKEN_BUDGET are served by the local recommender.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .authentication import LOCAL_CACHE_BACKENDS
+from .models import LLMUsage
+
+# Cached daily totals are refreshed from the ledger at least this often (seconds)
+USAGE_CACHE_TTL = 300
+
+
+def start_of_today():
+    return timezone.make_aware(timezone.datetime.combine(timezone.localdate(), timezone.datetime.min.time()))
+
+
+def usage_cache_ttl():
+    """Seconds to cache daily totals; 0 unless the cache is shared by every worker"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    return 0 if backend in LOCAL_CACHE_BACKENDS else USAGE_CACHE_TTL
+
+
+def usage_cache_key(user_id):
+    return f'llm-tokens:{user_id}:{timezone.localdate().isoformat()}'
+
+
+def tokens_used_today(user_id):
+    """Prompt + completion tokens the user has spent since local midnight"""
+    ttl = usage_cache_ttl()
+    key = usage_cache_key(user_id)
+    used = cache.get(key) if ttl else None
+    if used is None:
+        used = LLMUsage.objects.filter(owner_id=user_id, created_at__gte=start_of_today()).aggregate(
+            total=Sum(F('prompt_tokens') + F('completion_tokens'))
+        )['total'] or 0
+        if ttl:
+            cache.add(key, used, ttl)
+    return used
+
+
+def over_budget(user_id):
+    """True when the user has used up LLM_DAILY_TOKEN_BUDGET (0 = no budget)"""
+    budget = getattr(settings, 'LLM_DAILY_TOKEN_BUDGET', 0)
+    return bool(budget) and tokens_used_today(user_id) >= budget
+
+
+def record_usage(user_id, source, model, usage):
+    """Store an OpenAI `usage` object (or None) for the user"""
+    if usage is None:
+        return
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+    LLMUsage.objects.create(
+        owner_id=user_id,
+        source=source,
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+    )
+    if not usage_cache_ttl():
+        return
+    try:
+        cache.incr(usage_cache_key(user_id), prompt_tokens + completion_tokens)
+    except ValueError:
+        # Not cached yet; the next budget check totals the ledger
+        pass
+
+
+def usage_summary(days=7, top=20):
+    """Aggregate usage for the admin endpoint: totals, per day and heaviest users"""
+    rows = LLMUsage.objects.filter(created_at__gte=start_of_today() - timezone.timedelta(days=days - 1))
+    totals = rows.aggregate(
+        calls=Count('id'),
+        prompt_tokens=Sum('prompt_tokens'),
+        completion_tokens=Sum('completion_tokens'),
+        users=Count('owner', distinct=True),
+    )
+    per_day = (
+        rows.annotate(day=TruncDate('created_at'))
+        .values('day')
+        .annotate(calls=Count('id'), prompt_tokens=Sum('prompt_tokens'), completion_tokens=Sum('completion_tokens'))
+        .order_by('day')
+    )
+    top_users = (
+        rows.values('owner_id', 'owner__username')
+        .annotate(calls=Count('id'), tokens=Sum(F('prompt_tokens') + F('completion_tokens')))
+        .order_by('-tokens')[:top]
+    )
+    return {
+        'days': days,
+        'daily_token_budget': getattr(settings, 'LLM_DAILY_TOKEN_BUDGET', 0),
+        'totals': {key: value or 0 for key, value in totals.items()},
+        'per_day': [dict(row, day=row['day'].isoformat()) for row in per_day],
+        'top_users': [
+            {
+                'user_id': row['owner_id'],
+                'username': row['owner__username'],
+                'calls': row['calls'],
+                'tokens': row['tokens'],
+            }
+            for row in top_users
+        ],
+    }
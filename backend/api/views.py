@@ -4,7 +4,11 @@ from django.contrib.auth import login, authenticate
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.db.models import Q, Count
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from asgiref.sync import sync_to_async
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
@@ -15,15 +19,35 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from .authentication import rotate_token, CachedTokenAuthentication
+from .accounts import find_user_by_email, create_user_with_unique_username
+from .recommendations import recommendation_cache, model_flights, generate_recommendations, NoCleanGarmentsError
+from .recommendation_jobs import submit_recommendation_job, wait_for_job, JobLimitError
+from .streaming import stream_recommendations
+from .openai_client import openai_stats
+from .planner import plan_outfits, PlanError, MAX_THEME_LENGTH, MAX_WEATHER_LENGTH
+from .daily_outfits import get_daily_outfit, MAX_WEATHER_LENGTH as DAILY_WEATHER_MAX_LENGTH
+from .usage import usage_summary
+from .direct_uploads import create_upload, attach_upload, DirectUploadError
+from .image_dedup import near_duplicate_groups
+from .account_deletion import request_account_deletion
+from .export import export_lines, zip_chunks, buffered, async_chunks
+from .garment_import import import_garments, GarmentImportError
+from .idempotency import idempotent
+from .offline_sync import apply_operations, SyncError, SyncConflict
+from .changes import authenticate as authenticate_stream, issue_ticket as issue_stream_ticket, sse_changes
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 import os
 import json
-from openai import OpenAI
+import math
 from .models import Category, Garment, Outfit, LaundryItem, WearHistory, EmailVerification
 from .serializers import (
-    CategorySerializer, GarmentSerializer, OutfitSerializer,
-    UserSerializer, RegisterSerializer, LoginSerializer
+    CategorySerializer, GarmentSerializer, GarmentSummarySerializer, OutfitSerializer,
+    UserSerializer, RegisterSerializer, LoginSerializer, RecommendationRequestSerializer
 )
 from .forms import (
     GarmentForm, OutfitForm, CategoryForm, LaundryForm, 
@@ -244,18 +268,14 @@ def send_verification_code(request):
         return Response({'error': 'Email is required'}, status=status.HTTP_400_BAD_REQUEST)
     
     # Check if email already exists
-    if User.objects.filter(email=email).exists():
+    user = find_user_by_email(email)
+    if user:
         # Check if it's a Google user without a password
-        try:
-            user = User.objects.get(email=email)
-            # Check if user has a usable password
-            if not user.has_usable_password():
-                return Response({
-                    'error': 'This email is registered with Google. Please use Google Sign-In.',
-                    'suggestion': 'google_signin'
-                }, status=status.HTTP_400_BAD_REQUEST)
-        except User.DoesNotExist:
-            pass
+        if not user.has_usable_password():
+            return Response({
+                'error': 'This email is registered with Google. Please use Google Sign-In.',
+                'suggestion': 'google_signin'
+            }, status=status.HTTP_400_BAD_REQUEST)
         return Response({'error': 'Email already registered'}, status=status.HTTP_400_BAD_REQUEST)
     
     # Generate verification code
@@ -469,30 +489,21 @@ def google_auth(request):
             return Response({'error': 'Email or Google ID not found'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Check if user exists with this email
-        try:
-            user = User.objects.get(email=email)
+        user = find_user_by_email(email)
+        if user:
             print(f"Found existing user: {user.username} ({email})")
-        except User.DoesNotExist:
+        else:
             print(f"Creating new user for email: {email}")
-            # Create new user
-            username = email.split('@')[0]
-            # Make username unique if it already exists
-            base_username = username
-            counter = 1
-            while User.objects.filter(username=username).exists():
-                username = f"{base_username}{counter}"
-                counter += 1
-            
-            user = User.objects.create_user(
-                username=username,
+            # Create new user, suffixing the email prefix if the username is taken
+            user = create_user_with_unique_username(
+                email.split('@')[0],
                 email=email,
                 first_name=first_name,
                 last_name=last_name
             )
             # Don't set unusable password - allow users to set password later if they want
             # This allows Google users to also login with email/password
-            print(f"Created new user via Google OAuth: {username} ({email})")
-            user.save()
+            print(f"Created new user via Google OAuth: {user.username} ({email})")
         
         # Get or create social account
         social_account, created = SocialAccount.objects.get_or_create(
@@ -569,8 +580,8 @@ def login_view(request):
         
         if '@' in username_or_email:
             # It's an email
-            try:
-                user_obj = User.objects.get(email=username_or_email)
+            user_obj = find_user_by_email(username_or_email)
+            if user_obj:
                 # Check if user has a usable password (not Google-only account)
                 if not user_obj.has_usable_password():
                     print(f"User {username_or_email} tried to login with password but account is Google-only")
@@ -580,9 +591,8 @@ def login_view(request):
                     }, status=status.HTTP_401_UNAUTHORIZED)
                 
                 user = authenticate(username=user_obj.username, password=password)
-            except User.DoesNotExist:
+            else:
                 print(f"No user found with email: {username_or_email}")
-                pass
         else:
             # It's a username
             try:
@@ -620,11 +630,24 @@ def login_view(request):
 def logout_view(request):
     """Logout user by deleting token"""
     try:
-        request.user.auth_token.delete()
+        # request.auth is the token resolved during authentication; deleting it
+        # also evicts it from the auth cache (see api/signals.py)
+        token = request.auth if isinstance(request.auth, Token) else request.user.auth_token
+        token.delete()
         return Response({'message': 'Logout successful'})
     except:
         return Response({'error': 'Something went wrong'}, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def rotate_auth_token(request):
+    """Issue a new auth token and revoke the old one"""
+    token = rotate_token(request.user)
+    return Response({
+        'token': token.key,
+        'message': 'Token rotated successfully'
+    })
+
 @api_view(['GET', 'PATCH'])
 @permission_classes([IsAuthenticated])
 def current_user(request):
@@ -780,13 +803,13 @@ def delete_account(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Delete user account (will cascade delete related data)
-    username = user.username
-    user.delete()
+    # Deactivate now; wardrobe data and photos are deleted in the background
+    deletion = request_account_deletion(user)
     
     return Response({
-        'message': f'Account {username} has been permanently deleted'
-    }, status=status.HTTP_200_OK)
+        'message': f'Account {user.username} has been deactivated and will be permanently deleted shortly',
+        'deletion_id': deletion.id,
+    }, status=status.HTTP_202_ACCEPTED)
 
 @api_view(['GET'])
 def hello_world(request):
@@ -828,6 +851,19 @@ class GarmentViewSet(ModelViewSet):
         """Set owner when creating garment"""
         serializer.save(owner=self.request.user)
     
+    # Writes honour Idempotency-Key so retried requests don't apply twice
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+    
+    @idempotent
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+    
+    @idempotent
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+    
     @action(detail=False, methods=['get'])
     def by_category(self, request):
         category_id = request.query_params.get('category_id')
@@ -838,6 +874,78 @@ class GarmentViewSet(ModelViewSet):
         return Response({'error': 'category_id parameter required'}, 
                        status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """Fetch several garments in one query: ?ids=1,2,3 (returned in the order asked)"""
+        try:
+            ids = list(dict.fromkeys(int(value) for value in request.query_params.get('ids', '').split(',') if value.strip()))
+        except ValueError:
+            return Response({'error': 'ids must be a comma-separated list of integers'},
+                           status=status.HTTP_400_BAD_REQUEST)
+        if not ids:
+            return Response({'error': 'ids parameter required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > settings.GARMENT_BATCH_LIMIT:
+            return Response({'error': f'At most {settings.GARMENT_BATCH_LIMIT} ids per request'},
+                           status=status.HTTP_400_BAD_REQUEST)
+        
+        garments = self.get_queryset().filter(id__in=ids).select_related('category', 'owner')
+        by_id = {garment['id']: garment for garment in self.get_serializer(garments, many=True).data}
+        return Response({
+            'garments': [by_id[garment_id] for garment_id in ids if garment_id in by_id],
+            'missing': [garment_id for garment_id in ids if garment_id not in by_id],
+        })
+    
+    @action(detail=False, methods=['post'], url_path='upload-url')
+    def upload_url(self, request):
+        """Presigned POST for uploading a photo straight to S3: {"content_type": "image/jpeg", "size": 123456}"""
+        size = request.data.get('size')
+        try:
+            upload = create_upload(request.user.id, request.data.get('content_type'),
+                                   int(size) if size not in (None, '') else None)
+        except ValueError:
+            return Response({'error': 'size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        except DirectUploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(upload)
+    
+    @action(detail=True, methods=['post'], url_path='confirm-upload')
+    def confirm_upload(self, request, pk=None):
+        """Attach a key uploaded with upload-url as the garment's image"""
+        garment = self.get_object()
+        try:
+            attach_upload(garment, request.data.get('key'))
+        except DirectUploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(garment)
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_file(self, request):
+        """Create garments from a CSV/NDJSON upload ("file"), with photos from an optional "images" zip.
+
+        Pass "dry_run": true to validate without saving. Rows that fail
+        validation are skipped and listed in the report; rows whose photo
+        is missing are imported without it and listed as warnings.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+        images = request.FILES.get('images')
+        try:
+            report = import_garments(
+                request.user, upload, upload.name, images=images,
+                dry_run=is_truthy(request.data.get('dry_run')),
+            )
+        except GarmentImportError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report, status=status.HTTP_200_OK if report['dry_run'] or not report['created']
+                        else status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'])
+    def duplicates(self, request):
+        """Groups of garments whose photos are identical or look nearly the same"""
+        return Response({'groups': near_duplicate_groups(request.user.id)})
+    
     @action(detail=False, methods=['get'])
     def favorites(self, request):
         favorites = self.get_queryset().filter(is_favorite=True)
@@ -845,6 +953,7 @@ class GarmentViewSet(ModelViewSet):
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
+    @idempotent
     def toggle_favorite(self, request, pk=None):
         """Toggle favorite status"""
         garment = self.get_object()
@@ -854,6 +963,7 @@ class GarmentViewSet(ModelViewSet):
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
+    @idempotent
     def wear(self, request, pk=None):
         """Mark garment as worn"""
         garment = self.get_object()
@@ -877,10 +987,23 @@ class OutfitViewSet(ModelViewSet):
     def perform_create(self, serializer):
         """Set owner when creating outfit"""
         serializer.save(owner=self.request.user)
+    
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+    
+    @idempotent
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+    
+    @idempotent
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
 
 # Legacy endpoint for compatibility
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def garments(request):
     """Legacy garments endpoint for backward compatibility (requires authentication)"""
     if request.method == 'GET':
@@ -895,130 +1018,319 @@ def garments(request):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def with_garments(result, request):
+    """Copy of a recommendation result with a {id: garment summary} dictionary for its outfits"""
+    garment_ids = {
+        garment_id
+        for outfit in result.get('outfits', [])
+        for garment_id in outfit.get('garment_ids', [])
+    }
+    garments = Garment.objects.filter(owner=request.user, id__in=garment_ids).select_related('category')
+    summaries = GarmentSummarySerializer(garments, many=True, context={'request': request}).data
+    return dict(result, garments={str(garment['id']): garment for garment in summaries})
+
+def is_truthy(value):
+    return str(value or '').lower() in ('1', 'true')
+
 # AI Outfit Recommendation Endpoint
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def ai_outfit_recommendation(request):
-    """Generate AI-powered outfit recommendations based on occasion/theme"""
+    """Generate AI-powered outfit recommendations based on occasion/theme.
+
+    Pass "async": true to run in job mode: the request returns a job ID right
+    away and the result is fetched from ai_recommendation_job. Pass
+    "engine": "local" to skip the model and use the local scoring engine
+    ("seed" makes its picks repeatable). Pass "include_garments": true to
+    get a garment dictionary alongside the outfits.
+    """
+    serializer = RecommendationRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    theme = serializer.validated_data['theme']
+    weather = serializer.validated_data['weather']
+    
+    if is_truthy(request.data.get('async')):
+        try:
+            job = submit_recommendation_job(request.user, theme, weather)
+        except JobLimitError as e:
+            return Response({'error': str(e)}, status=e.status_code, headers={'Retry-After': '5'})
+        return Response({
+            'job_id': str(job.id),
+            'status': job.status,
+            'poll_url': request.build_absolute_uri(f'/api/ai/outfit-recommendations/jobs/{job.id}/')
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    engine = request.data.get('engine')
+    if engine not in (None, '', 'ai', 'local'):
+        return Response({'error': 'engine must be "ai" or "local"'}, status=status.HTTP_400_BAD_REQUEST)
     try:
-        theme = request.data.get('theme', 'casual day')
-        weather = request.data.get('weather', 'moderate')
-        
-        # Get user's wardrobe
-        garments = Garment.objects.filter(owner=request.user, status='clean')
-        
-        if garments.count() == 0:
-            return Response({
-                'error': 'No clean garments available in your wardrobe'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Build wardrobe description for AI
-        wardrobe_items = []
-        for g in garments:
-            wardrobe_items.append({
-                'id': g.id,
-                'name': g.name,
-                'category': g.category.name if g.category else 'Uncategorized',
-                'color': g.color or 'unknown',
-                'size': g.size or 'unknown',
-                'brand': g.brand or 'unknown'
-            })
-        
-        # Use OpenAI API for recommendations (fallback to rule-based if no API key)
-        api_key = os.getenv('OPENAI_API_KEY')
-        
-        if api_key:
-            try:
-                client = OpenAI(api_key=api_key)
-                prompt = f"""You are a fashion stylist assistant. Based on the following wardrobe items, recommend 3 complete outfits for the theme: "{theme}" with weather: "{weather}".
-
-Wardrobe items:
-{json.dumps(wardrobe_items, indent=2)}
-
-IMPORTANT RULES:
-- Pick ONLY ONE item from each category per outfit
-- Do not repeat the same category multiple times in one outfit
-- Create balanced, complete outfits
-
-For each outfit, provide:
-1. A creative outfit name
-2. List of garment IDs to use (ONE per category only)
-3. Brief reasoning why this combination works
-4. Style tip
-
-Return JSON format:
-{{
-  "outfits": [
-    {{
-      "name": "outfit name",
-      "garment_ids": [1, 2, 3],
-      "reasoning": "why it works",
-      "style_tip": "additional tip"
-    }}
-  ]
-}}"""
-                
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "You are a professional fashion stylist who creates practical, stylish outfit recommendations."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.8,
-                    response_format={ "type": "json_object" }
-                )
-                
-                recommendations = json.loads(response.choices[0].message.content)
-                return Response(recommendations)
-                
-            except Exception as e:
-                print(f"OpenAI API error: {e}")
-                # Fall through to rule-based recommendation
-        
-        # Rule-based fallback recommendation
-        import random
-        
-        # Group garments by category
-        categories = {}
-        for g in garments:
-            cat_name = g.category.name if g.category else 'Uncategorized'
-            if cat_name not in categories:
-                categories[cat_name] = []
-            categories[cat_name].append(g)
-        
-        recommendations = {
-            "outfits": []
-        }
-        
-        # Generate 3 outfit combinations, picking ONE item from each category
-        for i in range(3):
-            outfit = {
-                "name": f"{theme.title()} Look {i+1}",
-                "garment_ids": [],
-                "reasoning": f"A curated combination perfect for {theme}",
-                "style_tip": "Each outfit uses one item per category for a balanced look!"
-            }
-            
-            # Pick ONE random item from each category
-            for cat_name, items in categories.items():
-                if items:
-                    chosen = random.choice(items)
-                    outfit["garment_ids"].append(chosen.id)
-            
-            if outfit["garment_ids"]:
-                recommendations["outfits"].append(outfit)
-        
-        if not recommendations["outfits"]:
-            recommendations["outfits"].append({
-                "name": f"Simple {theme.title()} Outfit",
-                "garment_ids": [g.id for g in garments[:3]],
-                "reasoning": "A basic combination from your available items",
-                "style_tip": "Mix and match to find your perfect look!"
-            })
-        
-        return Response(recommendations)
-        
+        seed = int(request.data['seed']) if request.data.get('seed') not in (None, '') else None
+    except (TypeError, ValueError):
+        return Response({'error': 'seed must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        result = generate_recommendations(request.user, theme, weather, engine=engine, seed=seed)
+        if is_truthy(request.data.get('include_garments')):
+            result = with_garments(result, request)
+        return Response(result)
+    except NoCleanGarmentsError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({
             'error': f'Failed to generate recommendations: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+async def ai_outfit_recommendation_stream(request):
+    """Stream outfit recommendations as Server-Sent Events, one event per outfit.
+
+    Plain async view (DRF views are sync) so it runs natively under the ASGI
+    application. Authenticates with the same token scheme as the REST API;
+    session cookies are not accepted, since the view is exempt from CSRF.
+    """
+    try:
+        auth = await sync_to_async(CachedTokenAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': str(e.detail)}, status=401)
+    if auth is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    user = auth[0]
+    
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'JSON body must be an object'}, status=400)
+    else:
+        data = request.GET
+    theme = data.get('theme') or 'casual day'
+    weather = data.get('weather') or 'moderate'
+    
+    response = StreamingHttpResponse(
+        stream_recommendations(user, theme, weather),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering so events arrive immediately
+    return response
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def sync_operations(request):
+    """Apply edits queued while offline: {"operations": [{"op_id", "type", ...}], "all_or_nothing": false}
+
+    Operations run in order in one transaction and get one result each.
+    Resent op_ids return their stored result. With all_or_nothing, any
+    failed operation rolls the whole queue back (409).
+    """
+    if not isinstance(request.data, dict):
+        return Response({'error': 'Body must be an object with an "operations" list'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        results, committed = apply_operations(
+            request, request.data.get('operations'),
+            all_or_nothing=is_truthy(request.data.get('all_or_nothing')),
+        )
+    except SyncError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except SyncConflict as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    return Response({'committed': committed, 'results': results},
+                    status=status.HTTP_200_OK if committed else status.HTTP_409_CONFLICT)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def change_stream_ticket(request):
+    """Short-lived ?ticket= for change streams opened by clients that can't send the token header"""
+    if not isinstance(request.auth, Token):
+        return Response({'error': 'Tickets are only issued to token-authenticated requests'},
+                        status=status.HTTP_403_FORBIDDEN)
+    return Response({
+        'ticket': issue_stream_ticket(request.user.id, request.auth.key),
+        'expires_in': settings.CHANGE_STREAM_TICKET_MAX_AGE,
+    })
+
+@require_http_methods(['GET'])
+async def change_stream(request):
+    """Server-Sent Events with {"type", "id", "version"} for each change to the user's wardrobe.
+
+    Pass a ticket from change_stream_ticket as ?ticket=... when the client
+    can't set headers (EventSource). Needs the ASGI application; see
+    api/changes.py.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI each open stream would hold a worker for good
+        return JsonResponse({'detail': 'The change stream needs the ASGI server (garmently_backend.asgi).'},
+                            status=501)
+    credentials = await authenticate_stream(request.headers, request.META.get('QUERY_STRING', ''))
+    if credentials is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    response = StreamingHttpResponse(sse_changes(*credentials), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_wardrobe(request):
+    """Download the whole wardrobe as NDJSON, or ?mode=zip for the NDJSON plus garment photos.
+
+    The response is streamed as it is generated, so memory use doesn't grow
+    with the size of the wardrobe.
+    """
+    mode = request.query_params.get('mode', 'ndjson')
+    if mode not in ('ndjson', 'zip'):
+        return Response({'error': 'mode must be "ndjson" or "zip"'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if mode == 'zip':
+        chunks, content_type = zip_chunks(request.user), 'application/zip'
+    else:
+        chunks, content_type = buffered(export_lines(request.user)), 'application/x-ndjson'
+    if isinstance(request._request, ASGIRequest):
+        chunks = async_chunks(chunks)
+    
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    filename = f'garmently-export-{timezone.localdate().isoformat()}.{mode}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def ai_recommendation_job(request, job_id):
+    """Poll a recommendation job; ?wait=N long-polls up to N seconds for it to finish.
+
+    The wait is capped at RECOMMENDATION_JOB_MAX_WAIT, or at the (by default
+    zero) RECOMMENDATION_JOB_WSGI_MAX_WAIT when not served over ASGI.
+    ?include_garments=1 adds a garment dictionary to a finished result.
+    """
+    try:
+        wait = float(request.query_params.get('wait', 0))
+    except ValueError:
+        wait = None
+    if wait is None or not math.isfinite(wait) or wait < 0:
+        return Response({'error': 'wait must be a non-negative number of seconds'}, status=status.HTTP_400_BAD_REQUEST)
+    if isinstance(request._request, ASGIRequest):
+        wait = min(wait, settings.RECOMMENDATION_JOB_MAX_WAIT)
+    else:
+        wait = min(wait, settings.RECOMMENDATION_JOB_WSGI_MAX_WAIT)
+    
+    job = wait_for_job(job_id, request.user, wait)
+    if job is None:
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    data = {'job_id': str(job.id), 'status': job.status}
+    if job.status == 'done':
+        data['result'] = job.result
+        if is_truthy(request.query_params.get('include_garments')):
+            data['result'] = with_garments(job.result, request)
+    elif job.status == 'failed':
+        data['error'] = job.error
+    return Response(data)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def plan_outfit_week(request):
+    """Plan an outfit for each day in a date range with the local scoring engine.
+
+    Body: start_date and end_date (YYYY-MM-DD), a default "theme" and
+    "weather", optional per-day "themes" and "weathers" (either lists in day
+    order or objects keyed by date), "laundry_gap" in days and "seed".
+    Planned outfits are stored with their date and replace an earlier plan
+    for the same days; days with an outfit you created are left as they are.
+    """
+    try:
+        start_date = parse_date(str(request.data.get('start_date', '')))
+        end_date = parse_date(str(request.data.get('end_date', '')))
+    except ValueError:
+        # Well formed but not a real date, e.g. 2024-02-30
+        start_date = end_date = None
+    if not start_date or not end_date:
+        return Response({'error': 'start_date and end_date are required (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+    if end_date < start_date:
+        return Response({'error': 'end_date must not be before start_date'}, status=status.HTTP_400_BAD_REQUEST)
+    day_count = (end_date - start_date).days + 1
+    if day_count > settings.PLANNER_MAX_DAYS:
+        return Response({'error': f'You can plan at most {settings.PLANNER_MAX_DAYS} days at a time'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    dates = [start_date + timezone.timedelta(days=i) for i in range(day_count)]
+    
+    def per_day(values, default):
+        """Expand a list (day order) or {date: value} object into {date: value}"""
+        if isinstance(values, list):
+            return {date: str(values[i]) if i < len(values) and values[i] else default for i, date in enumerate(dates)}
+        if isinstance(values, dict):
+            return {date: str(values.get(date.isoformat()) or default) for date in dates}
+        return {date: default for date in dates}
+    
+    themes = per_day(request.data.get('themes'), str(request.data.get('theme') or 'casual day'))
+    weathers = per_day(request.data.get('weathers'), str(request.data.get('weather') or 'moderate'))
+    if any(len(theme.title()) > MAX_THEME_LENGTH for theme in themes.values()):
+        return Response({'error': f'Themes must be at most {MAX_THEME_LENGTH} characters'}, status=status.HTTP_400_BAD_REQUEST)
+    if any(len(weather) > MAX_WEATHER_LENGTH for weather in weathers.values()):
+        return Response({'error': f'Weather must be at most {MAX_WEATHER_LENGTH} characters'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        laundry_gap = request.data.get('laundry_gap')
+        laundry_gap = int(laundry_gap) if laundry_gap not in (None, '') else None
+        seed = int(request.data['seed']) if request.data.get('seed') not in (None, '') else None
+    except (TypeError, ValueError):
+        return Response({'error': 'laundry_gap and seed must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    if laundry_gap is not None and not 0 <= laundry_gap <= 30:
+        return Response({'error': 'laundry_gap must be between 0 and 30 days'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        outfits, empty_dates, kept_dates = plan_outfits(
+            request.user, start_date, end_date, themes, weathers, laundry_gap=laundry_gap, seed=seed
+        )
+    except PlanError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    outfits = Outfit.objects.filter(id__in=[outfit.id for outfit in outfits]).select_related('owner').prefetch_related('garments__category').order_by('date')
+    return Response({
+        'outfits': OutfitSerializer(outfits, many=True, context={'request': request}).data,
+        'unplanned_dates': [date.isoformat() for date in empty_dates],
+        'kept_dates': [date.isoformat() for date in kept_dates],
+    }, status=status.HTTP_201_CREATED)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def outfit_of_the_day(request):
+    """Today's outfit of the day, precomputed overnight (computed now if missing).
+
+    ?weather= recomputes it when the stored outfit was made for other weather.
+    """
+    weather = request.query_params.get('weather', '').strip()
+    if len(weather) > DAILY_WEATHER_MAX_LENGTH:
+        return Response({'error': f'weather must be at most {DAILY_WEATHER_MAX_LENGTH} characters'}, status=status.HTTP_400_BAD_REQUEST)
+    daily_outfit, precomputed = get_daily_outfit(request.user, timezone.localdate(), weather)
+    if daily_outfit is None:
+        return Response({'error': 'No clean garments available in your wardrobe'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(dict(
+        daily_outfit.result,
+        date=daily_outfit.date.isoformat(),
+        weather=daily_outfit.weather,
+        precomputed=precomputed,
+    ))
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def ai_usage(request):
+    """OpenAI token usage over the last ?days= days (default 7): totals, per day and top users"""
+    try:
+        days = min(max(int(request.query_params.get('days', 7)), 1), 90)
+    except ValueError:
+        days = 7
+    return Response(usage_summary(days))
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def ai_recommendation_stats(request):
+    """Recommendation cache hit rate, coalesced requests and OpenAI breaker state (this process)"""
+    return Response({
+        'cache': recommendation_cache.stats(),
+        'coalescing': model_flights.stats(),
+        'openai': openai_stats(),
+    })
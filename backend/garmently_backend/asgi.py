@@ -3,6 +3,15 @@ ASGI config for garmently_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Async views such as the SSE recommendation stream
+(/api/ai/outfit-recommendations/stream/) run natively here, so an open
+stream waits on OpenAI without holding a worker thread. The same goes for
+change notifications: /api/changes/stream/ (SSE) and the /ws/changes/
+WebSocket, which Django doesn't route itself and is dispatched below (see
+api/changes.py). Serve it with e.g.:
+
+    gunicorn garmently_backend.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -13,4 +22,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'garmently_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from api.changes import websocket_changes  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'] == '/ws/changes/':
+            return await websocket_changes(scope, receive, send)
+        await receive()
+        return await send({'type': 'websocket.close', 'code': 4404})
+    return await django_application(scope, receive, send)
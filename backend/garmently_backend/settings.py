@@ -184,7 +184,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -195,6 +195,129 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Auth token cache lifetime (in seconds; only used with a shared cache, see REDIS_URL
+# below) and optional token expiry (in hours, 0 = never)
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', '300'))
+AUTH_TOKEN_EXPIRY_HOURS = int(os.getenv('AUTH_TOKEN_EXPIRY_HOURS', '0'))
+
+# AI recommendation result cache (per process): max entries, TTL in seconds,
+# and how many alternate result sets to keep per wardrobe/theme/weather
+RECOMMENDATION_CACHE_SIZE = int(os.getenv('RECOMMENDATION_CACHE_SIZE', '512'))
+RECOMMENDATION_CACHE_TTL = int(os.getenv('RECOMMENDATION_CACHE_TTL', '3600'))
+RECOMMENDATION_CACHE_POOL_SIZE = int(os.getenv('RECOMMENDATION_CACHE_POOL_SIZE', '3'))
+
+# OpenAI client: per-call deadline and connect timeout (in seconds), retries,
+# and circuit breaker (consecutive failures to open, seconds before a probe)
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '20'))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '3'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '0'))
+OPENAI_BREAKER_FAILURES = int(os.getenv('OPENAI_BREAKER_FAILURES', '5'))
+OPENAI_BREAKER_RESET = float(os.getenv('OPENAI_BREAKER_RESET', '30'))
+
+# Default recommendation engine: 'ai' (OpenAI with local fallback) or 'local' (scoring engine only)
+RECOMMENDATION_ENGINE = os.getenv('RECOMMENDATION_ENGINE', 'ai')
+
+# Token budget for the wardrobe table in AI recommendation prompts
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '3000'))
+
+# Background recommendation jobs: worker threads per process, max queued jobs
+# per process, max unfinished jobs per user, and longest allowed long-poll (seconds)
+RECOMMENDATION_JOB_WORKERS = int(os.getenv('RECOMMENDATION_JOB_WORKERS', '4'))
+RECOMMENDATION_JOB_QUEUE_LIMIT = int(os.getenv('RECOMMENDATION_JOB_QUEUE_LIMIT', '32'))
+RECOMMENDATION_JOB_USER_LIMIT = int(os.getenv('RECOMMENDATION_JOB_USER_LIMIT', '2'))
+RECOMMENDATION_JOB_MAX_WAIT = float(os.getenv('RECOMMENDATION_JOB_MAX_WAIT', '15'))
+# Long-poll cap under WSGI, where each waiting poll holds one of the few
+# worker processes; 0 makes polls return immediately
+RECOMMENDATION_JOB_WSGI_MAX_WAIT = float(os.getenv('RECOMMENDATION_JOB_WSGI_MAX_WAIT', '0'))
+
+# Image variants (thumbnails/WebP): render in background threads after upload
+# (set IMAGE_VARIANTS_ASYNC=false to render before the response), and thread count
+IMAGE_VARIANTS_ASYNC = os.getenv('IMAGE_VARIANTS_ASYNC', 'true').lower() == 'true'
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', '2'))
+
+# Most garment IDs accepted by /api/garments-api/batch/
+GARMENT_BATCH_LIMIT = int(os.getenv('GARMENT_BATCH_LIMIT', '200'))
+
+# Direct-to-S3 photo uploads (/api/garments-api/upload-url/): largest file
+# accepted by the presigned POST policy, and seconds the policy stays valid
+DIRECT_UPLOAD_MAX_BYTES = int(os.getenv('DIRECT_UPLOAD_MAX_BYTES', str(15 * 1024 * 1024)))
+DIRECT_UPLOAD_EXPIRY = int(os.getenv('DIRECT_UPLOAD_EXPIRY', '300'))
+
+# Hash uploads as they stream in so garment photos are stored once per content (api/image_dedup.py)
+FILE_UPLOAD_HANDLERS = [
+    'api.image_dedup.HashingMemoryFileUploadHandler',
+    'api.image_dedup.HashingTemporaryFileUploadHandler',
+]
+
+# Perceptual hashes of garment photos, and how many of their 64 bits may differ
+# for two garments to be flagged as near duplicates
+IMAGE_PHASH_ENABLED = os.getenv('IMAGE_PHASH_ENABLED', 'true').lower() == 'true'
+IMAGE_PHASH_DISTANCE = int(os.getenv('IMAGE_PHASH_DISTANCE', '6'))
+
+# Account deletion runs in a background thread (ACCOUNT_DELETION_ASYNC=false runs it
+# in the request), deleting this many rows per transaction
+ACCOUNT_DELETION_ASYNC = os.getenv('ACCOUNT_DELETION_ASYNC', 'true').lower() == 'true'
+ACCOUNT_DELETION_CHUNK_SIZE = int(os.getenv('ACCOUNT_DELETION_CHUNK_SIZE', '500'))
+
+# Most rows read from one garment import file, and the largest uncompressed
+# photo and whole zip accepted (checked against the zip's own listing)
+GARMENT_IMPORT_MAX_ROWS = int(os.getenv('GARMENT_IMPORT_MAX_ROWS', '20000'))
+GARMENT_IMPORT_MAX_PHOTO_BYTES = int(os.getenv('GARMENT_IMPORT_MAX_PHOTO_BYTES', str(15 * 1024 * 1024)))
+GARMENT_IMPORT_MAX_ZIP_BYTES = int(os.getenv('GARMENT_IMPORT_MAX_ZIP_BYTES', str(2 * 1024 * 1024 * 1024)))
+
+# How long a stored Idempotency-Key response is replayed (hours), and after how
+# many seconds a key whose first request never finished can be claimed again
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+IDEMPOTENCY_PENDING_TIMEOUT = int(os.getenv('IDEMPOTENCY_PENDING_TIMEOUT', '60'))
+
+# Most queued offline edits accepted by one /api/sync/ request
+OFFLINE_SYNC_MAX_OPERATIONS = int(os.getenv('OFFLINE_SYNC_MAX_OPERATIONS', '500'))
+
+# Change notifications (api/changes.py): broker URL for sharing events between
+# worker processes (Redis; empty = in-process only), seconds between keepalives
+# on idle streams, events queued per connection before it is told to resync,
+# seconds a stream ticket stays valid, and seconds between checks that an open
+# stream's token is still valid
+CHANGE_BROKER_URL = os.getenv('CHANGE_BROKER_URL', os.getenv('REDIS_URL', ''))
+CHANGE_STREAM_KEEPALIVE = int(os.getenv('CHANGE_STREAM_KEEPALIVE', '15'))
+CHANGE_STREAM_QUEUE_SIZE = int(os.getenv('CHANGE_STREAM_QUEUE_SIZE', '100'))
+CHANGE_STREAM_TICKET_MAX_AGE = int(os.getenv('CHANGE_STREAM_TICKET_MAX_AGE', '60'))
+CHANGE_STREAM_REVALIDATE = int(os.getenv('CHANGE_STREAM_REVALIDATE', '60'))
+
+# WEB_CONCURRENCY is the server's worker count (see Procfile); without a shared
+# broker each worker's streams only hear about changes made in that worker
+if not CHANGE_BROKER_URL and int(os.getenv('WEB_CONCURRENCY', '1')) > 1:
+    print("WARNING: change notifications use the in-process broker with "
+          f"{os.getenv('WEB_CONCURRENCY')} workers; set CHANGE_BROKER_URL or REDIS_URL")
+
+# Daily OpenAI token budget per user (prompt + completion, 0 = unlimited);
+# users over it get local recommendations until local midnight
+LLM_DAILY_TOKEN_BUDGET = int(os.getenv('LLM_DAILY_TOKEN_BUDGET', '50000'))
+
+# Theme index (per process): most users kept in memory, and seconds before
+# an index is rebuilt to pick up garment edits made by other processes
+THEME_INDEX_MAX_USERS = int(os.getenv('THEME_INDEX_MAX_USERS', '1000'))
+THEME_INDEX_TTL = int(os.getenv('THEME_INDEX_TTL', '600'))
+
+# Outfit planner: default days before a planned garment may be worn again,
+# and the longest range that can be planned in one request
+PLANNER_LAUNDRY_GAP_DAYS = int(os.getenv('PLANNER_LAUNDRY_GAP_DAYS', '3'))
+PLANNER_MAX_DAYS = int(os.getenv('PLANNER_MAX_DAYS', '14'))
+
+# Longest an identical concurrent AI recommendation request waits on the
+# in-flight one (in seconds) before calling OpenAI itself
+RECOMMENDATION_COALESCE_TIMEOUT = float(os.getenv('RECOMMENDATION_COALESCE_TIMEOUT', '30'))
+
+# Shared cache: set REDIS_URL so locks and results are shared between worker
+# processes (request coalescing); otherwise each process has its own memory cache
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
 # CORS Configuration - Allow frontend to access API
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -238,6 +361,7 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'idempotency-key',
     'origin',
     'user-agent',
     'x-csrftoken',
@@ -251,6 +375,8 @@ AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME', 'garmently-media')
 AWS_S3_REGION_NAME = os.getenv('AWS_S3_REGION_NAME', 'us-east-1')
+# Optional S3-compatible endpoint (MinIO, moto server) instead of AWS
+AWS_S3_ENDPOINT_URL = os.getenv('AWS_S3_ENDPOINT_URL') or None
 S3_ENABLED_FLAG = os.getenv('ENABLE_S3', 'true').lower() == 'true'
 
 # Use S3 storage only when explicitly enabled and credentials are present
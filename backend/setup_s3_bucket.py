@@ -136,7 +136,7 @@ def setup_s3_bucket():
     print("  • Accept requests from your frontend (localhost:3000)")
     print("  • Not use ACLs (using bucket policy instead)")
     print("\nNext steps:")
-    print("  1. Run: python sync_images_to_s3.py")
+    print("  1. Run: python manage.py sync_images_to_s3")
     print("  2. Refresh your browser")
     print("  3. Upload new images - they'll automatically go to S3")
 